@@ -0,0 +1,201 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for graphs stored as compressed sparse rows."""
+
+# Imports
+import networkx as nx
+import numpy as np
+import scipy as sp
+import scipy.sparse
+
+
+class ArrayGraph(object):
+    """A graph stored as the csr arrays of its adjacency matrix.
+
+    Node i of the graph has id node_ids[i] and neighbors
+    indices[indptr[i]:indptr[i + 1]], with edge weights held in `data`.
+    The adjacency matrix is built once and reused by every analysis,
+    and networkx graphs are only built on request.
+
+    Parameters
+    ----------
+    indptr, indices : Numpy Array
+        Row pointers and column indices of the adjacency matrix.
+    data : Numpy Array
+        Edge weights (default all 1).
+    node_ids : List
+        Node ids in row order (default 0..n-1).
+    """
+
+    __slots__ = (
+        'indptr',
+        'indices',
+        'data',
+        'node_ids',
+        'node_attributes',
+        '_adjacency',
+        '_graph'
+    )
+
+    def __init__(self, indptr, indices, data=None, node_ids=None):
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        if data is None:
+            data = np.ones(len(self.indices))
+        self.data = np.asarray(data, dtype=np.float64)
+        if node_ids is None:
+            node_ids = np.arange(len(self.indptr) - 1)
+        self.node_ids = _id_array(node_ids)
+        self.node_attributes = {}
+        self._adjacency = None
+        self._graph = None
+
+    @classmethod
+    def from_adjacency(cls, adj, node_ids=None):
+        """Create a graph from an adjacency matrix.
+
+        Parameters
+        ----------
+        adj : Scipy Sparse Matrix
+            Symmetric adjacency matrix.
+        node_ids : List
+            Node ids in row order (default 0..n-1).
+
+        Returns
+        -------
+        ArrayGraph
+            The graph of `adj`.
+        """
+        adj = sp.sparse.csr_matrix(adj, dtype=np.float64)
+        adj.sort_indices()
+        graph = cls(adj.indptr, adj.indices, adj.data, node_ids)
+        graph._adjacency = adj
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Create a graph from a networkx graph.
+
+        Parameters
+        ----------
+        graph : Networkx Graph
+            A networkx graph, whose nodes are taken in graph.nodes() order.
+
+        Returns
+        -------
+        ArrayGraph
+            The same graph, keeping a reference to `graph`.
+        """
+        array = cls.from_adjacency(
+            nx.adjacency_matrix(graph),
+            list(graph.nodes())
+        )
+        array._graph = graph
+        return array
+
+    def adjacency(self):
+        """Return the adjacency matrix.
+
+        Returns
+        -------
+        Scipy Sparse Matrix
+            The adjacency matrix in csr format, built on first use.
+        """
+        if self._adjacency is None:
+            num_nodes = len(self.indptr) - 1
+            self._adjacency = sp.sparse.csr_matrix(
+                (self.data, self.indices, self.indptr),
+                shape=(num_nodes, num_nodes)
+            )
+        return self._adjacency
+
+    def nodes(self):
+        """Return the list of node ids in row order."""
+        return self.node_ids.tolist()
+
+    def number_of_nodes(self):
+        """Return the number of nodes."""
+        return len(self.indptr) - 1
+
+    def degrees(self):
+        """Return the number of neighbors of each node, in row order."""
+        return np.diff(self.indptr)
+
+    def set_node_attributes(self, name, values):
+        """Set an attribute of every node.
+
+        Parameters
+        ----------
+        name : String
+            Name of the attribute.
+        values : Numpy Array
+            Value of the attribute for each node, in row order.
+        """
+        self.node_attributes[name] = np.asarray(values)
+        if self._graph is not None:
+            nx.set_node_attributes(
+                self._graph,
+                name,
+                dict(zip(self.nodes(), self.node_attributes[name].tolist()))
+            )
+
+    def to_networkx(self):
+        """Return the graph as a networkx graph.
+
+        Returns
+        -------
+        Networkx Graph
+            The networkx graph this graph was created from, or a new one
+            holding its edges, node ids and node attributes.
+        """
+        if self._graph is None:
+            graph = nx.from_scipy_sparse_matrix(self.adjacency())
+            num_nodes = len(self.node_ids)
+            if not np.array_equal(self.node_ids, np.arange(num_nodes)):
+                graph = nx.relabel_nodes(
+                    graph,
+                    dict(enumerate(self.nodes()))
+                )
+            for name, values in self.node_attributes.items():
+                nx.set_node_attributes(
+                    graph,
+                    name,
+                    dict(zip(self.nodes(), values.tolist()))
+                )
+            self._graph = graph
+        return self._graph
+
+
+def _id_array(node_ids):
+    """Store node ids in an array, as objects unless they are integers."""
+    node_ids = list(node_ids)
+    ids = np.empty(len(node_ids), dtype=object)
+    for idx, node in enumerate(node_ids):
+        ids[idx] = node
+    if all(isinstance(node, (int, np.integer)) for node in ids):
+        return ids.astype(np.int64)
+    return ids
+
+
+def as_array_graph(graph):
+    """Convert a graph to an ArrayGraph.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph | Scipy Sparse Matrix
+        A graph, or its adjacency matrix.
+
+    Returns
+    -------
+    ArrayGraph
+        `graph` itself if it is an ArrayGraph, otherwise a new one.
+    """
+    if isinstance(graph, ArrayGraph):
+        return graph
+    if sp.sparse.issparse(graph):
+        return ArrayGraph.from_adjacency(graph)
+    return ArrayGraph.from_networkx(graph)
@@ -0,0 +1,234 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for caching walk computations on disk."""
+
+# Imports
+import hashlib
+import logging
+import os
+import tempfile
+import numpy as np
+import scipy as sp
+import scipy.sparse
+from code import SPIDERDONUTS
+
+
+# Default directory of the cache, overridden by $SPIDERDONUTS_CACHE
+CACHE_DIR = os.environ.get(
+    'SPIDERDONUTS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'spiderdonuts')
+)
+
+# Default maximum total size of the cache, in bytes
+MAX_BYTES = 2 ** 30
+
+# Version of the cache format, part of every key
+CACHE_VERSION = 1
+
+# Name of the array listing arrays stored as decimal strings
+OBJECT_ARRAYS = '__object__'
+
+
+# Spiderdonuts logger
+logger = logging.getLogger(SPIDERDONUTS)
+
+
+def adjacency_hash(adj):
+    """Calculate a canonical hash of the structure of an adjacency matrix.
+
+    Parameters
+    ----------
+    adj : Scipy Sparse Matrix
+        Adjacency matrix of a graph, with rows in node order.
+
+    Returns
+    -------
+    hashlib Hash
+        A sha256 hash of the shape, sparsity pattern and weights of `adj`.
+    """
+    # Canonical csr form: sorted indices, no duplicates or explicit zeros
+    adj = sp.sparse.csr_matrix(adj, dtype=np.float64, copy=True)
+    adj.sum_duplicates()
+    adj.eliminate_zeros()
+    adj.sort_indices()
+
+    digest = hashlib.sha256()
+    digest.update(np.array(adj.shape, dtype=np.int64).tobytes())
+    digest.update(adj.indptr.astype(np.int64).tobytes())
+    digest.update(adj.indices.astype(np.int64).tobytes())
+    digest.update(adj.data.tobytes())
+    return digest
+
+
+class Cache(object):
+    """A size-bounded cache of arrays keyed by adjacency structure.
+
+    Each entry is a compressed .npz file named by its key. Reading an
+    entry refreshes its modification time, and writing one evicts the
+    least recently used entries until the cache fits in `max_bytes`.
+
+    Parameters
+    ----------
+    path : String
+        Directory of the cache (default CACHE_DIR).
+    max_bytes : Number
+        Maximum total size of the cache files (default MAX_BYTES).
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        self.path = CACHE_DIR if path is None else path
+        self.max_bytes = max_bytes
+
+    def key(self, adj, *parts):
+        """Calculate the key of an entry.
+
+        Parameters
+        ----------
+        adj : Scipy Sparse Matrix
+            Adjacency matrix of a graph.
+        parts
+            Values such as the name of the computation, max_power and
+            precision mode, distinguished by their repr.
+
+        Returns
+        -------
+        String
+            A hexadecimal sha256 digest.
+        """
+        digest = adjacency_hash(adj)
+        digest.update(repr((CACHE_VERSION,) + parts).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """Read an entry from the cache.
+
+        Parameters
+        ----------
+        key : String
+            Key of the entry, as returned by `key`.
+
+        Returns
+        -------
+        Dict
+            The arrays of the entry keyed by name, or None on a miss.
+        """
+        path = self._file(key)
+        try:
+            with np.load(path) as data:
+                objects = set(data[OBJECT_ARRAYS].tolist())
+                arrays = {
+                    name: data[name] for name in data.files
+                    if name != OBJECT_ARRAYS
+                }
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+        # Rebuild python integers from their decimal strings
+        for name in objects:
+            values = [int(value) for value in arrays[name].flat]
+            arrays[name] = np.array(values, dtype=object).reshape(
+                arrays[name].shape
+            )
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        logger.info('Cache hit {}'.format(key))
+        return arrays
+
+    def put(self, key, arrays):
+        """Write an entry to the cache, evicting old entries if needed.
+
+        Parameters
+        ----------
+        key : String
+            Key of the entry, as returned by `key`.
+        arrays : Dict
+            Arrays keyed by name. Arrays with dtype=object must hold
+            integers, which are stored as decimal strings.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # Store python integers as decimal strings
+        stored = {}
+        objects = []
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if array.dtype == object:
+                objects.append(name)
+                array = np.array(
+                    [str(value) for value in array.flat]
+                ).reshape(array.shape)
+            stored[name] = array
+        stored[OBJECT_ARRAYS] = np.array(objects, dtype=str)
+
+        # Write to a temporary file, then move it into place so that
+        # readers never see a partial entry
+        handle, temp = tempfile.mkstemp(suffix='.npz', dir=self.path)
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.savez_compressed(file, **stored)
+            os.replace(temp, self._file(key))
+        except Exception:
+            os.remove(temp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits."""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                path = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Remove the oldest entries first
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def cached(self, adj, parts, compute):
+        """Look up an entry, computing and storing it on a miss.
+
+        Parameters
+        ----------
+        adj : Scipy Sparse Matrix
+            Adjacency matrix of a graph.
+        parts : Tuple
+            Values distinguishing the computation, passed to `key`.
+        compute : Function
+            Function of no arguments returning the arrays of the entry.
+
+        Returns
+        -------
+        Dict
+            The arrays of the entry keyed by name.
+        """
+        key = self.key(adj, *parts)
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute()
+            self.put(key, arrays)
+        return arrays
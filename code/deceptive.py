@@ -0,0 +1,221 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for evaluating deceptive functions.
+
+A deceptive function is formed as g(lambda) = e^lambda + p(lambda), where
+
+    p(lambda) = x_0 lambda^2 + x_1 lambda^3 + ... + x_(k-1) lambda^(k+1)
+
+with x the solution of `polygraph.nonnegative_linear_system_check`,
+excluding gamma. Functions here evaluate g over arrays of eigenvalues,
+and bound its minimum rigorously with interval arithmetic, rounding
+every bound outward so that floating point errors cannot hide a
+negative value.
+"""
+
+# Imports
+import heapq
+import numpy as np
+
+
+# Lowest power of lambda in p(lambda)
+OFFSET = 2
+
+# Units in the last place added to bounds computed by np.exp, whose
+# results are accurate to within a few units
+EXP_ULPS = 4
+
+
+def polynomial(coefficients, values):
+    """Evaluate p(lambda) by Horner's method.
+
+    Parameters
+    ----------
+    coefficients : Numpy Array
+        Coefficients x_0..x_(k-1) of lambda^2..lambda^(k+1). A 2d array
+        holds the coefficients of one polynomial per row, padded with
+        zeros.
+    values : Numpy Array
+        Values of lambda. If `coefficients` is 2d, a 2d array holds the
+        values for each polynomial per row.
+
+    Returns
+    -------
+    Numpy Array
+        p(lambda) for each value, with the shape of `values`.
+    """
+    coefficients = np.asarray(coefficients, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    result = np.zeros(np.broadcast(coefficients[..., :1], values).shape)
+    for idx in range(coefficients.shape[-1] - 1, -1, -1):
+        result = result * values + coefficients[..., idx:idx + 1]
+    return result * values ** OFFSET
+
+
+def deceptive_values(coefficients, values):
+    """Evaluate g(lambda) = e^lambda + p(lambda).
+
+    Parameters
+    ----------
+    coefficients : Numpy Array
+        Coefficients of p, as in `polynomial`.
+    values : Numpy Array
+        Values of lambda, as in `polynomial`. Padding with nan is
+        carried through to the result.
+
+    Returns
+    -------
+    Numpy Array
+        g(lambda) for each value, with the shape of `values`.
+    """
+    return np.exp(values) + polynomial(coefficients, values)
+
+
+def _down(x, ulps=1):
+    """Move values toward -inf by a number of units in the last place."""
+    for _ in range(ulps):
+        x = np.nextafter(x, -np.inf)
+    return x
+
+
+def _up(x, ulps=1):
+    """Move values toward +inf by a number of units in the last place."""
+    for _ in range(ulps):
+        x = np.nextafter(x, np.inf)
+    return x
+
+
+def _interval_product(lo_a, hi_a, lo_b, hi_b):
+    """Multiply intervals, rounding outward."""
+    products = np.array([lo_a * lo_b, lo_a * hi_b, hi_a * lo_b, hi_a * hi_b])
+    return _down(products.min(axis=0)), _up(products.max(axis=0))
+
+
+def deceptive_bounds(coefficients, lower, upper):
+    """Bound g(lambda) over intervals of lambda.
+
+    Uses the interval extension of Horner's method with outward
+    rounding, so the bounds hold for every real lambda in each interval
+    despite floating point errors. Bounds tighten as intervals shrink.
+
+    Parameters
+    ----------
+    coefficients : Numpy Array
+        One dimensional array of coefficients of p, as in `polynomial`.
+    lower, upper : Numpy Array
+        Endpoints of the intervals of lambda.
+
+    Returns
+    -------
+    tuple
+        A tuple containing arrays of lower and upper bounds of g(lambda)
+        over each interval.
+    """
+    coefficients = np.asarray(coefficients, dtype=np.float64)
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+
+    # Horner's method on intervals
+    lo = np.zeros(lower.shape)
+    hi = np.zeros(lower.shape)
+    for coefficient in coefficients[::-1]:
+        lo, hi = _interval_product(lo, hi, lower, upper)
+        lo, hi = _down(lo + coefficient), _up(hi + coefficient)
+    for _ in range(OFFSET):
+        lo, hi = _interval_product(lo, hi, lower, upper)
+
+    # e^lambda is increasing
+    lo = _down(lo + _down(np.exp(lower), EXP_ULPS))
+    hi = _up(hi + _up(np.exp(upper), EXP_ULPS))
+    return lo, hi
+
+
+def interval_minimum(coefficients, lower, upper, tolerance=1e-9,
+                     max_intervals=100000):
+    """Bound the minimum of g(lambda) over an interval by branch and bound.
+
+    The interval is split in halves, discarding pieces whose lower bound
+    exceeds the smallest upper bound found at any point, until the bounds
+    on the minimum are within `tolerance`.
+
+    Parameters
+    ----------
+    coefficients : Numpy Array
+        One dimensional array of coefficients of p, as in `polynomial`.
+    lower, upper : Number
+        Endpoints of the interval of lambda.
+    tolerance : Number
+        Largest accepted gap between the bounds, relative to the size
+        of the minimum (default 1e-9).
+    max_intervals : Number
+        Largest number of intervals examined (default 100000).
+
+    Returns
+    -------
+    tuple
+        A tuple (low, high) with low <= min g(lambda) <= high over
+        [lower, upper]. If `max_intervals` is reached first, the gap may
+        exceed `tolerance`, but the bounds still hold.
+    """
+    # Any point bounds the minimum from above
+    low, high = deceptive_bounds(coefficients, [lower, upper], [lower, upper])
+    best = high.min()
+
+    low, _ = deceptive_bounds(coefficients, [lower], [upper])
+    heap = [(low[0], lower, upper)]
+    examined = 1
+    while heap:
+        bound, lo, hi = heap[0]
+        if best - bound <= tolerance * max(1.0, abs(best)):
+            break
+        if examined >= max_intervals:
+            break
+        heapq.heappop(heap)
+
+        # Split in halves, tightening the upper bound at the middle
+        middle = lo + (hi - lo) / 2
+        if not lo < middle < hi:
+            heapq.heappush(heap, (bound, lo, hi))
+            break
+        _, high = deceptive_bounds(coefficients, [middle], [middle])
+        best = min(best, high[0])
+        bounds, _ = deceptive_bounds(coefficients, [lo, middle], [middle, hi])
+        for piece_bound, piece in zip(bounds, [(lo, middle), (middle, hi)]):
+            if piece_bound <= best:
+                heapq.heappush(heap, (piece_bound,) + piece)
+        examined += 2
+
+    return (heap[0][0] if heap else best), best
+
+
+def eigenvalue_minimum(coefficients, eigenvalues, radius):
+    """Bound the minimum of g over eigenvalues known within a radius.
+
+    Parameters
+    ----------
+    coefficients : Numpy Array
+        One dimensional array of coefficients of p, as in `polynomial`.
+    eigenvalues : Numpy Array
+        Computed eigenvalues.
+    radius : Number
+        Bound on the error of each computed eigenvalue, such as
+        n * eps * ||A|| for a dense symmetric eigensolver.
+
+    Returns
+    -------
+    tuple
+        A tuple (low, high) with low <= min g(lambda) <= high, the
+        minimum taken over the true eigenvalues.
+    """
+    eigenvalues = np.asarray(eigenvalues, dtype=np.float64)
+    low, high = deceptive_bounds(
+        coefficients,
+        _down(eigenvalues - radius),
+        _up(eigenvalues + radius)
+    )
+    return low.min(), high.min()
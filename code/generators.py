@@ -7,11 +7,14 @@
 """A collection of functions used to generate pre-existing graphs."""
 
 # Imports
+import itertools
 import networkx as nx
 import numpy as np
 import os
 import logging
-from code import SPIDERDONUTS
+import scipy as sp
+import scipy.sparse
+from code import kronecker, SPIDERDONUTS
 
 
 # Determine the base path to the current directory
@@ -157,6 +160,42 @@ def pyramid_prism(faces=3, layers=0):
     return g
 
 
+def pyramid_prism_partition(faces=3, layers=0):
+    """Partition the nodes of a Pyramid Prism into orbits.
+
+    Reflecting the prism top to bottom swaps the top and bottom nodes
+    and the i-th row from the top with the i-th row from the bottom,
+    and rotating it permutes the nodes within each row.
+
+    Parameters
+    ----------
+    faces : int, optional
+        Number of sides of the prism (The default is 3).
+    layers : int, optional
+        Number of additional layers of the prism (The default is 0).
+
+    Returns
+    -------
+    List
+        A list of lists of nodes of `pyramid_prism(faces, layers)`,
+        one list per orbit, starting with the top and bottom nodes.
+    """
+    num_rows = 2 + layers
+    bottom = (num_rows * faces) + 1
+
+    # Nodes of each row, numbered as in `pyramid_prism`
+    rows = [
+        [(i * faces) + j for j in range(1, faces + 1)]
+        for i in range(0, num_rows)
+    ]
+
+    # Pair each row with its mirror image
+    return [[0, bottom]] + [
+        rows[i] + (rows[num_rows - 1 - i] if i != num_rows - 1 - i else [])
+        for i in range(0, (num_rows + 1) // 2)
+    ]
+
+
 def fan_graph():
     """Create a fan graph.
 
@@ -285,7 +324,8 @@ def rhombicuboctahedron():
     return nx.read_gml(abs_path('gml/rhombicuboctahedron.gml'))
 
 
-def snowflakecycle(flake_number=5, inner_cycle=5, outer_cycle=3):
+def snowflakecycle(flake_number=5, inner_cycle=5, outer_cycle=3,
+                   sparse=False):
     """Generate a snowflake cycle.
 
     Cycle can be customized with flake_number different snowflake-sides,
@@ -303,10 +343,13 @@ def snowflakecycle(flake_number=5, inner_cycle=5, outer_cycle=3):
     outer_cycle : Number
         Length of cycle connecting outer nodes of snowflakes (default 3).
         Generated graph of a snowflake-cycle.
+    sparse : Boolean
+        Whether or not to return the adjacency matrix as a scipy csr
+        matrix instead of a networkx graph (default False).
 
     Returns
     -------
-    Networkx Graph
+    Networkx Graph | Scipy Sparse Matrix
         Snowflake Cycle
     """
     # Construct (k+1)-node snow-flake graph:
@@ -326,21 +369,25 @@ def snowflakecycle(flake_number=5, inner_cycle=5, outer_cycle=3):
 
     A_snowflake[1:(num_flake_nodes), 0] = np.squeeze(temp_vec)
     A_snowflake[0, 1:(num_flake_nodes)] = np.squeeze(temp_vec.T)
+    A_snowflake = sp.sparse.csr_matrix(A_snowflake)
 
     # Next link together inner_cycle of these
     # snowflakes by their inner flake nodes
     D = np.zeros((num_flake_nodes))
     D[1:(num_flake_nodes)] = np.squeeze(temp_vec)
-    D = np.diag(D)
+    D = sp.sparse.diags(D)
 
     cycle_inner_g = nx.cycle_graph(inner_cycle)
-    cycle_inner = nx.adjacency_matrix(cycle_inner_g).toarray()
-    I_inner = np.identity(inner_cycle)
-    A_inner = np.kron(I_inner, A_snowflake) + np.kron(cycle_inner, D)
+    cycle_inner = nx.adjacency_matrix(cycle_inner_g)
+    I_inner = sp.sparse.identity(inner_cycle)
+    A_inner = (
+        sp.sparse.kron(I_inner, A_snowflake) +
+        sp.sparse.kron(cycle_inner, D)
+    )
 
     # Now link together outer_cycle copies of the inner_cycle graphs
     cycle_outer_g = nx.cycle_graph(outer_cycle)
-    cycle_outer = nx.adjacency_matrix(cycle_outer_g).toarray()
+    cycle_outer = nx.adjacency_matrix(cycle_outer_g)
 
     temp_vec = np.zeros((2 * flake_number, 1))
     for j in range(len(temp_vec)):
@@ -350,14 +397,52 @@ def snowflakecycle(flake_number=5, inner_cycle=5, outer_cycle=3):
     D = np.zeros(num_flake_nodes)
     D[1:(num_flake_nodes)] = temp_vec
 
-    I_outer = np.identity(outer_cycle)
-    AG = np.kron(I_outer, A_inner) + np.kron(
+    I_outer = sp.sparse.identity(outer_cycle)
+    AG = sp.sparse.kron(I_outer, A_inner) + sp.sparse.kron(
         cycle_outer,
-        np.kron(I_inner, np.diag(D))
+        sp.sparse.kron(I_inner, sp.sparse.diags(D))
     )
-    AG = np.asmatrix(AG)
+    AG = _adjacency(AG)
 
-    return nx.from_numpy_matrix(AG)
+    return AG if sparse else nx.from_scipy_sparse_matrix(AG)
+
+
+def snowflakecycle_partition(flake_number=5, inner_cycle=5, outer_cycle=3):
+    """Partition the nodes of a snowflake cycle into orbits.
+
+    Each snowflake has a center node, the cycle nodes joined to the
+    center and to the inner cycle, and the cycle nodes joined to the
+    outer cycle. Rotating every snowflake and either cycle preserves
+    these three roles.
+
+    Parameters
+    ----------
+    flake_number : Number
+        Number of sides of the snowflake (default is 5).
+    inner_cycle : Number
+        Length of cycle connecting inner nodes of snowflakes (default 5).
+    outer_cycle : Number
+        Length of cycle connecting outer nodes of snowflakes (default 3).
+
+    Returns
+    -------
+    List
+        A list of three lists of nodes of
+        `snowflakecycle(flake_number, inner_cycle, outer_cycle)`:
+        the centers, the inner nodes and the outer nodes.
+    """
+    num_flake_nodes = (1 + 2 * flake_number)
+    num_nodes = num_flake_nodes * inner_cycle * outer_cycle
+
+    # Role of each node within its own snowflake
+    local = [node % num_flake_nodes for node in range(num_nodes)]
+
+    return [
+        [node for node in range(num_nodes) if local[node] == 0],
+        [node for node in range(num_nodes) if local[node] % 2 == 1],
+        [node for node in range(num_nodes)
+         if local[node] > 0 and local[node] % 2 == 0]
+    ]
 
 
 def kks_graph(clique_size=4, num_cliques=5, silent=True):
@@ -409,7 +494,33 @@ def kks_graph(clique_size=4, num_cliques=5, silent=True):
     return G
 
 
-def spider(degree, length):
+def kks_graph_partition(clique_size=4, num_cliques=5):
+    """Partition the nodes of a KKS graph into orbits.
+
+    Permuting the cliques, or permuting the nodes of every clique along
+    with the independent set, preserves the graph.
+
+    Parameters
+    ----------
+    clique_size: positive integer
+        The number of nodes in each clique
+    num_cliques: positive integer
+        The number of cliques
+
+    Returns
+    -------
+    List
+        A list containing the list of clique nodes and the list of
+        independent set nodes of `kks_graph(clique_size, num_cliques)`.
+    """
+    num_clique_nodes = num_cliques * clique_size
+    return [
+        list(range(0, num_clique_nodes)),
+        list(range(num_clique_nodes, num_clique_nodes + clique_size))
+    ]
+
+
+def spider(degree, length, sparse=False):
     """Create a spider graph.
 
     Parameters
@@ -418,42 +529,42 @@ def spider(degree, length):
         Degree of the center node (number of pendants)
     length : Integer
         Length of each pendant (not including the center node)
+    sparse : Boolean
+        Whether or not to return the adjacency matrix as a scipy csr
+        matrix instead of a networkx graph (default False).
 
     Returns
     -------
-    Networkx Graph
+    Networkx Graph | Scipy Sparse Matrix
         Spider graph
     """
     # Create a single spoke and get its adjacency matrix W
     spoke = nx.path_graph(length)
-    spoke_adj = nx.adjacency_matrix(spoke).todense()
+    spoke_adj = nx.adjacency_matrix(spoke)
 
     # Create the identity matrix of size degree
-    identity = np.identity(degree)
+    identity = sp.sparse.identity(degree)
 
     # Create the adjacency matrix for the graph containing
     # `degree` number unconnected spokes
-    spokes = np.matrix(np.kron(spoke_adj, identity))
+    spokes = sp.sparse.kron(spoke_adj, identity)
 
-    # Calculate the total number of desired nodes in the graph
-    num_nodes = (degree * length) + 1
+    # Connect each spoke to the center, which is node 0
+    center = np.zeros((1, degree * length))
+    center[0, 0:degree] = 1
+    center = sp.sparse.csr_matrix(center)
 
-    # Create a num_nodes x num_nodes matrix, filled with zeroes.
-    # This will eventually be the matrix of the spider graph
-    spider = np.zeros((num_nodes, num_nodes))
+    # Construct the matrix of the spider graph
+    spider = _adjacency(sp.sparse.bmat([
+        [None, center],
+        [center.T, spokes]
+    ]))
 
-    # Add the spokes to the spider
-    spider[1:num_nodes, 1:num_nodes] = spokes
+    # Return the matrix or a networkx graph constructed from it
+    return spider if sparse else nx.from_scipy_sparse_matrix(spider)
 
-    # Connect each spoke to the center
-    spider[0, 1:degree + 1] = 1
-    spider[1:degree + 1, 0] = 1
 
-    # Construct and return a networkx graph from the matrix
-    return nx.from_numpy_matrix(spider)
-
-
-def spider_torus(degree, length, copies):
+def spider_torus(degree, length, copies, sparse=False):
     """Create a torus of spider graphs.
 
     A torus is formed with the folling process:
@@ -482,14 +593,22 @@ def spider_torus(degree, length, copies):
         A list containing the number of copies of the
         previous level to maek at each level of the
         hyperchain.
+    sparse : Boolean
+        Whether or not to return the adjacency matrix of the hyperchain
+        as a scipy csr matrix instead of a networkx graph (default False).
+        The matrix is built from sparse Kronecker products, so memory
+        stays proportional to the number of edges either way.
 
     Returns
     -------
     Dict
         Dictionary containing
-        graph           - The full hyperchain graph
+        graph           - The full hyperchain graph, or its adjacency
+                          matrix if `sparse`
         representatives - An list of representative nodes from each class,
                           in ascending order by level.
+        partition       - A list of lists of nodes, one per level, whose
+                          first nodes are the representatives.
         degree          - Degree of the base spider graph
         length          - Length of each pendant
         copies          - Number of copies in each ring
@@ -500,11 +619,8 @@ def spider_torus(degree, length, copies):
     if len(copies) != length:
         raise Exception('Invalid number of copies.')
 
-    # Create the base spider graph
-    spider_graph = spider(degree, length)
-
-    # Get the adjacency matrix and shape of the base spider
-    spider_adj = nx.adjacency_matrix(spider_graph).todense()
+    # Create the adjacency matrix of the base spider graph
+    spider_adj = spider(degree, length, sparse=True)
     spider_rows, spider_cols = spider_adj.shape
 
     # Copy the spider adjacency matrix. This will be the base
@@ -534,37 +650,195 @@ def spider_torus(degree, length, copies):
         max_node = 1 + ((level + 1) * degree)
         row = np.zeros(spider_rows)
         row[min_node:max_node] = 1
-        diagonal = np.diag(np.tile(row, num_duplcates))
+        diagonal = sp.sparse.diags(np.tile(row, num_duplcates))
 
         # Create a cycle graph equal in size to the number of copies
         # being made for this level. Save its adjacency matrix.
-        cycle = nx.adjacency_matrix(nx.cycle_graph(num_copies)).todense()
+        cycle = nx.adjacency_matrix(nx.cycle_graph(num_copies))
 
         # Calculate the edges being added to the set of duplicates
         # as the kronecker product of the cycle graph with the
         # diagonal matrix which links nodes together
-        edges = np.kron(cycle, diagonal)
+        edges = sp.sparse.kron(cycle, diagonal)
 
         # Use the kronecker product to create a single graph
         # containing n unconnected copies of the base adjacency
         # matrix
-        duplicates = np.kron(np.identity(num_copies), adj)
+        duplicates = sp.sparse.kron(sp.sparse.identity(num_copies), adj)
 
         # Update the number of duplicates
         num_duplcates *= num_copies
 
         # Update the adjacency matrix to be the set of duplicates
         # plus the set of edges being added.
-        adj = duplicates + edges
+        adj = _adjacency(duplicates + edges)
 
     # Log completion
     logger.info('Spider torus complete')
 
+    # Group nodes by the level of their position in the base spider,
+    # placing each representative first
+    representatives = [level * degree for level in range(length + 1)]
+    nodes = np.arange(adj.shape[0])
+    local = nodes % spider_rows
+    levels = np.where(local == 0, 0, ((local - 1) // degree) + 1)
+    partition = [
+        [representative] + [
+            node for node in nodes[levels == level].tolist()
+            if node != representative
+        ]
+        for level, representative in enumerate(representatives)
+    ]
+
     # Return the graph formed from the final adjacency matrix
     return {
-        'graph': nx.from_numpy_matrix(adj),
-        'representatives': [level * degree for level in range(length + 1)],
+        'graph': adj if sparse else nx.from_scipy_sparse_matrix(adj),
+        'representatives': representatives,
+        'partition': partition,
         'degree': degree,
         'length': length,
         'copies': copies
     }
+
+
+def _adjacency(adj):
+    """Convert a sum of sparse Kronecker products to a csr matrix.
+
+    Parameters
+    ----------
+    adj : Scipy Sparse Matrix
+        An adjacency matrix in any sparse format.
+
+    Returns
+    -------
+    Scipy Sparse Matrix
+        `adj` in csr format, with duplicates summed, explicit zeros
+        removed and indices sorted.
+    """
+    adj = sp.sparse.csr_matrix(adj, dtype=np.float64)
+    adj.sum_duplicates()
+    adj.eliminate_zeros()
+    adj.sort_indices()
+    return adj
+
+
+def _product(combine, graphs, operator):
+    """Build a product of graphs from a Kronecker operator.
+
+    Parameters
+    ----------
+    combine : Function
+        `kronecker.cartesian_product` or `kronecker.tensor_product`.
+    graphs : List
+        Networkx graphs, whose nodes are taken in graph.nodes() order.
+    operator : Boolean
+        Whether or not to return the operator along with the graph.
+
+    Returns
+    -------
+    Networkx Graph | Dict
+        The product graph, with node (u, v, ...) numbered as in
+        `scipy.sparse.kron`, or a dict of the graph and its operator.
+    """
+    op = combine(*[nx.adjacency_matrix(graph) for graph in graphs])
+    graph = nx.from_scipy_sparse_matrix(op.adjacency())
+    if not operator:
+        return graph
+    return {
+        'graph': graph,
+        'operator': op
+    }
+
+
+def cartesian_product(*graphs, operator=False):
+    """Generate the cartesian product of graphs.
+
+    Unlike `nx.cartesian_product`, any number of graphs are combined and
+    nodes are numbered 0..n-1, node (u, v) of G x H being u * |H| + v.
+
+    Parameters
+    ----------
+    graphs
+        Networkx graphs.
+    operator : Boolean
+        Whether or not to also return the adjacency matrix as a
+        `kronecker.KroneckerSum`, which lets `polygraph.walk_classes`
+        compute walks and spectra from the factors (default False).
+
+    Returns
+    -------
+    Networkx Graph | Dict
+        The cartesian product, or if `operator` a dict containing
+        graph    - The cartesian product
+        operator - Its Kronecker structured adjacency matrix
+    """
+    return _product(kronecker.cartesian_product, graphs, operator)
+
+
+def tensor_product(*graphs, operator=False):
+    """Generate the tensor product of graphs.
+
+    Nodes are numbered as in `cartesian_product`.
+
+    Parameters
+    ----------
+    graphs
+        Networkx graphs.
+    operator : Boolean
+        Whether or not to also return the adjacency matrix as a
+        `kronecker.KroneckerProduct` (default False).
+
+    Returns
+    -------
+    Networkx Graph | Dict
+        The tensor product, or if `operator` a dict containing
+        graph    - The tensor product
+        operator - Its Kronecker structured adjacency matrix
+    """
+    return _product(kronecker.tensor_product, graphs, operator)
+
+
+def sweep(generator, params=None, **ranges):
+    """Lazily generate the graphs of a family over a range of parameters.
+
+    Each graph is only generated when the sweep is advanced to it, so a
+    sweep over many graphs holds a single graph at a time.
+
+    Parameters
+    ----------
+    generator : String | Function
+        A generator in this module, or its name, e.g. 'pyramid_prism'.
+    params : Iterable
+        Dicts of keyword arguments of the generator, for families whose
+        parameters depend on each other, e.g. the `length` and `copies`
+        of `spider_torus`. If omitted, `ranges` is used instead.
+    ranges
+        An iterable of values for each keyword argument of the
+        generator. Every combination of values is generated, varying
+        the last argument fastest.
+
+    Yields
+    ------
+    tuple
+        A tuple (params, graph) containing the dict of keyword arguments
+        and the output of the generator, e.g.
+
+        >>> for params, g in sweep('pyramid_prism', faces=range(3, 5),
+        ...                        layers=[0, 1]):
+        ...     print(params, len(g))
+        {'faces': 3, 'layers': 0} 8
+        ...
+    """
+    if isinstance(generator, str):
+        generator = globals()[generator]
+
+    # Every combination of the ranges
+    if params is None:
+        keys = list(ranges.keys())
+        params = (
+            dict(zip(keys, values))
+            for values in itertools.product(*ranges.values())
+        )
+
+    for kwargs in params:
+        yield kwargs, generator(**kwargs)
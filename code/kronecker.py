@@ -0,0 +1,343 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for graphs built as products of smaller graphs.
+
+An operator is an expression tree whose leaves are adjacency matrices.
+A `KroneckerSum` is the adjacency matrix of a cartesian product,
+L (x) I + I (x) R, and a `KroneckerProduct` that of a tensor product,
+L (x) R. Node (u, v) of a product has index u * n_R + v, as in
+`scipy.sparse.kron`.
+
+Closed walks, eigenvalues and the diagonal of the matrix exponential
+of a product follow from those of its factors, so they are computed on
+the factors and only combined for the distinct rows of each factor.
+"""
+
+# Imports
+import numpy as np
+import scipy as sp
+import scipy.sparse
+from scipy.special import comb
+from code import linalg
+
+
+def _reduce(rows):
+    """Find the distinct rows of a matrix.
+
+    Parameters
+    ----------
+    rows : Numpy Array
+        A two dimensional array.
+
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - the distinct rows, in order of first appearance
+        - an integer array mapping each row to its distinct row
+    """
+    index = {}
+    labels = np.zeros(len(rows), dtype=np.intp)
+    for idx, row in enumerate(rows):
+        labels[idx] = index.setdefault(tuple(row.tolist()), len(index))
+
+    # Labels are numbered in order of first appearance
+    first = np.unique(labels, return_index=True)[1]
+    return rows[first], labels
+
+
+def _distinct_values(values, decimals):
+    """Round values and drop duplicates.
+
+    Parameters
+    ----------
+    values : Numpy Array
+        An array of floats.
+    decimals : Number
+        Number of decimals kept.
+
+    Returns
+    -------
+    Numpy Array
+        The sorted distinct rounded values.
+    """
+    return np.unique(np.asarray(values).round(decimals=decimals))
+
+
+class Operator(object):
+    """Base class of adjacency matrices with Kronecker structure."""
+
+    def __init__(self, num_nodes):
+        self.num_nodes = num_nodes
+
+    def adjacency(self):
+        """Build the sparse adjacency matrix.
+
+        Returns
+        -------
+        Scipy Sparse Matrix
+            The adjacency matrix in csr format.
+        """
+        raise NotImplementedError
+
+    def walk_rows(self, max_power, exact=False):
+        """Calculate the diagonals of the powers of the operator.
+
+        Parameters
+        ----------
+        max_power : Number
+            Largest power whose diagonal is computed.
+        exact : Boolean
+            Whether or not to count walks with python integers
+            (default False).
+
+        Returns
+        -------
+        tuple
+            A tuple containing
+            - a (num_rows, max_power + 1) array whose columns hold the
+              entries of the diagonals of A**0 through A**max_power, with
+              dtype=object if `exact` and float64 otherwise
+            - an integer array mapping each node to its row
+        """
+        raise NotImplementedError
+
+    def distinct_eigenvalues(self, decimals):
+        """Calculate the distinct eigenvalues of the operator.
+
+        Parameters
+        ----------
+        decimals : Number
+            Number of decimals used to compare eigenvalues.
+
+        Returns
+        -------
+        Numpy Array
+            The sorted distinct eigenvalues, rounded to `decimals`.
+        """
+        raise NotImplementedError
+
+    def expm_diagonal(self, nodes):
+        """Calculate diagonal entries of the matrix exponential.
+
+        Parameters
+        ----------
+        nodes : List
+            Indices of the requested diagonal entries.
+
+        Returns
+        -------
+        Numpy Array
+            The entries of the diagonal of expm(A) at `nodes`.
+        """
+        return linalg.expm_diagonal(self.adjacency(), nodes)
+
+
+class Matrix(Operator):
+    """A leaf of an operator, holding an adjacency matrix.
+
+    Parameters
+    ----------
+    adj : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph.
+    """
+
+    def __init__(self, adj):
+        self.adj = sp.sparse.csr_matrix(adj)
+        super(Matrix, self).__init__(self.adj.shape[0])
+
+    def adjacency(self):
+        return self.adj
+
+    def walk_rows(self, max_power, exact=False):
+        dtype = object if exact else np.float64
+        walks = np.zeros((self.num_nodes, max_power + 1), dtype=dtype)
+        walks[:, 0] = 1
+        if max_power >= 1:
+            diagonal = self.adj.diagonal()
+            if exact:
+                diagonal = diagonal.astype(np.int64).astype(object)
+            walks[:, 1] = diagonal
+        if max_power >= 2:
+            if exact:
+                walks[:, 2:] = linalg.exact_closed_walks(self.adj, max_power)
+            else:
+                walks[:, 2:] = linalg.closed_walks(self.adj, max_power)
+        return _reduce(walks)
+
+    def distinct_eigenvalues(self, decimals):
+        return _distinct_values(linalg.eigenvalues(self.adj), decimals)
+
+    def expm_diagonal(self, nodes):
+        return linalg.expm_diagonal(self.adj, nodes)
+
+
+class _Binary(Operator):
+    """An operator combining two factors.
+
+    Parameters
+    ----------
+    left, right : Operator
+        The factors, with `left` varying slowest in node order.
+    """
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        super(_Binary, self).__init__(left.num_nodes * right.num_nodes)
+
+    def _combine(self, left_rows, right_rows):
+        """Calculate the rows of every pair of rows of the factors."""
+        raise NotImplementedError
+
+    def walk_rows(self, max_power, exact=False):
+        left_rows, left_labels = self.left.walk_rows(max_power, exact)
+        right_rows, right_labels = self.right.walk_rows(max_power, exact)
+
+        # Rows of pairs of distinct factor rows, pair (i, j) at
+        # i * len(right_rows) + j, then merged when equal
+        rows, merged = _reduce(self._combine(left_rows, right_rows))
+        pairs = np.add.outer(
+            left_labels * len(right_rows),
+            right_labels
+        ).ravel()
+        return rows, merged[pairs]
+
+    def _split(self, nodes):
+        """Split node indices into the indices of the factor nodes."""
+        nodes = np.asarray(nodes, dtype=np.intp)
+        return nodes // self.right.num_nodes, nodes % self.right.num_nodes
+
+
+class KroneckerSum(_Binary):
+    """The Kronecker sum L (x) I + I (x) R of two operators.
+
+    This is the adjacency matrix of the cartesian product of the graphs
+    of `left` and `right`. The terms commute, so
+
+        (L (x) I + I (x) R)**k = sum_j binom(k, j) L**j (x) R**(k - j)
+
+    and the closed walks of a node (u, v) are the binomial convolution of
+    those of u and v. Eigenvalues are the pairwise sums of those of the
+    factors, and expm(L (x) I + I (x) R) = expm(L) (x) expm(R).
+    """
+
+    def adjacency(self):
+        left = self.left.adjacency()
+        right = self.right.adjacency()
+        return sp.sparse.csr_matrix(
+            sp.sparse.kron(left, sp.sparse.identity(right.shape[0])) +
+            sp.sparse.kron(sp.sparse.identity(left.shape[0]), right)
+        )
+
+    def _combine(self, left_rows, right_rows):
+        exact = left_rows.dtype == object
+        num_powers = left_rows.shape[1]
+        rows = np.zeros(
+            (len(left_rows), len(right_rows), num_powers),
+            dtype=left_rows.dtype
+        )
+        for power in range(num_powers):
+            for j in range(power + 1):
+                binomial = comb(power, j, exact=True)
+                if not exact:
+                    binomial = float(binomial)
+                rows[:, :, power] += binomial * np.multiply.outer(
+                    left_rows[:, j],
+                    right_rows[:, power - j]
+                )
+        return rows.reshape((-1, num_powers))
+
+    def distinct_eigenvalues(self, decimals):
+        return _distinct_values(
+            np.add.outer(
+                self.left.distinct_eigenvalues(decimals),
+                self.right.distinct_eigenvalues(decimals)
+            ),
+            decimals
+        )
+
+    def expm_diagonal(self, nodes):
+        left_nodes, right_nodes = self._split(nodes)
+        left_uniq, left_idx = np.unique(left_nodes, return_inverse=True)
+        right_uniq, right_idx = np.unique(right_nodes, return_inverse=True)
+        return (
+            self.left.expm_diagonal(left_uniq)[left_idx] *
+            self.right.expm_diagonal(right_uniq)[right_idx]
+        )
+
+
+class KroneckerProduct(_Binary):
+    """The Kronecker product L (x) R of two operators.
+
+    This is the adjacency matrix of the tensor product of the graphs of
+    `left` and `right`. Since (L (x) R)**k = L**k (x) R**k, the closed
+    walks of a node (u, v) are the products of those of u and v, and
+    eigenvalues are the pairwise products of those of the factors.
+    """
+
+    def adjacency(self):
+        return sp.sparse.csr_matrix(
+            sp.sparse.kron(self.left.adjacency(), self.right.adjacency())
+        )
+
+    def _combine(self, left_rows, right_rows):
+        num_powers = left_rows.shape[1]
+        rows = left_rows[:, None, :] * right_rows[None, :, :]
+        return rows.reshape((-1, num_powers))
+
+    def distinct_eigenvalues(self, decimals):
+        return _distinct_values(
+            np.multiply.outer(
+                self.left.distinct_eigenvalues(decimals),
+                self.right.distinct_eigenvalues(decimals)
+            ),
+            decimals
+        )
+
+
+def cartesian_product(*operators):
+    """Combine operators into the operator of their cartesian product.
+
+    Parameters
+    ----------
+    operators
+        Operators or sparse adjacency matrices, at least one.
+
+    Returns
+    -------
+    Operator
+        The Kronecker sum of the operators, nested to the left.
+    """
+    return _nest(KroneckerSum, operators)
+
+
+def tensor_product(*operators):
+    """Combine operators into the operator of their tensor product.
+
+    Parameters
+    ----------
+    operators
+        Operators or sparse adjacency matrices, at least one.
+
+    Returns
+    -------
+    Operator
+        The Kronecker product of the operators, nested to the left.
+    """
+    return _nest(KroneckerProduct, operators)
+
+
+def _nest(binary, operators):
+    """Nest operators to the left with a binary operator class."""
+    operators = [
+        op if isinstance(op, Operator) else Matrix(op) for op in operators
+    ]
+    result = operators[0]
+    for op in operators[1:]:
+        result = binary(result, op)
+    return result
@@ -7,7 +7,31 @@
 
 # Imports
 import numpy as np
+import scipy as sp
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
 from math import exp
+from code import profiling
+
+
+# Maximum number of bytes used by the dense blocks of vectors
+# held at any one time while streaming closed walk computations
+MEMORY_BUDGET = 2 ** 28
+
+# Largest walk count trusted to native int64 arithmetic. Half of the
+# int64 range leaves room for the float64 estimates used to check it.
+INT64_LIMIT = 2 ** 62
+
+# Integers below this bound are represented exactly in float64
+FLOAT_EXACT_LIMIT = 2 ** 53
+
+# Modular walk counts use primes just below this bound, so that residues
+# multiplied by the row sums of an adjacency matrix stay inside int64
+PRIME_LIMIT = 2 ** 31
+
+# Largest connected component whose eigenvalues are computed densely
+DENSE_LIMIT = 4096
 
 
 def adhoc_expm(A):
@@ -32,3 +56,909 @@ def adhoc_expm(A):
 
     # Return
     return eig_vecs * exp_eigs * eig_vecs.T
+
+
+def expm_diagonal(a, nodes=None, memory_budget=MEMORY_BUDGET):
+    """Calculate diagonal entries of the matrix exponential.
+
+    The matrix exponential is never formed. Since A is symmetric,
+
+        expm(A)_ii = || expm(A / 2) e_i ||**2
+
+    so the action of expm(A / 2) is applied to blocks of unit vectors of
+    the requested nodes with `scipy.sparse.linalg.expm_multiply`, and
+    cost scales with the number of nodes requested.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph.
+    nodes : List, optional
+        Indices of the requested diagonal entries (default all nodes).
+    memory_budget : Number, optional
+        Maximum number of bytes used by the dense blocks of vectors
+        (default MEMORY_BUDGET).
+
+    Returns
+    -------
+    Numpy Array
+        A float64 array holding expm(A)_ii for i in `nodes`.
+    """
+    # Work with a csr matrix of floats, halved
+    half = sp.sparse.csr_matrix(a, dtype=np.float64) / 2
+    num_nodes = half.shape[0]
+
+    # Default to every node in the graph
+    if nodes is None:
+        nodes = np.arange(num_nodes)
+    nodes = np.asarray(nodes, dtype=np.intp)
+
+    diagonal = np.zeros(len(nodes))
+
+    # expm_multiply keeps a few n x b blocks alive at once
+    block_size = _block_size(num_nodes, 4, 8, memory_budget)
+
+    # Process the unit vectors one block at a time
+    for start in range(0, len(nodes), block_size):
+        chunk = nodes[start:start + block_size]
+        block = np.zeros((num_nodes, len(chunk)))
+        block[chunk, np.arange(len(chunk))] = 1
+        block = sp.sparse.linalg.expm_multiply(half, block)
+        diagonal[start:start + len(chunk)] = np.einsum(
+            'ij,ij->j', block, block
+        )
+
+    return diagonal
+
+
+def eigenvalues(a):
+    """Calculate the eigenvalues of a symmetric matrix.
+
+    Eigenvalues of each connected component of the graph of `a` are
+    computed separately with a dense `eigvalsh`, and components with
+    identical adjacency matrices are only computed once. Eigenvectors
+    are never formed.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph.
+
+    Returns
+    -------
+    Numpy Array
+        The eigenvalues of `a` in ascending order.
+    """
+    a = sp.sparse.csr_matrix(a, dtype=np.float64)
+    num_components, labels = sp.sparse.csgraph.connected_components(
+        a,
+        directed=False
+    )
+
+    # Group nodes by component, keeping node order within each
+    order = np.argsort(labels, kind='mergesort')
+    bounds = np.searchsorted(labels[order], np.arange(num_components + 1))
+
+    values = []
+    spectra = {}
+    for idx in range(num_components):
+        nodes = order[bounds[idx]:bounds[idx + 1]]
+        sub = a[nodes][:, nodes]
+        sub.sort_indices()
+
+        # Reuse the spectrum of an identical component
+        key = (
+            sub.shape[0],
+            sub.indptr.tobytes(),
+            sub.indices.tobytes(),
+            sub.data.tobytes()
+        )
+        if key not in spectra:
+            spectra[key] = np.linalg.eigvalsh(sub.toarray())
+        values.append(spectra[key])
+
+    return np.sort(np.concatenate(values)) if values else np.zeros(0)
+
+
+def spectral_radius(a):
+    """Calculate the spectral radius of a symmetric matrix.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph.
+
+    Returns
+    -------
+    Number
+        The largest absolute value of an eigenvalue of `a`, or 1 if `a`
+        is zero, so that it can always be divided by.
+    """
+    a = sp.sparse.csr_matrix(a, dtype=np.float64)
+    if a.nnz == 0:
+        return 1.0
+
+    # Dense solve for tiny matrices, Lanczos otherwise
+    if a.shape[0] <= 64:
+        values = np.linalg.eigvalsh(a.toarray())
+    else:
+        values = sp.sparse.linalg.eigsh(
+            a,
+            k=1,
+            which='LM',
+            return_eigenvectors=False
+        )
+    return float(np.abs(values).max()) or 1.0
+
+
+def distinct_eigenvalue_count(a, limit, tolerance=1e-8, seed=0):
+    """Estimate the number of distinct eigenvalues of a symmetric matrix.
+
+    The Krylov space of a random vector has dimension equal to the number
+    of distinct eigenvalues of `a`, almost surely. Lanczos iteration with
+    full reorthogonalization builds that space until it breaks down, so
+    the count costs at most `limit` sparse products and no eigenvectors.
+    In floating point, nearly equal eigenvalues may end the iteration
+    early and rounding errors may hide a breakdown, in which case `limit`
+    is returned, so the result is an estimate. It is most reliable when
+    `limit` is small compared to the number of nodes.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph.
+    limit : Number
+        Largest count of interest. The iteration stops there.
+    tolerance : Number, optional
+        Breakdown threshold, relative to the largest row sum of `a`
+        (default 1e-8).
+    seed : Number, optional
+        Seed of the random starting vector (default 0).
+
+    Returns
+    -------
+    Number
+        The estimated number of distinct eigenvalues, at most `limit`.
+    """
+    a = sp.sparse.csr_matrix(a, dtype=np.float64)
+    num_nodes = a.shape[0]
+    limit = min(limit, num_nodes)
+    if limit <= 0:
+        return 0
+
+    # Breakdown is measured against a bound on the norm of `a`
+    scale = max(1.0, abs(a).sum(axis=1).max()) if a.nnz else 1.0
+
+    # Orthonormal basis of the Krylov space, one vector per row
+    basis = np.zeros((limit, num_nodes))
+    vector = np.random.RandomState(seed).standard_normal(num_nodes)
+    vector /= np.linalg.norm(vector)
+
+    for dimension in range(limit):
+        basis[dimension] = vector
+        vector = a.dot(vector)
+
+        # Orthogonalize twice against the whole basis for stability
+        for _ in range(2):
+            active = basis[:dimension + 1]
+            vector -= active.T.dot(active.dot(vector))
+
+        norm = np.linalg.norm(vector)
+        if norm <= tolerance * scale:
+            return dimension + 1
+        vector /= norm
+
+    return limit
+
+
+def _block_size(num_nodes, num_blocks, itemsize, memory_budget):
+    """Calculate the number of unit vectors processed at once.
+
+    Parameters
+    ----------
+    num_nodes : Number
+        Length of each vector (the number of nodes in the graph).
+    num_blocks : Number
+        Number of dense n x b blocks alive at the same time.
+    itemsize : Number
+        Size in bytes of a single entry of a block.
+    memory_budget : Number
+        Maximum number of bytes to be used by all live blocks.
+
+    Returns
+    -------
+    Number
+        The number of columns b in each block, at least 1.
+    """
+    return max(1, memory_budget // (num_blocks * itemsize * max(1, num_nodes)))
+
+
+def closed_walks(a, max_power, nodes=None, memory_budget=MEMORY_BUDGET,
+                 min_power=2, state=None, return_exact=False):
+    """Calculate the diagonals of A**min_power through A**max_power.
+
+    No power of A is ever formed. Instead the unit vectors e_i of the
+    requested nodes are multiplied by A in blocks sized to fit within
+    `memory_budget`. Since A is symmetric, with x_p = A**p e_i,
+
+        (A**2p)_ii = x_p . x_p    and    (A**(2p-1))_ii = x_(p-1) . x_p
+
+    so only ceil(max_power / 2) sparse products are needed per block.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph.
+    max_power : Number
+        Largest power of `a` whose diagonal is computed.
+    nodes : List, optional
+        Indices of the nodes whose diagonal entries are computed
+        (default all nodes).
+    memory_budget : Number, optional
+        Maximum number of bytes used by the dense blocks of vectors
+        (default MEMORY_BUDGET).
+    min_power : Number, optional
+        Smallest power of `a` whose diagonal is computed (default 2).
+    state : Dict, optional
+        Vectors to resume from, updated in place. If state['power'] is
+        min_power // 2, streaming resumes from the block
+        state['vectors'] = A**state['power'] e_i of every requested node
+        instead of the unit vectors. On return the block reached at
+        max_power is kept in `state`, if it fits within `memory_budget`,
+        so a later call with min_power = max_power + 1 can resume.
+    return_exact : Boolean, optional
+        Whether or not to also return which entries are certainly exact
+        (default False). For a matrix of nonnegative integers every sum
+        is of nonnegative integers, so a vector entry or dot product is
+        exact when its inputs are and its computed value is below
+        FLOAT_EXACT_LIMIT: a true value at or above the limit cannot be
+        rounded below it. The same holds for such a matrix divided by a
+        power of two 2**s, which scales every value of power p exactly
+        by 2**(-s * p), with the limit scaled alike. Entries of other
+        matrices are never certain.
+
+    Returns
+    -------
+    Numpy Array | tuple
+        A len(nodes) x (max_power - min_power + 1) float64 array whose
+        row r holds the entries (A**min_power)_ii through
+        (A**max_power)_ii for i = nodes[r]. If `return_exact`, a tuple
+        of that array and a boolean array of the same shape marking the
+        entries that are exact.
+    """
+    # Work with a csr matrix of floats
+    a = sp.sparse.csr_matrix(a, dtype=np.float64)
+    num_nodes = a.shape[0]
+
+    # Default to every node in the graph
+    if nodes is None:
+        nodes = np.arange(num_nodes)
+    nodes = np.asarray(nodes, dtype=np.intp)
+
+    # Output matrix, one row per requested node
+    walks = np.zeros((len(nodes), max(0, max_power - min_power + 1)))
+    exact = np.zeros(walks.shape, dtype=bool)
+    shift = _power_of_two_shift(a) if return_exact else 0
+    scaled = np.ldexp(a.data, -shift)
+    integral = return_exact and bool(
+        np.all(a.data >= 0) and np.all(scaled == np.round(scaled))
+    )
+
+    # Values of power p below limit(p) are exact for such matrices
+    def limit(power):
+        return _exact_limit(shift * power)
+
+    # Three n x b blocks are alive at once: x_(p-1), x_p and their product
+    block_size = _block_size(num_nodes, 3, 8, memory_budget)
+
+    # Resume from saved vectors, which hold every requested node at once
+    vectors = _resume_vectors(state, min_power, len(nodes))
+    if vectors is not None:
+        block_size = max(block_size, len(nodes))
+    keep = state is not None and len(nodes) <= block_size
+
+    # Process the unit vectors one block at a time
+    for start in range(0, len(nodes), block_size):
+
+        # Block of unit vectors for this chunk of nodes, or saved vectors
+        chunk = nodes[start:start + block_size]
+        rows = slice(start, start + len(chunk))
+        if vectors is None:
+            first = 0
+            prev = np.zeros((num_nodes, len(chunk)))
+            prev[chunk, np.arange(len(chunk))] = 1
+        else:
+            first = min_power // 2
+            prev = np.asarray(vectors, dtype=np.float64)
+
+        # Columns of the block known to hold exact integers
+        prev_exact = np.zeros(len(chunk), dtype=bool)
+        if integral:
+            prev_exact = _exact_columns(np.ldexp(prev, -shift * first))
+
+        # Even power 2s of the saved vectors x_s
+        if min_power <= 2 * first <= max_power:
+            col = 2 * first - min_power
+            walks[rows, col] = np.einsum('ij,ij->j', prev, prev)
+            exact[rows, col] = prev_exact & (
+                walks[rows, col] < limit(2 * first)
+            )
+
+        # Stream x_p = A**p e_i, reading off two diagonals per product
+        for p in range(first + 1, (max_power + 1) // 2 + 1):
+            with profiling.span('power_step', power=2 * p):
+                cur = a.dot(prev)
+            cur_exact = prev_exact
+            if integral and len(cur):
+                cur_exact = prev_exact & (
+                    cur.max(axis=0) < limit(p)
+                )
+
+            # Odd power 2p - 1
+            if 2 * p - 1 >= min_power:
+                col = 2 * p - 1 - min_power
+                walks[rows, col] = np.einsum('ij,ij->j', prev, cur)
+                exact[rows, col] = cur_exact & (
+                    walks[rows, col] < limit(2 * p - 1)
+                )
+
+            # Even power 2p
+            if min_power <= 2 * p <= max_power:
+                col = 2 * p - min_power
+                walks[rows, col] = np.einsum('ij,ij->j', cur, cur)
+                exact[rows, col] = cur_exact & (
+                    walks[rows, col] < limit(2 * p)
+                )
+
+            prev, prev_exact = cur, cur_exact
+
+    _save_vectors(state, keep, max_power, prev if len(nodes) else None)
+
+    if return_exact:
+        return walks, exact
+    return walks
+
+
+def _power_of_two_shift(a):
+    """Find the exponent of a power of two dividing a matrix to integers.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        A csr matrix of floats.
+
+    Returns
+    -------
+    Number
+        The exponent s <= 0 of the largest power of two 2**s at most 1
+        and at most the smallest positive entry of `a`, so that `a` is a
+        matrix of integers divided by 2**(-s) exactly when its entries
+        are multiples of 2**s.
+    """
+    positive = a.data[a.data > 0]
+    if not len(positive):
+        return 0
+    return min(0, int(np.floor(np.log2(positive.min()))))
+
+
+def _exact_limit(shift):
+    """Scale FLOAT_EXACT_LIMIT by 2**shift.
+
+    Integer values scaled by 2**shift stay exact while they are normal
+    floats, so the limit is 0, and no value exact, once 2**shift is
+    subnormal.
+    """
+    if shift < np.finfo(np.float64).minexp:
+        return 0.0
+    return np.ldexp(float(FLOAT_EXACT_LIMIT), shift)
+
+
+def _exact_columns(x):
+    """Find the columns of a block that hold small nonnegative integers.
+
+    Parameters
+    ----------
+    x : Numpy Array
+        A float64 block of vectors.
+
+    Returns
+    -------
+    Numpy Array
+        A boolean array marking the columns whose entries are integers
+        in [0, FLOAT_EXACT_LIMIT).
+    """
+    if not len(x):
+        return np.ones(x.shape[1], dtype=bool)
+    return (
+        np.all(x == np.round(x), axis=0) &
+        (x.min(axis=0) >= 0) &
+        (x.max(axis=0) < FLOAT_EXACT_LIMIT)
+    )
+
+
+def _resume_vectors(state, min_power, num_vectors):
+    """Find saved vectors to resume a closed walk computation from.
+
+    Parameters
+    ----------
+    state : Dict
+        State left by an earlier call, or None.
+    min_power : Number
+        Smallest power of the adjacency matrix still to be computed.
+    num_vectors : Number
+        Number of requested nodes.
+
+    Returns
+    -------
+    Numpy Array
+        The saved block of vectors A**(min_power // 2) e_i, or None if
+        `state` cannot be resumed from.
+    """
+    if not state or state.get('vectors') is None:
+        return None
+    if state.get('power') != min_power // 2 or min_power < 2:
+        return None
+    if state['vectors'].shape[1] != num_vectors:
+        return None
+    return state['vectors']
+
+
+def _save_vectors(state, keep, max_power, vectors):
+    """Save the last block of vectors of a closed walk computation.
+
+    Parameters
+    ----------
+    state : Dict
+        State to update in place, or None.
+    keep : Boolean
+        Whether or not the vectors of every requested node were held
+        in a single block within the memory budget.
+    max_power : Number
+        Largest power of the adjacency matrix computed.
+    vectors : Numpy Array
+        The block of vectors A**((max_power + 1) // 2) e_i.
+    """
+    if state is None:
+        return
+    state['power'] = (max_power + 1) // 2
+    state['vectors'] = vectors if keep else None
+
+
+def _integer_matrix(a):
+    """Convert an adjacency matrix to a csr matrix of int64 entries.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Adjacency matrix of a graph.
+
+    Returns
+    -------
+    Scipy Sparse Matrix
+        `a` as a csr matrix with dtype int64.
+
+    Raises
+    ------
+    Exception
+        Raised if `a` has non-integer entries, in which case walk
+        counts cannot be computed exactly.
+    """
+    a = sp.sparse.csr_matrix(a)
+    if np.any(a.data != np.round(a.data)):
+        raise Exception('Exact walk counts require integer edge weights.')
+    return sp.sparse.csr_matrix(a, dtype=np.int64)
+
+
+def _object_dot(a, x):
+    """Multiply a sparse int64 matrix by a dense block of python integers.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        A csr matrix with dtype int64.
+    x : Numpy Array
+        A dense n x b array with dtype=object.
+
+    Returns
+    -------
+    Numpy Array
+        The n x b product `a * x` with dtype=object.
+    """
+    # Start from zeros so empty rows of `a` stay zero
+    product = np.zeros(x.shape, dtype=object)
+    if x.shape[1] == 0 or a.nnz == 0:
+        return product
+
+    # Sum the weighted neighbor rows of each row of `a`
+    terms = x[a.indices] * a.data.astype(object)[:, None]
+    nonempty = np.diff(a.indptr) > 0
+    product[nonempty] = np.add.reduceat(
+        terms,
+        a.indptr[:-1][nonempty],
+        axis=0
+    )
+    return product
+
+
+def _exact_dots(x, y, x_obj, y_obj, native, promoted):
+    """Calculate exact column-wise dot products of two blocks.
+
+    Columns held in int64 use native arithmetic unless a float64
+    estimate of their dot product reaches INT64_LIMIT, in which case
+    they are summed as python integers.
+
+    Parameters
+    ----------
+    x, y : Numpy Array
+        int64 blocks holding the columns listed in `native`.
+    x_obj, y_obj : Numpy Array
+        Object blocks holding the columns listed in `promoted`.
+    native, promoted : Numpy Array
+        Block column indices of the int64 and object columns.
+
+    Returns
+    -------
+    Numpy Array
+        Dot products of matching columns with dtype=object, ordered by
+        block column index.
+    """
+    dots = np.zeros(len(native) + len(promoted), dtype=object)
+
+    # Estimate the native dot products to detect overflow
+    estimate = np.einsum('ij,ij->j', x.astype(float), y.astype(float))
+    safe = np.abs(estimate) < INT64_LIMIT
+    dots[native[safe]] = np.einsum('ij,ij->j', x[:, safe], y[:, safe])
+    dots[native[~safe]] = (
+        x[:, ~safe].astype(object) * y[:, ~safe].astype(object)
+    ).sum(axis=0)
+
+    # Promoted columns are always summed as python integers
+    if len(promoted):
+        dots[promoted] = (x_obj * y_obj).sum(axis=0)
+
+    return dots
+
+
+def exact_closed_walks(a, max_power, nodes=None,
+                       memory_budget=MEMORY_BUDGET, min_power=2,
+                       state=None):
+    """Calculate the diagonals of A**min_power through A**max_power exactly.
+
+    Works like `closed_walks`, but the blocks of vectors are held in
+    int64. Before each product the growth of every column is bounded
+    by the largest row sum of A, and any column that could leave the
+    int64 range is promoted to python integers. Only those columns pay
+    for arbitrary precision arithmetic.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Symmetric adjacency matrix of a graph with integer entries.
+    max_power : Number
+        Largest power of `a` whose diagonal is computed.
+    nodes : List, optional
+        Indices of the nodes whose diagonal entries are computed
+        (default all nodes).
+    memory_budget : Number, optional
+        Maximum number of bytes used by the int64 blocks of vectors
+        (default MEMORY_BUDGET).
+    min_power : Number, optional
+        Smallest power of `a` whose diagonal is computed (default 2).
+    state : Dict, optional
+        Vectors to resume from, updated in place, as in `closed_walks`.
+        Saved vectors are int64, or dtype=object once any column has
+        been promoted.
+
+    Returns
+    -------
+    Numpy Array
+        A len(nodes) x (max_power - min_power + 1) array with dtype=object
+        whose entries are python arbitrary precision integers.
+    """
+    # Work with a csr matrix of int64
+    a = _integer_matrix(a)
+    num_nodes = a.shape[0]
+
+    # Largest possible growth factor of a vector entry per product
+    growth = float(max(1, abs(a).sum(axis=1).max())) if a.nnz else 1.0
+
+    # Default to every node in the graph
+    if nodes is None:
+        nodes = np.arange(num_nodes)
+    nodes = np.asarray(nodes, dtype=np.intp)
+
+    # Output matrix, one row per requested node
+    walks = np.zeros(
+        (len(nodes), max(0, max_power - min_power + 1)),
+        dtype=object
+    )
+
+    # Three int64 blocks and one float64 estimate are alive at once
+    block_size = _block_size(num_nodes, 4, 8, memory_budget)
+
+    # Resume from saved vectors, which hold every requested node at once
+    vectors = _resume_vectors(state, min_power, len(nodes))
+    if vectors is not None:
+        block_size = max(block_size, len(nodes))
+    keep = state is not None and len(nodes) <= block_size
+    saved = None
+
+    # Process the unit vectors one block at a time
+    for start in range(0, len(nodes), block_size):
+
+        # Block of unit vectors for this chunk of nodes
+        chunk = nodes[start:start + block_size]
+        rows = slice(start, start + len(chunk))
+        native = np.arange(len(chunk))
+        promoted = np.arange(0)
+        if vectors is None:
+            first = 0
+            prev = np.zeros((num_nodes, len(chunk)), dtype=np.int64)
+            prev[chunk, native] = 1
+            prev_obj = np.zeros((num_nodes, 0), dtype=object)
+
+        # Saved vectors keep python integers only for the columns
+        # that no longer fit in int64
+        else:
+            first = min_power // 2
+            if vectors.dtype == object:
+                fits = np.array([
+                    max(abs(value) for value in column) < INT64_LIMIT
+                    for column in vectors.T
+                ], dtype=bool)
+                promoted = native[~fits]
+                native = native[fits]
+                prev = vectors[:, native].astype(np.int64)
+                prev_obj = vectors[:, promoted]
+            else:
+                prev = vectors
+                prev_obj = np.zeros((num_nodes, 0), dtype=object)
+
+        # Even power 2s of the saved vectors x_s
+        if min_power <= 2 * first <= max_power:
+            walks[rows, 2 * first - min_power] = _exact_dots(
+                prev, prev, prev_obj, prev_obj, native, promoted
+            )
+
+        # Stream x_p = A**p e_i, reading off two diagonals per product
+        for p in range(first + 1, (max_power + 1) // 2 + 1):
+
+            # Promote columns whose next product may overflow int64
+            bound = np.abs(prev).max(axis=0).astype(float) * growth
+            unsafe = bound >= INT64_LIMIT
+            if np.any(unsafe):
+                prev_obj = np.concatenate(
+                    (prev_obj, prev[:, unsafe].astype(object)),
+                    axis=1
+                )
+                promoted = np.concatenate((promoted, native[unsafe]))
+                native = native[~unsafe]
+                prev = prev[:, ~unsafe]
+
+            # Advance both parts of the block
+            with profiling.span('power_step', power=2 * p) as record:
+                cur = a.dot(prev)
+                cur_obj = _object_dot(a, prev_obj)
+                if record is not None:
+                    record['promoted'] = len(promoted)
+
+            # Odd power 2p - 1
+            if 2 * p - 1 >= min_power:
+                walks[rows, 2 * p - 1 - min_power] = _exact_dots(
+                    prev, cur, prev_obj, cur_obj, native, promoted
+                )
+
+            # Even power 2p
+            if min_power <= 2 * p <= max_power:
+                walks[rows, 2 * p - min_power] = _exact_dots(
+                    cur, cur, cur_obj, cur_obj, native, promoted
+                )
+
+            prev, prev_obj = cur, cur_obj
+
+        # Reassemble the block in column order to save it
+        if keep:
+            if len(promoted):
+                saved = np.zeros((num_nodes, len(chunk)), dtype=object)
+                saved[:, native] = prev.astype(object)
+                saved[:, promoted] = prev_obj
+            else:
+                saved = prev
+
+    _save_vectors(state, keep, max_power, saved)
+
+    return walks
+
+
+def _is_prime(n):
+    """Determine whether or not a number below 3215031751 is prime.
+
+    Uses the Miller-Rabin test with bases 2, 3, 5 and 7, which is
+    deterministic in that range.
+
+    Parameters
+    ----------
+    n : Number
+        The number to test.
+
+    Returns
+    -------
+    Boolean
+        True if `n` is prime.
+    """
+    if n < 2:
+        return False
+    for base in (2, 3, 5, 7):
+        if n % base == 0:
+            return n == base
+
+    # Write n - 1 as d * 2**r with d odd
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+
+    # Look for a witness to the compositeness of n
+    for base in (2, 3, 5, 7):
+        x = pow(base, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def walk_primes(a, max_power):
+    """Choose primes whose product exceeds every closed walk count.
+
+    Every entry of A**k is at most r**k, where r is the largest row sum
+    of A, so residues modulo primes whose product exceeds
+    r**max_power determine the walk counts exactly.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Adjacency matrix of a graph with nonnegative integer entries.
+    max_power : Number
+        Largest power of `a` whose diagonal is computed.
+
+    Returns
+    -------
+    List
+        Primes below PRIME_LIMIT in descending order.
+
+    Raises
+    ------
+    Exception
+        Raised if a row sum of `a` is too large for residues
+        to be multiplied in int64.
+    """
+    a = _integer_matrix(a)
+    growth = int(abs(a).sum(axis=1).max()) if a.nnz else 1
+    if growth * PRIME_LIMIT >= 2 ** 63:
+        raise Exception('Row sums are too large for modular walk counts.')
+
+    # Collect primes until their product bounds every walk count
+    bound = max(1, growth) ** max_power
+    primes = []
+    product = 1
+    candidate = PRIME_LIMIT - 1
+    while product <= bound:
+        if _is_prime(candidate):
+            primes.append(candidate)
+            product *= candidate
+        candidate -= 1
+    return primes
+
+
+def modular_closed_walks(a, max_power, primes, nodes=None,
+                         memory_budget=MEMORY_BUDGET, min_power=2):
+    """Calculate residues of the diagonals of A**min_power to A**max_power.
+
+    For each prime q the unit vectors of the requested nodes are
+    multiplied by A in int64 blocks, reducing modulo q after every
+    product, and (A**k)_ii mod q is read off the block.
+
+    Parameters
+    ----------
+    a : Scipy Sparse Matrix
+        Adjacency matrix of a graph with nonnegative integer entries.
+    max_power : Number
+        Largest power of `a` whose diagonal is computed.
+    primes : List
+        Primes below PRIME_LIMIT, as returned by `walk_primes`.
+    nodes : List, optional
+        Indices of the nodes whose diagonal entries are computed
+        (default all nodes).
+    memory_budget : Number, optional
+        Maximum number of bytes used by the blocks of vectors
+        (default MEMORY_BUDGET).
+    min_power : Number, optional
+        Smallest power of `a` whose diagonal is computed (default 2).
+
+    Returns
+    -------
+    Numpy Array
+        A len(primes) x len(nodes) x (max_power - min_power + 1) int64
+        array of residues of (A**min_power)_ii through (A**max_power)_ii.
+    """
+    # Work with a csr matrix of int64
+    a = _integer_matrix(a)
+    num_nodes = a.shape[0]
+
+    # Default to every node in the graph
+    if nodes is None:
+        nodes = np.arange(num_nodes)
+    nodes = np.asarray(nodes, dtype=np.intp)
+
+    # Output residues, one matrix per prime
+    residues = np.zeros(
+        (len(primes), len(nodes), max(0, max_power - min_power + 1)),
+        dtype=np.int64
+    )
+
+    # Two int64 blocks are alive at once
+    block_size = _block_size(num_nodes, 2, 8, memory_budget)
+
+    for idx, prime in enumerate(primes):
+
+        # Reduce the adjacency matrix once per prime
+        a_mod = a.copy()
+        a_mod.data %= prime
+
+        # Process the unit vectors one block at a time
+        for start in range(0, len(nodes), block_size):
+
+            # Block of unit vectors for this chunk of nodes
+            chunk = nodes[start:start + block_size]
+            cols = np.arange(len(chunk))
+            block = np.zeros((num_nodes, len(chunk)), dtype=np.int64)
+            block[chunk, cols] = 1
+
+            # Stream x_p = A**p e_i mod q, reading its entry at node i
+            for power in range(1, max_power + 1):
+                with profiling.span('power_step', power=power, prime=prime):
+                    block = a_mod.dot(block) % prime
+                if power >= min_power:
+                    column = power - min_power
+                    residues[idx, start:start + len(chunk), column] = (
+                        block[chunk, cols]
+                    )
+
+    return residues
+
+
+def chinese_remainder(residues, primes):
+    """Rebuild integers from their residues modulo distinct primes.
+
+    Uses Garner's algorithm on python integers, vectorized over the
+    entries of `residues`.
+
+    Parameters
+    ----------
+    residues : Numpy Array
+        An array whose first axis runs over `primes`, as returned by
+        `modular_closed_walks`.
+    primes : List
+        Distinct primes.
+
+    Returns
+    -------
+    Numpy Array
+        Array of shape residues.shape[1:] with dtype=object, holding the
+        unique integers in [0, prod(primes)) with the given residues.
+    """
+    values = residues[0].astype(object)
+    modulus = 1
+    for idx, prime in enumerate(primes):
+        if idx > 0:
+            inverse = pow(modulus % prime, prime - 2, prime)
+            digit = (
+                (residues[idx].astype(object) - values) * inverse
+            ) % prime
+            values = values + modulus * digit
+        modulus *= prime
+    return values
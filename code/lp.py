@@ -0,0 +1,179 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for solving the linear programs of walk matrices.
+
+Every program has the form
+
+    minimize c.x  subject to  A_eq x = b_eq,  bounds[i][0] <= x_i
+
+Constraints on single variables are passed to the solver as bounds, not
+as rows of an identity matrix. When scipy provides the HiGHS solvers the
+equality constraints are passed as a sparse matrix, and many small
+programs can be solved in a few calls as block diagonal programs.
+"""
+
+# Imports
+import numpy as np
+import scipy as sp
+import scipy.optimize
+import scipy.sparse
+from code import profiling
+
+
+# Status of a successful solve, as reported by scipy.optimize.linprog
+OPTIMAL = 0
+
+# Maximum number of programs stacked into one block diagonal program
+BATCH_SIZE = 64
+
+# Method used with scipy.optimize.linprog, determined on first use
+_METHOD = []
+
+
+def method():
+    """Choose the method used with scipy.optimize.linprog.
+
+    Returns
+    -------
+    String
+        'highs' if this version of scipy supports it, or None for the
+        default method.
+    """
+    if not _METHOD:
+        try:
+            sp.optimize.linprog(c=[1.0], bounds=[(0, None)], method='highs')
+            _METHOD.append('highs')
+        except ValueError:
+            _METHOD.append(None)
+    return _METHOD[0]
+
+
+def linear_program(c, A_eq, b_eq, bounds):
+    """Solve a linear program.
+
+    Parameters
+    ----------
+    c : Numpy Array
+        Coefficients of the objective.
+    A_eq : Numpy Matrix | Scipy Sparse Matrix
+        Matrix of the equality constraints.
+    b_eq : Numpy Array
+        Right hand side of the equality constraints.
+    bounds : List
+        A (lower, upper) pair per variable, None meaning unbounded.
+
+    Returns
+    -------
+    Scipy Optimize Result
+        The result from calling scipy.optimize.linprog
+    """
+    options = {}
+    if method() is not None:
+        options['method'] = method()
+        A_eq = sp.sparse.csr_matrix(A_eq, dtype=np.float64)
+    else:
+        A_eq = np.asarray(
+            A_eq.toarray() if sp.sparse.issparse(A_eq) else A_eq,
+            dtype=np.float64
+        )
+
+    with profiling.span(
+            'linprog',
+            backend=method() or 'default',
+            shape=A_eq.shape):
+        return sp.optimize.linprog(
+            c=np.asarray(c, dtype=np.float64),
+            A_eq=A_eq,
+            b_eq=np.asarray(b_eq, dtype=np.float64).ravel(),
+            bounds=bounds,
+            **options
+        )
+
+
+def linear_programs(problems, batch_size=BATCH_SIZE):
+    """Solve many small linear programs.
+
+    With the HiGHS solvers up to `batch_size` programs are stacked into
+    one block diagonal program. The objective is a sum over the blocks,
+    so its solution restricted to each block solves that block's program.
+    If a stacked program has no solution, its programs are solved one at
+    a time instead, so a batch costs at most one extra solve. Without
+    HiGHS every program is solved on its own.
+
+    Parameters
+    ----------
+    problems : Iterable
+        Dicts of the keyword arguments of `linear_program`.
+    batch_size : Number
+        Maximum number of programs solved at once (default BATCH_SIZE).
+
+    Returns
+    -------
+    List
+        A Scipy Optimize Result per program, in order.
+    """
+    problems = list(problems)
+    if method() is None:
+        return [linear_program(**problem) for problem in problems]
+
+    results = []
+    for start in range(0, len(problems), batch_size):
+        results.extend(_stacked(problems[start:start + batch_size]))
+    return results
+
+
+def _stacked(problems):
+    """Solve linear programs as one block diagonal program.
+
+    Parameters
+    ----------
+    problems : List
+        Dicts of the keyword arguments of `linear_program`.
+
+    Returns
+    -------
+    List
+        A Scipy Optimize Result per program, in order.
+    """
+    if len(problems) <= 1:
+        return [linear_program(**problem) for problem in problems]
+
+    # Solve the stacked program
+    res = linear_program(
+        c=np.concatenate([problem['c'] for problem in problems]),
+        A_eq=sp.sparse.block_diag(
+            [sp.sparse.csr_matrix(problem['A_eq'], dtype=np.float64)
+             for problem in problems],
+            format='csr'
+        ),
+        b_eq=np.concatenate([
+            np.asarray(problem['b_eq'], dtype=np.float64).ravel()
+            for problem in problems
+        ]),
+        bounds=[bound for problem in problems for bound in problem['bounds']]
+    )
+
+    # Some program has no solution, so solve each on its own
+    if res.status != OPTIMAL:
+        return [linear_program(**problem) for problem in problems]
+
+    # Split the solution into the solution of each program
+    results = []
+    start = 0
+    for problem in problems:
+        c = np.asarray(problem['c'], dtype=np.float64)
+        x = res.x[start:start + len(c)]
+        start += len(c)
+        results.append(sp.optimize.OptimizeResult(
+            x=x,
+            fun=float(c.dot(x)),
+            status=res.status,
+            success=res.success,
+            message=res.message,
+            nit=res.nit
+        ))
+    return results
@@ -0,0 +1,497 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for analyzing batches of generated graphs."""
+
+# Imports
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait
+)
+from functools import partial
+import numpy as np
+from code import generators as gen, polygraph, profiling, SPIDERDONUTS
+
+
+# Flip-flopping properties checked for every graph
+FLIP_FLOPS = [
+    ('pair_wise', polygraph.pair_wise_flip_flopping),
+    ('dominant', polygraph.dominant_flip_flopping),
+    ('set_average', polygraph.set_average_flip_flopping),
+    ('each_class_max', polygraph.each_class_max)
+]
+
+
+# Spiderdonuts logger
+logger = logging.getLogger(SPIDERDONUTS)
+
+
+def _spec(spec):
+    """Normalize a graph spec to a (generator name, params) tuple.
+
+    Parameters
+    ----------
+    spec : Dict | Tuple
+        Either a dict with keys `generator` and `params`, or a tuple
+        (generator, params). `params` is a dict of keyword arguments or
+        a list of positional arguments, and may be omitted.
+
+    Returns
+    -------
+    Tuple
+        The generator name and its params.
+    """
+    if isinstance(spec, dict):
+        return spec['generator'], spec.get('params', {})
+    if isinstance(spec, str):
+        return spec, {}
+    return spec[0], spec[1] if len(spec) > 1 else {}
+
+
+def _linear_system_result(res):
+    """Summarize the result of a linear program.
+
+    Parameters
+    ----------
+    res : Scipy Optimize Result
+        The result from calling scipy.optimize.linprog
+
+    Returns
+    -------
+    Dict
+        The success flag, status code, message and solution of `res`.
+    """
+    return {
+        'success': bool(res.success),
+        'status': int(res.status),
+        'message': str(res.message),
+        'x': None if res.x is None else np.asarray(res.x).tolist()
+    }
+
+
+def analyze(spec, max_power=None, arbitrary_precision=False,
+            linear_systems=True, cache=None):
+    """Generate a graph and analyze its walk classes.
+
+    Parameters
+    ----------
+    spec : Dict | Tuple
+        The generator in `code.generators` and its params, as accepted
+        by `_spec`. A generator returning a dict is either `spider_torus`
+        or returns a Kronecker operator along with the graph.
+    max_power : Number
+        Maximum power passed to `polygraph.walk_classes`.
+    arbitrary_precision : Boolean | String
+        Precision mode passed to the walk class analysis.
+    linear_systems : Boolean
+        Whether or not to solve the positive and nonnegative linear
+        systems (default True).
+    cache : cache.Cache
+        An optional on-disk cache of walk matrices, eigenvalues and
+        expm diagonals, shared by every worker.
+
+    Returns
+    -------
+    Dict
+        A dict consisting of the following:
+        generator    - Name of the generator
+        params       - Params of the generator
+        num_nodes    - Number of nodes of the graph
+        num_classes  - The number `N` of walk classes
+        class_sizes  - Number of nodes in each walk class
+        flip_flops   - Dict of the flip-flopping properties that hold
+        certificate  - Certificate of the flip-flopping properties, as
+                       returned by `polygraph.flip_flop_certificate`
+        positive     - Result of `positive_linear_system_check`
+        nonnegative  - Result of `nonnegative_linear_system_check`
+        timings      - Seconds spent in each stage
+        profile      - Count, wall time and peak RSS of each span
+                       recorded by `profiling`, totaled by name
+        error        - Description of the exception raised while
+                       analyzing the graph, or None
+    """
+    name, params = _spec(spec)
+    result = {
+        'generator': name,
+        'params': params,
+        'timings': {},
+        'error': None
+    }
+
+    try:
+        # Generate the graph
+        start = time.time()
+        generator = getattr(gen, name)
+        if isinstance(params, dict):
+            g = generator(**params)
+        else:
+            g = generator(*params)
+        result['timings']['generate'] = time.time() - start
+    except Exception as e:
+        logger.warn('Failed to generate {} {}: {}'.format(name, params, e))
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        return result
+
+    return _analyze(g, result, max_power, arbitrary_precision,
+                    linear_systems, cache)
+
+
+def analyze_graph(g, params=None, generator=None, max_power=None,
+                  arbitrary_precision=False, linear_systems=True,
+                  cache=None):
+    """Analyze the walk classes of a generated graph.
+
+    Parameters
+    ----------
+    g : Networkx Graph | Dict
+        Output of a generator in `code.generators`, as yielded by
+        `generators.sweep`.
+    params : Dict
+        Params of the generator, recorded in the result.
+    generator : String
+        Name of the generator, recorded in the result.
+    max_power, arbitrary_precision, linear_systems, cache
+        As in `analyze`.
+
+    Returns
+    -------
+    Dict
+        The same dict as `analyze`.
+    """
+    result = {
+        'generator': generator,
+        'params': params,
+        'timings': {},
+        'error': None
+    }
+    return _analyze(g, result, max_power, arbitrary_precision,
+                    linear_systems, cache)
+
+
+def _analyze(g, result, max_power, arbitrary_precision, linear_systems,
+             cache):
+    """Analyze a generated graph, filling in and returning `result`."""
+    trace = profiling.new_trace()
+    with profiling.recording(trace):
+        _analyze_stages(g, result, max_power, arbitrary_precision,
+                        linear_systems, cache)
+    result['profile'] = profiling.summary(trace)
+    return result
+
+
+def _analyze_stages(g, result, max_power, arbitrary_precision,
+                    linear_systems, cache):
+    """Run each stage of `_analyze`, filling in `result`."""
+    timings = result['timings']
+
+    try:
+        # Analyze walk classes
+        start = time.time()
+        if type(g) is dict and 'representatives' in g:
+            graph = g['graph']
+            w_obj = polygraph.spider_torus_walk_classes(
+                g,
+                arbitrary_precision
+            )
+        else:
+            graph, operator = g, None
+            if type(g) is dict:
+                graph, operator = g['graph'], g['operator']
+            w_obj = polygraph.walk_classes(
+                graph,
+                max_power,
+                arbitrary_precision,
+                cache=cache,
+                operator=operator
+            )
+        timings['walk_classes'] = time.time() - start
+
+        result['num_nodes'] = len(graph.nodes())
+        result['num_classes'] = w_obj['num_classes']
+        if 'classes' in w_obj:
+            result['class_sizes'] = [
+                len(w_obj['classes'][label])
+                for label in range(w_obj['num_classes'])
+            ]
+
+        # Check flip-flopping properties
+        start = time.time()
+        certificate = polygraph.flip_flop_certificate(
+            w_obj['uniq_matrix'],
+            [key for key, _ in FLIP_FLOPS],
+            short_circuit=False,
+            known=w_obj.get('flip_flops')
+        )
+        result['flip_flops'] = {
+            key: bool(certificate['conditions'][key]['holds'])
+            for key, _ in FLIP_FLOPS
+        }
+        result['certificate'] = certificate
+        timings['flip_flops'] = time.time() - start
+
+        # Solve the linear systems
+        if linear_systems:
+            start = time.time()
+            result['positive'] = _linear_system_result(
+                polygraph.positive_linear_system_check(w_obj)
+            )
+            timings['positive'] = time.time() - start
+
+            start = time.time()
+            result['nonnegative'] = _linear_system_result(
+                polygraph.nonnegative_linear_system_check(
+                    w_obj,
+                    cache=cache
+                )
+            )
+            timings['nonnegative'] = time.time() - start
+
+    except Exception as e:
+        logger.warn('Failed to analyze {} {}: {}'.format(
+            result['generator'],
+            result['params'],
+            e
+        ))
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+
+
+def analyze_batch(specs, workers=None, max_pending=None, **options):
+    """Analyze a batch of generated graphs across a pool of processes.
+
+    Specs are consumed lazily, and at most `max_pending` graphs are
+    in flight at any time, so arbitrarily long iterables of specs can be
+    analyzed in bounded memory.
+
+    Parameters
+    ----------
+    specs : Iterable
+        Graph specs, as accepted by `analyze`.
+    workers : Number
+        Number of worker processes (default os.cpu_count()). If 1 or
+        less, graphs are analyzed in the current process.
+    max_pending : Number
+        Maximum number of graphs submitted but not yet yielded
+        (default twice the number of workers). A ValueError is raised
+        unless it is at least 1.
+    options
+        Keyword arguments passed to `analyze`.
+
+    Yields
+    ------
+    Dict
+        The result of `analyze` for each spec, in order of completion.
+    """
+    return _imap(partial(analyze, **options), specs, workers, max_pending)
+
+
+def _analyze_pair(pair, generator=None, **options):
+    """Analyze a (params, graph) pair yielded by `generators.sweep`."""
+    params, g = pair
+    return analyze_graph(g, params, generator, **options)
+
+
+def analyze_sweep(pairs, generator=None, workers=1, max_pending=None,
+                  **options):
+    """Analyze the graphs of a parameter sweep as they are generated.
+
+    Parameters
+    ----------
+    pairs : Iterable
+        (params, graph) pairs, as yielded by `generators.sweep`.
+    generator : String
+        Name of the generator, recorded in each result.
+    workers : Number
+        Number of worker processes (default 1). Graphs are generated in
+        the current process and sent to the workers, so more workers
+        only pay off when analysis dominates generation.
+    max_pending : Number
+        Maximum number of graphs submitted but not yet yielded, as in
+        `analyze_batch`.
+    options
+        Keyword arguments passed to `analyze_graph`.
+
+    Yields
+    ------
+    Dict
+        The result of `analyze_graph` for each pair, in order of
+        completion.
+    """
+    task = partial(_analyze_pair, generator=generator, **options)
+    return _imap(task, pairs, workers, max_pending)
+
+
+def _imap(task, items, workers=None, max_pending=None):
+    """Lazily map a task over items across a pool of processes.
+
+    Parameters
+    ----------
+    task : Function
+        A picklable function of one item.
+    items : Iterable
+        Items, consumed no more than `max_pending` ahead of the results.
+    workers : Number
+        Number of worker processes (default os.cpu_count()). If 1 or
+        less, items are processed in the current process.
+    max_pending : Number
+        Maximum number of items submitted but not yet yielded
+        (default twice the number of workers). At least 1.
+
+    Returns
+    -------
+    Iterator
+        The result of `task` for each item, in order of completion.
+    """
+    if max_pending is not None and max_pending < 1:
+        raise ValueError(
+            'max_pending must be at least 1, not {}'.format(max_pending)
+        )
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Process in the current process
+    if workers <= 1:
+        return map(task, items)
+
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    return _pool_imap(task, items, workers, max_pending)
+
+
+def _pool_imap(task, items, workers, max_pending):
+    """Map a task over items in a pool of processes, as in `_imap`."""
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        # Keep the pool busy, but never more than max_pending items ahead
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    pending.add(executor.submit(task, next(items)))
+                except StopIteration:
+                    exhausted = True
+
+            # Yield results as they complete
+            if pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def _json_default(value):
+    """Convert numpy values, which json cannot encode, to python values."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
+
+
+def _flatten(result, prefix=''):
+    """Flatten nested dicts of a result into dotted keys.
+
+    Parameters
+    ----------
+    result : Dict
+        A result of `analyze`.
+    prefix : String
+        Prefix of every key.
+
+    Returns
+    -------
+    Dict
+        Scalars of `result` keyed by their path, e.g. 'flip_flops.dominant',
+        with lists and params encoded as JSON.
+    """
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict) and key != 'params':
+            flat.update(_flatten(value, prefix + key + '.'))
+        elif isinstance(value, (dict, list, tuple)):
+            flat[prefix + key] = json.dumps(value, default=_json_default)
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+# Columns written by `write_results` in csv format
+CSV_FIELDS = [
+    'generator',
+    'params',
+    'num_nodes',
+    'num_classes',
+    'class_sizes',
+    *['flip_flops.{}'.format(key) for key, _ in FLIP_FLOPS],
+    'positive.success',
+    'nonnegative.success',
+    'error'
+]
+
+
+def write_results(results, output, output_format='jsonl', append=True):
+    """Write results as they arrive, passing them on.
+
+    Each result is written and flushed before the next one is consumed,
+    so an interrupted sweep leaves every finished result in `output`.
+
+    Parameters
+    ----------
+    results : Iterable
+        Results of `analyze`, `analyze_graph` or their batch versions.
+    output : String | File
+        A path, or a file opened for writing.
+    output_format : String
+        'jsonl' for one JSON object per line, or 'csv' for the columns
+        in CSV_FIELDS (default 'jsonl').
+    append : Boolean
+        Whether or not to append to the file at path `output`, rather
+        than truncating it (default True).
+
+    Yields
+    ------
+    Dict
+        Each result, after it is written.
+    """
+    if output_format not in ('jsonl', 'csv'):
+        raise Exception('Unknown output format {}'.format(output_format))
+
+    close = isinstance(output, str)
+    if close:
+        write_header = not append or (
+            not os.path.exists(output) or os.path.getsize(output) == 0
+        )
+        output = open(output, 'a' if append else 'w', newline='')
+    else:
+        write_header = True
+
+    try:
+        writer = None
+        if output_format == 'csv':
+            writer = csv.DictWriter(
+                output,
+                fieldnames=CSV_FIELDS,
+                extrasaction='ignore'
+            )
+            if write_header:
+                writer.writeheader()
+
+        for result in results:
+            if writer is None:
+                output.write(json.dumps(result, default=_json_default) + '\n')
+            else:
+                writer.writerow(_flatten(result))
+            output.flush()
+            yield result
+    finally:
+        if close:
+            output.close()
@@ -10,28 +10,87 @@
 import networkx as nx
 import numpy as np
 import scipy as sp
+import scipy.sparse.csgraph
+import scipy.special
 import logging
-from itertools import chain, combinations
-from code import linalg, SPIDERDONUTS
+import time
+from code import arraygraph, linalg, lp, profiling, SPIDERDONUTS
 
 
 # Number of decimals used for floating point comparison
 DECIMALS = 10
 
+# Largest number of subsets of classes whose sums are held at once by
+# `set_average_flip_flopping_report`
+SUBSET_CHUNK = 2 ** 14
+
 # For a justification of MAX_POWER, see the pdf in /docs/notes-walk-entropy
 MAX_POWER = 14
 
+# Value of `arbitrary_precision` selecting exact walk counts computed
+# modulo several primes and rebuilt by chinese remaindering
+MODULAR = 'modular'
+
+# Value of `arbitrary_precision` selecting walk counts computed in float64,
+# with only the rows that may have lost precision recounted exactly
+ADAPTIVE = 'adaptive'
+
+# Values of `scale` dividing the column of walks of length k by the k-th
+# power of the power of two nearest the spectral radius, or then also by
+# the power of two nearest above the column maximum. Dividing by powers of
+# two is exact, so scaled columns compare exactly as the unscaled ones.
+SPECTRAL = 'spectral'
+COLUMN = 'column'
+
 
 # Spiderdonuts logger
 logger = logging.getLogger(SPIDERDONUTS)
 
 
+def _adjacency(graph):
+    """Get the adjacency matrix of a graph.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph | Scipy Sparse Matrix
+        A graph, or its adjacency matrix. The adjacency matrix of an
+        ArrayGraph is only built once.
+
+    Returns
+    -------
+    Scipy Sparse Matrix
+        The adjacency matrix in csr format, rows in graph.nodes() order.
+    """
+    if isinstance(graph, arraygraph.ArrayGraph):
+        return graph.adjacency()
+    if sp.sparse.issparse(graph):
+        return sp.sparse.csr_matrix(graph)
+    return sp.sparse.csr_matrix(nx.adjacency_matrix(graph))
+
+
+def _degrees(graph):
+    """Get the number of neighbors of each node of a graph.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        A graph.
+
+    Returns
+    -------
+    Numpy Array
+        The degrees in graph.nodes() order.
+    """
+    return np.diff(_adjacency(graph).indptr)
+
+
 def _necessary_flip_flip_conditions_check(
         w, full_columns, arbitrary_precision):
     """Check whether or not a walk matrix satisfies necessary flip-flop conditions.
 
     The pair-wise flip-flopping condition is known to be necessary.
-    We merely suspect the set-average condition is necessary.
+    We merely suspect the set-average condition is necessary. It implies
+    the pair-wise condition, so it is only checked when that holds.
 
     Parameters
     ----------
@@ -46,8 +105,9 @@ def _necessary_flip_flip_conditions_check(
 
     Returns
     -------
-    Tuple
-        A tuple with the check for each necessary condition.
+    Dict
+        The certificate of both conditions, as returned by
+        `flip_flop_certificate`.
     """
 
     # Warning template string
@@ -57,8 +117,13 @@ def _necessary_flip_flip_conditions_check(
     )
 
     # Check
-    pw = pair_wise_flip_flopping(w)
-    ac = set_average_flip_flopping(w)
+    certificate = flip_flop_certificate(
+        w,
+        ['pair_wise', 'set_average'],
+        short_circuit=False
+    )
+    pw = certificate['conditions']['pair_wise']['holds']
+    ac = certificate['conditions']['set_average']['holds']
 
     # Warn if either check failed
     if not pw:
@@ -81,10 +146,12 @@ def _necessary_flip_flip_conditions_check(
             )
 
     # Return result
-    return (pw, ac)
+    return certificate
 
 
-def _diag_matrix(graph, max_power=None, arbitrary_precision=False):
+def _diag_matrix(graph, max_power=None, arbitrary_precision=False,
+                 nodes=None, min_power=2, state=None, divisor=None,
+                 return_exact=False):
     """Calculate the matrix of diagonals for a graph.
 
     The matrix of diagonals is an n x (n - 1) matrix
@@ -93,110 +160,403 @@ def _diag_matrix(graph, max_power=None, arbitrary_precision=False):
 
     Parameters
     ----------
-    graph : Networkx Graph
-        A networkx graph
+    graph : ArrayGraph | Networkx Graph
+        A graph
     max_power: Number
         An optional maximum power to use in determining the walk matrix
         (default n, the number of nodes in the graph).
-    arbitrary_precision: Boolean
+    arbitrary_precision: Boolean | String
         Whether or not to compute the walk matrix using arbitrary
-        precision arithmetic. Using it is slow, but avoids numerical
-        difficulties. If arbitrary precision is used, calculations
-        will be performed on dense matrices. (Default False).
+        precision arithmetic. Walk counts are held in int64 and only
+        the columns that would overflow fall back to python integers
+        (see `linalg.exact_closed_walks`). If MODULAR, exact counts are
+        rebuilt from their residues modulo several primes (see
+        `_residue_matrix`). If ADAPTIVE, counts are computed in float64
+        and only rows that may have lost precision are recounted exactly
+        (see `_adaptive_closed_walks`). Either way the diagonals are
+        streamed from sparse products with blocks of unit vectors, so
+        memory stays within `linalg.MEMORY_BUDGET` (Default False).
+    nodes: List
+        Optional indices of the rows to compute (default all rows).
+    min_power: Number
+        Smallest power whose diagonal is computed (default 2).
+    state: Dict
+        Optional vectors to resume from, updated in place, as in
+        `linalg.closed_walks`. Ignored if `arbitrary_precision` is
+        MODULAR.
+    divisor: Number
+        Optional power of two the adjacency matrix is divided by, so that
+        column k holds the diagonal of (A / divisor)**k. Only used when
+        `arbitrary_precision` is False.
+    return_exact: Boolean
+        Whether or not to also return which entries are certainly exact,
+        as in `linalg.closed_walks`. Every entry is exact unless
+        `arbitrary_precision` is False (default False).
 
     Returns
     -------
-    Numpy Matrix
-        A numpy matrix with dtype=object where
-        data elements are python arbitrary
-        precision integer objects.
+    Numpy Matrix | tuple
+        A numpy matrix of float64 values, or with dtype=object where
+        data elements are python arbitrary precision integer objects
+        if `arbitrary_precision` is True. If `return_exact`, a tuple of
+        that matrix and a boolean array marking its exact entries.
     """
     # Get the total number of nodes in the graph
-    num_nodes = len(graph.nodes())
+    num_nodes = graph.number_of_nodes()
 
     # Set maximum power to n if not specified
     if not max_power:
         max_power = num_nodes
 
-    # List of all diagonals computed
-    diagonals = []
-
-    # Get adjacency matrix as a scipy sparse csr matrix.
-    # Specify object datatype if arbitrary precision is
-    # True to force use of python's default arbitrary
-    # precision integers.
-    if not arbitrary_precision:
-        a_1 = sp.sparse.csr_matrix(
-            nx.adjacency_matrix(graph),
-            dtype=np.float64
+    # Log start
+    logger.info(
+        'Calculating diagonals of powers of the '
+        'adjacency matrix in range {}..{}'
+        .format(min_power, max_power)
+    )
+
+    # Stream products of the sparse adjacency matrix with blocks of
+    # unit vectors. Powers of the adjacency matrix are never formed.
+    # Exact counts are held in int64, and only the columns that would
+    # overflow are promoted to python integers.
+    with profiling.span(
+            'closed_walks',
+            backend=_backend(arbitrary_precision),
+            min_power=min_power,
+            max_power=max_power):
+        diagonals, exact = _closed_walks(
+            graph,
+            max_power,
+            arbitrary_precision,
+            nodes,
+            min_power,
+            state,
+            divisor
         )
+
+    # Log end
+    logger.info('Finished calculating the diagonal matrix')
+
+    # Return the matrix of diagonals
+    if return_exact:
+        return np.matrix(diagonals), exact
+    return np.matrix(diagonals)
+
+
+def _closed_walks(graph, max_power, arbitrary_precision, nodes, min_power,
+                  state, divisor=None):
+    """Calculate diagonals of powers in the precision mode requested.
+
+    Returns
+    -------
+    tuple
+        A tuple of the diagonals and a boolean array marking the entries
+        that are certainly exact.
+    """
+    exact = None
+    if arbitrary_precision == ADAPTIVE:
+        diagonals = _adaptive_closed_walks(
+            graph,
+            max_power,
+            nodes,
+            min_power
+        )[0]
+    elif not arbitrary_precision:
+        adj = _adjacency(graph)
+        if divisor is not None:
+            adj = adj / divisor
+        diagonals, exact = linalg.closed_walks(
+            adj,
+            max_power,
+            nodes,
+            min_power=min_power,
+            state=state,
+            return_exact=True
+        )
+    elif arbitrary_precision == MODULAR:
+        primes, residues = _residue_matrix(
+            graph,
+            max_power,
+            nodes,
+            min_power
+        )
+        diagonals = linalg.chinese_remainder(residues, primes)
     else:
-        a_1 = np.matrix(
-            nx.adjacency_matrix(graph).todense(),
-            dtype=object
+        diagonals = linalg.exact_closed_walks(
+            _adjacency(graph),
+            max_power,
+            nodes,
+            min_power=min_power,
+            state=state
         )
 
-    # Make a copy to accumulate the product of
-    # the matrix from 2..n.
-    adj = a_1.copy()
+    # Counts of the exact modes are exact
+    if exact is None:
+        exact = np.ones(np.shape(diagonals), dtype=bool)
+    return diagonals, exact
 
-    # Log start
-    logger.info(
-        'Calculating diagonals of powers of the '
-        'adjacency matrix in range 2..{}'
-        .format(max_power)
+
+def _adaptive_closed_walks(graph, max_power, nodes=None, min_power=2):
+    """Calculate the matrix of diagonals in float64, escalating precision.
+
+    Walks are counted in float64 while tracking which entries are
+    certainly exact (see `linalg.closed_walks`). Rows holding any entry
+    that may have lost precision are recounted exactly with
+    `linalg.exact_closed_walks`, so the result is exact while only those
+    rows pay for integer arithmetic.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        A graph
+    max_power: Number
+        Maximum power used in determining the walk matrix.
+    nodes: List
+        Optional indices of the rows to compute (default all rows).
+    min_power: Number
+        Smallest power whose diagonal is computed (default 2).
+
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - an array with dtype=object of python integers, with a row per
+          requested node and a column per power
+        - the number of rows recounted exactly
+    """
+    adj = _adjacency(graph)
+    walks, exact = linalg.closed_walks(
+        adj,
+        max_power,
+        nodes,
+        min_power=min_power,
+        return_exact=True
     )
 
-    # Calculate A**2 through max_power
-    for i in range(2, max_power + 1):
+    # Exact rows are converted, the others recounted
+    certain = np.all(exact, axis=1)
+    diagonals = np.zeros(walks.shape, dtype=object)
+    diagonals[certain] = walks[certain].astype(np.int64).astype(object)
+    ambiguous = np.flatnonzero(~certain)
+    if len(ambiguous):
+        logger.info(
+            '{} of {} rows may have lost precision in float64, '
+            'recounting them exactly'.format(len(ambiguous), len(walks))
+        )
+        if nodes is not None:
+            ambiguous_nodes = np.asarray(nodes)[ambiguous]
+        else:
+            ambiguous_nodes = ambiguous
+        diagonals[ambiguous] = linalg.exact_closed_walks(
+            adj,
+            max_power,
+            ambiguous_nodes,
+            min_power=min_power
+        )
+    return diagonals, len(ambiguous)
 
-        # Calculate nth adj matrix
-        adj = adj.dot(a_1)
 
-        # Get the diagonal of the matrix
-        diag = adj.diagonal()
-        if type(diag) is not np.ndarray:
-            diag = diag.getA1()
+def _unique_rows(w):
+    """Find the distinct rows of a matrix.
 
-        # Append to list of diagonals
-        diagonals.append(diag)
+    Numeric rows are compared by their raw bytes, so duplicates are found
+    by a single vectorized sort. Rows of python integers (dtype=object)
+    are compared as tuples.
 
-    # Log end
-    logger.info('Finished calculating the diagonal matrix')
+    Parameters
+    ----------
+    w : Numpy Matrix
+        A matrix of diagonals, or of their residues.
 
-    # Return the matrix of diagonals
-    return np.matrix(diagonals).transpose()
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - an integer array with the index of the first copy of each
+          distinct row, in order of first appearance
+        - an integer array with the class label of each row, where
+          label i refers to the i-th distinct row
+    """
+    w = np.asarray(w)
+    num_rows = w.shape[0]
+
+    # Rows of python integers cannot be viewed as bytes
+    if w.dtype == object:
+        mapping = {}
+        labels = np.array(
+            [mapping.setdefault(tuple(row), len(mapping)) for row in w],
+            dtype=np.intp
+        )
+        _, first = np.unique(labels, return_index=True)
+        return first, labels
+
+    # Without columns every row is the same
+    if w.shape[1] == 0:
+        return np.zeros(min(1, num_rows), dtype=np.intp), \
+            np.zeros(num_rows, dtype=np.intp)
+
+    # View each row as a single opaque value of its raw bytes
+    w = np.ascontiguousarray(w)
+    rows = w.view(np.dtype((np.void, w.dtype.itemsize * w.shape[1])))
+    rows = rows.reshape(num_rows)
+
+    # Sorted distinct rows, the first copy of each, and the
+    # index of every row into the sorted distinct rows
+    _, first, inverse = np.unique(
+        rows,
+        return_index=True,
+        return_inverse=True
+    )
 
+    # Relabel classes in order of first appearance
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+
+    return first[order], rank[inverse.reshape(num_rows)]
 
-def _eigenvalues(graph):
-    """Calculate eigenvalues and eigenvectors of a graph.
+
+def _residue_matrix(graph, max_power, nodes=None, min_power=2):
+    """Calculate the matrix of diagonals modulo several primes.
+
+    The primes are chosen so that their product exceeds every entry
+    of the matrix of diagonals. Two rows are therefore equal exactly
+    when their residues are equal for every prime.
 
     Parameters
     ----------
-    graph : Networkx Graph
-        A networkx graph
+    graph : ArrayGraph | Networkx Graph
+        A graph
+    max_power: Number
+        Maximum power used in determining the walk matrix.
+    nodes: List
+        Optional indices of the rows to compute (default all rows).
+    min_power: Number
+        Smallest power whose diagonal is computed (default 2).
 
     Returns
     -------
     tuple
         A tuple containing
-        - eigenvalues
-        - eigenvectors
+        - the list of primes used
+        - an int64 array of shape
+          (num_primes, len(nodes), max_power - min_power + 1) holding the
+          residues of the matrix of diagonals modulo each prime
     """
     # Get the adjacency matrix
-    adj = nx.adjacency_matrix(graph).todense()
+    adj = _adjacency(graph)
 
-    # Return the eigenvalues
-    return np.linalg.eigh(adj)
+    # Choose enough primes to determine every walk count
+    primes = linalg.walk_primes(adj, max_power)
 
+    # Log start
+    logger.info(
+        'Calculating diagonals of powers of the adjacency matrix '
+        'in range {}..{} modulo {} primes'
+        .format(min_power, max_power, len(primes))
+    )
+
+    # Calculate the residues
+    residues = linalg.modular_closed_walks(
+        adj,
+        max_power,
+        primes,
+        nodes,
+        min_power=min_power
+    )
+
+    # Log end
+    logger.info('Finished calculating the residue matrix')
+
+    return primes, residues
+
+
+def _eigenvalues(graph):
+    """Calculate eigenvalues of a graph.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        A graph
 
-def _flip_flop_subset(w):
+    Returns
+    -------
+    Numpy Array
+        The eigenvalues of the adjacency matrix in ascending order
+        (see `linalg.eigenvalues`).
+    """
+    # Return the eigenvalues of the sparse adjacency matrix
+    return linalg.eigenvalues(_adjacency(graph))
+
+
+def _num_eigenvalues(graph, limit, cache=None):
+    """Count the distinct eigenvalues of a graph.
+
+    Eigenvalues are compared after rounding to DECIMALS. If a connected
+    component has more than `linalg.DENSE_LIMIT` nodes, the count is
+    instead estimated with `linalg.distinct_eigenvalue_count`, and only
+    counts up to `limit` are distinguished.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        A graph
+    limit : Number
+        Largest count of interest for the estimate.
+    cache: cache.Cache
+        An optional on-disk cache holding the eigenvalues.
+
+    Returns
+    -------
+    tuple
+        A tuple containing the number of distinct eigenvalues, or `limit`
+        if estimated to be at least `limit`, and whether or not the
+        number was estimated.
+    """
+    adj = _adjacency(graph)
+
+    # Estimate the count for graphs with large connected components
+    sizes = np.bincount(
+        sp.sparse.csgraph.connected_components(adj, directed=False)[1]
+    )
+    if len(sizes) and sizes.max() > linalg.DENSE_LIMIT:
+        logger.warn(
+            'A connected component has more than {} nodes. Estimating '
+            'the number of distinct eigenvalues up to {}, which may '
+            'undercount them.'.format(linalg.DENSE_LIMIT, limit)
+        )
+        with profiling.span('eigenvalues', backend='lanczos', nnz=adj.nnz):
+            return linalg.distinct_eigenvalue_count(adj, limit), True
+
+    with profiling.span('eigenvalues', backend='eigvalsh', nnz=adj.nnz):
+        eigenvalues = _cached(
+            cache,
+            graph,
+            ('eigenvalues',),
+            lambda: {'eigenvalues': _eigenvalues(graph)}
+        )['eigenvalues']
+    return len(np.unique(eigenvalues.round(decimals=DECIMALS))), False
+
+
+def _flip_flop_subset(w, return_indices=False):
     """Given a matrix, return a subset that has the same Flip-Flopping.
 
+    Every flip-flopping property asks that a set of requirements each be
+    met by some column, such as one class having more walks than another,
+    so removing columns can only lose a property. A subset therefore has
+    the same properties as `w` when its columns meet every requirement of
+    the properties `w` has. The requirements met by each column are held
+    as a bitmask, and combinations of columns are searched depth first in
+    lexicographic order, abandoning a prefix as soon as the remaining
+    columns cannot meet every requirement. Set-average flip-flopping is
+    only checked for combinations meeting all the other requirements.
+
     Parameters
     ----------
     w : Numpy Matrix
         A reduced walk matrix as returned by `walk_classes`
+    return_indices : Boolean
+        If True, return the indices of the columns instead (default False)
 
     Returns
     -------
@@ -205,44 +565,529 @@ def _flip_flop_subset(w):
         required to make a matrix which demonstrates the same
         Flip-Flopping properties as `w`.
     """
-    # Keep a list of flip-flopping properties to check
-    flip_flops = [
-        pair_wise_flip_flopping,
-        dominant_flip_flopping,
-        set_average_flip_flopping,
-        each_class_max
-    ]
-
-    # Calculate original flip-flopping properties
-    original_ff = np.array([ff(w) for ff in flip_flops])
-
     # Get matrix shape
     rows, cols = w.shape
+    w_arr = _walk_array(w)[0]
+
+    # Requirements met by each column. Pair-wise flip-flopping needs
+    # each class to have more walks than each other class somewhere,
+    # dominant flip-flopping and each class max need every class to
+    # dominate, or hold the maximum, somewhere.
+    greater = w_arr[:, None, :] > w_arr[None, :, :]
+    dominant = w_arr > w_arr.sum(0) - w_arr
+    is_max = w_arr == w_arr.max(axis=0)
+    has_max = is_max & (is_max.sum(axis=0) == 1)
+    met = np.concatenate((
+        greater.reshape((rows * rows, cols)),
+        dominant,
+        has_max
+    ))
+
+    # Encode the requirements met by each column as a bitmask
+    masks = [
+        sum(1 << int(bit) for bit in np.flatnonzero(met[:, col]))
+        for col in range(cols)
+    ]
+
+    # Bitmasks of the requirements of each property
+    pair_bits = sum(
+        1 << (i * rows + j)
+        for i in range(rows) for j in range(rows) if i != j
+    )
+    dominant_bits = ((1 << rows) - 1) << (rows * rows)
+    max_bits = dominant_bits << rows
+
+    # Calculate original flip-flopping properties. The subset has to meet
+    # the requirements of those that hold.
+    covered = 0
+    for mask in masks:
+        covered |= mask
+    required = 0
+    for bits in (pair_bits, dominant_bits, max_bits):
+        if covered & bits == bits:
+            required |= bits
+    check_average = set_average_flip_flopping(w)
+
+    # Requirements met by the columns from each index onwards
+    suffix = [0] * (cols + 1)
+    for col in range(cols - 1, -1, -1):
+        suffix[col] = suffix[col + 1] | masks[col]
 
     # Log start
     logger.info('Searching for flip-flop subset')
 
-    # Get list of lexicographically sorted combinations of indices
-    # and test each of them. Return the subset that works.
-    for indices in combinations(range(cols), rows):
-
-        # Take the subset
-        w_sub = w[:, indices]
-
-        # Calculate the subset's flip-flopping properties
-        new_ff = np.array([ff(w_sub) for ff in flip_flops])
+    def search(start, chosen, met):
+        # Check a full combination
+        if len(chosen) == rows:
+            if met & required != required:
+                return None
+            if check_average and not set_average_flip_flopping(
+                    w[:, chosen]):
+                return None
+            return chosen
+
+        # Extend the combination in lexicographic order, skipping
+        # prefixes that can no longer meet every requirement
+        for col in range(start, cols - (rows - len(chosen)) + 1):
+            if (met | suffix[col]) & required != required:
+                break
+            found = search(col + 1, chosen + [col], met | masks[col])
+            if found is not None:
+                return found
+        return None
 
-        # Check for equivalence
-        if np.all(original_ff == new_ff):
-            logger.info('Subset found')
-            return w_sub
+    # Search for the first subset in lexicographic order
+    indices = search(0, [], 0)
+    if indices is not None:
+        logger.info('Subset found')
+        return indices if return_indices else w[:, indices]
 
     # Return None as a default. Should never actually happen.
     return None
 
 
-def walk_classes(graph, max_power=None, arbitrary_precision=False):
-    """Analyze a networkx graph to determine its walk classes.
+def _walk_array(W):
+    """Convert a walk matrix to an ndarray suited to exact comparison.
+
+    Parameters
+    ----------
+    W : Numpy Matrix
+        Unique walk matrix as returned by `walk_classes`
+
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - the walk matrix as an ndarray, with dtype=object if it holds
+          integers too large for int64 sums, int64 if it holds other
+          integers, and float64 otherwise
+        - whether or not the entries are integers
+    """
+    w = np.asarray(W)
+
+    # Integer entries, held natively or as python integers
+    if w.dtype.kind in 'iu' or (w.dtype == object and all(
+            isinstance(x, (int, np.integer)) for x in w.flat)):
+        largest = max([abs(int(x)) for x in w.flat] + [0])
+        if largest * max(1, w.shape[0]) ** 2 < linalg.INT64_LIMIT:
+            return w.astype(np.int64), True
+        return w.astype(object), True
+
+    # Everything else is compared in floating point
+    return w.astype(np.float64), False
+
+
+def _subset_table(w, combine, empty):
+    """Combine the rows of `w` over every subset of rows.
+
+    Subsets are encoded as bitmasks, with bit i set when row i is in the
+    subset. The table is filled by doubling: the subsets containing row
+    b are the subsets of rows 0..b-1 combined with row b.
+
+    Parameters
+    ----------
+    w : Numpy Array
+        An N x L array.
+    combine : Function
+        A binary numpy ufunc, such as np.add or np.maximum.
+    empty : Number
+        Value of the empty subset.
+
+    Returns
+    -------
+    Numpy Array
+        A 2**N x L array whose row `mask` combines the rows in `mask`.
+    """
+    num_rows, num_cols = w.shape
+    table = np.empty((2 ** num_rows, num_cols), dtype=w.dtype)
+    table[0] = empty
+    for bit in range(num_rows):
+        table[2 ** bit:2 ** (bit + 1)] = combine(table[:2 ** bit], w[bit])
+    return table
+
+
+def _split_tables(w, combine, empty):
+    """Combine the rows of `w` over every subset of each half of the rows.
+
+    The row combining a subset `mask` of all rows is the combination of
+    the rows of its low and high halves, found with `_split_lookup`. The
+    tables hold 2 * 2**(N/2) rows rather than 2**N.
+
+    Parameters
+    ----------
+    w : Numpy Array
+        An N x L array.
+    combine : Function
+        A binary numpy ufunc, such as np.add or np.maximum.
+    empty : Number
+        Value of the empty subset.
+
+    Returns
+    -------
+    tuple
+        A tuple containing the tables of the low and high halves, as
+        returned by `_subset_table`, and the number of low rows.
+    """
+    low_rows = (w.shape[0] + 1) // 2
+    return (
+        _subset_table(w[:low_rows], combine, empty),
+        _subset_table(w[low_rows:], combine, empty),
+        low_rows
+    )
+
+
+def _split_lookup(tables, combine, masks):
+    """Combine the rows of `w` in each of an array of bitmasks.
+
+    Parameters
+    ----------
+    tables : tuple
+        Tables of `w` returned by `_split_tables`.
+    combine : Function
+        The ufunc the tables were built with.
+    masks : Numpy Array
+        An integer array of bitmasks.
+
+    Returns
+    -------
+    Numpy Array
+        A len(masks) x L array whose row i combines the rows in masks[i].
+    """
+    low, high, low_rows = tables
+    return combine(low[masks & (2 ** low_rows - 1)], high[masks >> low_rows])
+
+
+def _submasks(mask, num_rows, chunk=None):
+    """List the nonempty submasks of a bitmask, in chunks.
+
+    Parameters
+    ----------
+    mask : Number
+        A bitmask over `num_rows` bits.
+    num_rows : Number
+        Number of bits.
+    chunk : Number
+        Largest number of submasks yielded at once (default SUBSET_CHUNK).
+
+    Yields
+    ------
+    Numpy Array
+        Integer arrays of the nonempty submasks of `mask`, in increasing
+        order of the bits of `mask` they keep.
+    """
+    chunk = chunk or SUBSET_CHUNK
+    bits = [bit for bit in range(num_rows) if mask >> bit & 1]
+    for start in range(1, 2 ** len(bits), chunk):
+        counter = np.arange(
+            start,
+            min(start + chunk, 2 ** len(bits)),
+            dtype=np.int64
+        )
+        submasks = np.zeros(len(counter), dtype=np.int64)
+        for idx, bit in enumerate(bits):
+            submasks |= ((counter >> idx) & 1) << bit
+        yield submasks
+
+
+def _default_max_power(graph):
+    """Choose a maximum power for the walk matrix of a graph.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        A graph
+
+    Returns
+    -------
+    Number
+        The minimum of the number of nodes in the graph and another
+        value (usually near 14) computed based on the max degree.
+    """
+    degree_max = _degrees(graph).max()
+    k = int(53 / (np.log(degree_max) / np.log(2)))
+
+    # this value of k computed  to avoid numerical errors
+    # but MAX_POWER set as lowerbound to attempt to ensure that
+    # the linear system has large enough dimension to have a feasible point
+    return min(graph.number_of_nodes(),  max(MAX_POWER,  k))
+
+
+def _backend(arbitrary_precision, operator=None):
+    """Name the method used to count closed walks, for `profiling`."""
+    if operator is not None:
+        return 'operator'
+    if arbitrary_precision in (MODULAR, ADAPTIVE):
+        return arbitrary_precision
+    return 'exact' if arbitrary_precision else 'float64'
+
+
+def _walk_matrix(graph, max_power, arbitrary_precision, state=None,
+                 divisor=None):
+    """Calculate the matrix of diagonals and label its distinct rows.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        The graph that will be analyzed.
+    max_power: Number
+        Maximum power used in determining the walk matrix.
+    arbitrary_precision: Boolean | String
+        Precision mode, as in `walk_classes`.
+    state: Dict
+        Optional dict filled with the vectors reached at max_power, if
+        they fit in memory (see `linalg.closed_walks`).
+    divisor: Number
+        Optional power of two the adjacency matrix is divided by, as in
+        `_diag_matrix`.
+
+    Returns
+    -------
+    dict
+        A dict consisting of the following:
+        diag_matrix - The matrix `W` of diagonals, as an ndarray
+        uniq_rows   - An integer array of the indices of the first copy
+                      of each distinct row of `W`
+        labels      - An integer array holding the class label of each
+                      row of `W`
+        certain_columns - A boolean array marking the columns of `W`
+                      whose entries are all certainly exact
+        recomputed_rows - The number of rows counted exactly in ADAPTIVE
+                      mode
+    """
+    # Create `W` as the matrix of diagonals. In modular mode rows are
+    # compared by their residues, and `W` is only rebuilt afterwards.
+    # Only float64 counts may be inexact.
+    recomputed = 0
+    certain = np.ones(max(0, max_power - 1), dtype=bool)
+    if arbitrary_precision == MODULAR:
+        with profiling.span(
+                'closed_walks',
+                backend=MODULAR,
+                min_power=2,
+                max_power=max_power):
+            primes, residues = _residue_matrix(graph, max_power)
+        keys = np.matrix(
+            residues.transpose((1, 0, 2)).reshape((residues.shape[1], -1))
+        )
+    elif arbitrary_precision == ADAPTIVE:
+        with profiling.span(
+                'closed_walks',
+                backend=ADAPTIVE,
+                min_power=2,
+                max_power=max_power) as record:
+            W, recomputed = _adaptive_closed_walks(graph, max_power)
+            if record is not None:
+                record['recomputed_rows'] = recomputed
+        W = np.matrix(W)
+        keys = W
+    else:
+        W, exact = _diag_matrix(
+            graph,
+            max_power,
+            arbitrary_precision,
+            state=state,
+            divisor=divisor,
+            return_exact=True
+        )
+        certain = np.all(exact, axis=0)
+        keys = W
+
+    # Log start
+    logger.info('Processing reduced walk matrix')
+
+    # Label each row by its class, in order of first appearance
+    with profiling.span('dedup', shape=keys.shape):
+        unique_row_idxs, row_labels = _unique_rows(keys)
+
+    # Rebuild only the distinct rows from their residues in modular mode
+    logger.info('Reduced walk matrix complete')
+    if arbitrary_precision == MODULAR:
+        W = linalg.chinese_remainder(
+            residues[:, unique_row_idxs],
+            primes
+        )[row_labels]
+
+    return {
+        'diag_matrix': np.asarray(W),
+        'uniq_rows': unique_row_idxs,
+        'labels': row_labels,
+        'certain_columns': certain,
+        'recomputed_rows': np.array(recomputed)
+    }
+
+
+def _extend_walk_matrix(graph, previous, max_power, arbitrary_precision,
+                        state=None):
+    """Extend a matrix of diagonals to a larger maximum power.
+
+    Only the diagonals of powers above those of `previous` are computed,
+    resuming from its saved vectors when possible. Adding columns can
+    only split walk classes, so rows are relabeled by their previous
+    label together with the new columns.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        The graph that was analyzed.
+    previous : dict
+        A dict returned by `walk_classes` for `graph`.
+    max_power: Number
+        Maximum power used in determining the walk matrix.
+    arbitrary_precision: Boolean | String
+        Precision mode, as in `walk_classes`.
+    state: Dict
+        Optional dict updated with the vectors reached at max_power,
+        holding the vectors saved in `previous` on entry.
+
+    Returns
+    -------
+    dict
+        A dict as returned by `_walk_matrix`.
+    """
+    W = np.asarray(previous['diag_matrix'])
+    labels = np.asarray(previous['labels'])
+    min_power = W.shape[1] + 2
+    certain = np.asarray(previous['precision']['certain_columns'])
+
+    # Drop columns, or compute only the new ones
+    if max_power < min_power:
+        W = W[:, :max_power - 1]
+        certain = certain[:max_power - 1]
+        keys = W
+    else:
+        new, exact = _diag_matrix(
+            graph,
+            max_power,
+            arbitrary_precision,
+            min_power=min_power,
+            state=state,
+            return_exact=True
+        )
+        new = np.asarray(new)
+        W = np.concatenate((W, new.astype(W.dtype)), axis=1)
+        certain = np.concatenate((certain, np.all(exact, axis=0)))
+        keys = np.concatenate(
+            (labels[:, None].astype(new.dtype), new),
+            axis=1
+        )
+
+    # Label each row by its class, in order of first appearance
+    with profiling.span('dedup', shape=keys.shape):
+        unique_row_idxs, row_labels = _unique_rows(keys)
+
+    return {
+        'diag_matrix': W,
+        'uniq_rows': unique_row_idxs,
+        'labels': row_labels,
+        'certain_columns': certain
+    }
+
+
+def _operator_walk_matrix(operator, max_power, arbitrary_precision):
+    """Calculate the matrix of diagonals of a Kronecker structured graph.
+
+    Parameters
+    ----------
+    operator : kronecker.Operator
+        The adjacency matrix of the graph.
+    max_power: Number
+        Maximum power used in determining the walk matrix.
+    arbitrary_precision: Boolean | String
+        Precision mode, as in `walk_classes`. Any exact mode counts walks
+        of the factors with `linalg.exact_closed_walks`.
+
+    Returns
+    -------
+    dict
+        A dict as returned by `_walk_matrix`.
+    """
+    logger.info(
+        'Calculating diagonals of powers of a Kronecker structured '
+        'adjacency matrix in range 2..{}'.format(max_power)
+    )
+
+    # Rows of the distinct factor combinations, expanded to every node
+    rows, labels = operator.walk_rows(max_power, bool(arbitrary_precision))
+    W = rows[:, 2:][labels]
+
+    # Label each row by its class, in order of first appearance
+    with profiling.span('dedup', shape=W.shape):
+        unique_row_idxs, row_labels = _unique_rows(W)
+
+    # Float64 counts combined from the factors are never certain
+    return {
+        'diag_matrix': W,
+        'uniq_rows': unique_row_idxs,
+        'labels': row_labels,
+        'certain_columns': np.full(
+            W.shape[1],
+            bool(arbitrary_precision),
+            dtype=bool
+        )
+    }
+
+
+def _expm_diagonal(A, nodes):
+    """Calculate diagonal entries of the matrix exponential of a graph.
+
+    Parameters
+    ----------
+    A : Scipy Sparse Matrix
+        Adjacency matrix of a graph.
+    nodes : List
+        Indices of the requested diagonal entries.
+
+    Returns
+    -------
+    Numpy Array
+        The entries of the diagonal of expm(A) at `nodes`.
+    """
+    try:
+        logger.info(
+            'Calculating {} diagonal entries of expm of sparse '
+            'adjacency matrix'.format(len(nodes))
+        )
+        d = linalg.expm_diagonal(A, nodes)
+    except Exception as e:
+        logger.info(
+            'linalg.expm_diagonal failed with exception {}, '
+            'running adhoc expm on dense walk matrix'.format(e)
+        )
+        logger.warn(e)
+        d = np.asarray(linalg.adhoc_expm(A.todense()).diagonal()).ravel()
+        d = d[nodes]
+    return d
+
+
+def _cached(cache, graph, parts, compute):
+    """Look up arrays computed for a graph in an optional cache.
+
+    Parameters
+    ----------
+    cache : cache.Cache
+        A cache, or None to always compute.
+    graph : ArrayGraph | Networkx Graph
+        The graph the arrays are computed for.
+    parts : Tuple
+        Values distinguishing the computation.
+    compute : Function
+        Function of no arguments returning a dict of arrays.
+
+    Returns
+    -------
+    dict
+        The arrays keyed by name.
+    """
+    if cache is None:
+        return compute()
+    return cache.cached(_adjacency(graph), parts, compute)
+
+
+def walk_classes(graph, max_power=None, arbitrary_precision=False,
+                 cache=None, previous=None, operator=None,
+                 trace_file=None, scale=None, keep_state=False,
+                 trace=None):
+    """Analyze a graph to determine its walk classes.
 
     Walk classes are computed as the distinct rows of the matrix
     of diagonals.
@@ -255,21 +1100,72 @@ def walk_classes(graph, max_power=None, arbitrary_precision=False):
     of a graph. After W is calculated, the graph is parsed and nodes labeled
     with their appropriate category, starting at 0.
 
-    Warning. This is slow for large graphs O(n^4).
+    Warning. This is slow for large graphs, O(n * m * max_power) for a
+    graph with n nodes and m edges.
 
     Parameters
     ----------
-    graph : Networkx Graph
-        The networkx graph that will be analyzed.
+    graph : ArrayGraph | Networkx Graph
+        The graph that will be analyzed.
     max_power: Number
         An optional maximum power to use in determining the walk matrix
         If none is specified, the maximum power used is the minimum of
         the number of nodes in the graph and another value (usually near 14)
         computed based on the max degree of the graph.
-    arbitrary_precision: Boolean
+    arbitrary_precision: Boolean | String
         Whether or not to compute the walk matrix using arbitrary
-        precision arithmetic. Using it is slow, but avoids numerical
-        difficulties. (Default False).
+        precision arithmetic. Columns of walk counts that fit in int64
+        use native arithmetic, the rest fall back to python integers.
+        If MODULAR, walk counts are computed modulo several primes,
+        rows are compared by their residues, and only the distinct rows
+        are rebuilt as integers. This suits large values of max_power.
+        If ADAPTIVE, walks are counted in float64 while tracking which
+        counts are certainly exact, and only the rows that may have lost
+        precision are recounted exactly. The result is exact, at float
+        speed for the rows that stay below 2**53.
+        Using it is slower, but avoids numerical difficulties.
+        (Default False).
+    cache: cache.Cache
+        An optional on-disk cache. The matrix of diagonals, its distinct
+        rows and the eigenvalues are read from it when the graph has been
+        analyzed before with the same max_power and precision mode.
+    previous: dict
+        An optional dict returned by an earlier call for the same graph.
+        Only the diagonals of powers above its max_power are computed,
+        resuming from its saved vectors if it kept them, and
+        its walk classes are split instead of found from scratch. This
+        makes it cheap to raise max_power step by step. Ignored if its
+        precision does not match `arbitrary_precision`.
+    operator: kronecker.Operator
+        An optional Kronecker structured adjacency matrix of `graph`,
+        whose node i is the i-th node of graph.nodes(). Closed walks and
+        eigenvalues are then computed on the factors and combined, and
+        `previous` is ignored.
+    trace_file: String
+        An optional path of a JSON file the trace is written to.
+    scale: String
+        If SPECTRAL, column k of `W` holds the diagonal of (A / 2**e)**k
+        for the power of two 2**e nearest the spectral radius rho,
+        computed by streaming products with A / 2**e, so counts that grow
+        like rho**k neither overflow nor leave the linear programs badly
+        scaled. If COLUMN, each column is then also divided by the
+        smallest power of two at least its largest entry. Dividing by
+        powers of two is exact, so the classes are those found unscaled,
+        the factors are kept, every flip-flopping check compares entries
+        of one column and gives the same answer, and the linear system
+        checks rescale their variables to solve the same systems.
+        Requires float arithmetic, and `previous` is ignored (Default
+        None).
+    keep_state: Boolean
+        Whether or not to keep the vectors reached at max_power, when
+        they fit in memory, so a later call passing this result as
+        `previous` resumes from them. They take up to
+        `linalg.MEMORY_BUDGET` bytes (Default False).
+    trace: Dict
+        An optional trace created by `profiling.new_trace`, into which
+        the spans of each stage are recorded. A trace is also recorded
+        when `trace_file` is given or a `profiling.recording` is active,
+        and otherwise nothing is recorded.
 
     Returns
     -------
@@ -281,25 +1177,135 @@ def walk_classes(graph, max_power=None, arbitrary_precision=False):
         diag_matrix - The matrix `W` of diagonals
         uniq_rows   - The indices of the first copy of each distinct row
                       from the matrix of diagonals
+        labels      - An integer array holding the class label of each
+                      row of the matrix of diagonals
         uniq_matrix - The matrix of uique rows in `W`
         eig_matrix  - The matix formed by taking columns 1-d of `uniq_matrix`
                       where d is the number of distinct eigenvalues in the
                       adjacency matrix of `graph`
         graph       - A copy of the graph where each node has the property
                       `category` corresponding to the walk category computed
+        array_graph - The graph as an ArrayGraph, holding its adjacency
+                      matrix
+        max_power   - The maximum power used
+        num_values  - The number d of distinct eigenvalues
+        num_values_estimated - Whether or not d was estimated by
+                      `linalg.distinct_eigenvalue_count`, which may
+                      undercount it, rather than counted exactly
+        walk_state  - Vectors saved for extending to a larger max_power,
+                      or None unless `keep_state` is True
+        flip_flops  - Certificate of the pair-wise and set-average
+                      flip-flopping conditions, as returned by
+                      `flip_flop_certificate`
+        scale       - None, or a dict of the scale `method`, spectral
+                      `radius`, the power of two `divisor` nearest it
+                      and the `factors` each column of `W` was divided by
+        precision   - A dict of the precision `mode`, whether row
+                      equality and flip-flop comparisons are `certain`,
+                      being made on exact counts, a boolean array of the
+                      `certain_columns` of `W` whose counts are all
+                      exact, and the number of `recomputed_rows` counted
+                      exactly in ADAPTIVE mode. In float64 a count is
+                      certain when `linalg.closed_walks` can show it is
+                      exact, so small graphs and walk lengths are
+                      certain too
+        trace       - Spans of each stage of the analysis, recorded by
+                      `profiling`, or None unless recorded. The linear
+                      system checks add theirs.
     """
+    # Record the time spent in each stage, only when asked
+    if trace is None and (trace_file is not None or profiling.active()):
+        trace = profiling.new_trace()
+    with profiling.recording(trace), profiling.span('walk_classes'):
+        w_obj = _walk_classes(
+            graph,
+            max_power,
+            arbitrary_precision,
+            cache,
+            previous,
+            operator,
+            scale,
+            keep_state
+        )
+    w_obj['trace'] = trace
+
+    if trace_file is not None:
+        profiling.write(trace, trace_file)
+
+    return w_obj
+
+
+def _walk_classes(graph, max_power, arbitrary_precision, cache,
+                  previous, operator, scale=None, keep_state=False):
+    """Analyze a graph to determine its walk classes, as in `walk_classes`."""
+    # Build the adjacency matrix once for every stage of the analysis
+    with profiling.span('adjacency') as record:
+        array = arraygraph.as_array_graph(graph)
+        if record is not None:
+            record['nnz'] = array.adjacency().nnz
+
     # Determine correct value for max_power
     if max_power is None:
+        max_power = _default_max_power(array)
 
-        degree_max = max(nx.degree(graph).values())
-        k = int(53 / (np.log(degree_max) / np.log(2)))
-
-        # this value of k computed  to avoid numerical errors
-        # but MAX_POWER set as lowerbound to attempt to ensure that
-        # the linear system has large enough dimension to have a feasible point
-        max_power = min(len(graph.nodes()),  max(MAX_POWER,  k))
+    # A previous result must come from `walk_classes`
+    missing = [
+        key for key in ('diag_matrix', 'labels', 'max_power', 'num_values')
+        if previous is not None and key not in previous
+    ]
+    if missing:
+        raise Exception(
+            'previous must be a result of walk_classes, but it is missing '
+            '{}'.format(', '.join(missing))
+        )
 
-    if max_power > 14:
+    # Only extend a previous matrix of diagonals of the same precision
+    if previous is not None:
+        exact = np.asarray(previous['diag_matrix']).dtype == object
+        if exact != bool(arbitrary_precision):
+            logger.warn(
+                'Precision of the previous walk matrix does not match. '
+                'Computing the matrix of diagonals from scratch.'
+            )
+            previous = None
+
+    # Scaled matrices are only computed in float arithmetic from scratch
+    if scale is not None:
+        if scale not in (SPECTRAL, COLUMN):
+            raise Exception('Unknown scale {}'.format(scale))
+        if arbitrary_precision:
+            raise Exception(
+                'Scaled walk matrices require arbitrary_precision=False'
+            )
+    if previous is not None and (
+            scale is not None or previous.get('scale') is not None):
+        logger.warn(
+            'Scaled walk matrices are not extended. '
+            'Computing the matrix of diagonals from scratch.'
+        )
+        previous = None
+
+    # Spectral radius and the power of two 2**exponent nearest it, which
+    # the columns are scaled by
+    radius = None
+    exponent = None
+    if scale is not None:
+        with profiling.span('spectral_radius'):
+            if operator is not None:
+                radius = float(np.abs(
+                    operator.distinct_eigenvalues(DECIMALS)
+                ).max()) or 1.0
+            else:
+                radius = linalg.spectral_radius(array.adjacency())
+        exponent = int(np.round(np.log2(radius))) if radius > 0 else 0
+
+    # Vectors saved by the previous call are replaced, not modified.
+    # New vectors are only saved when asked for.
+    state = {} if keep_state else None
+    if previous is not None and previous.get('walk_state'):
+        state = dict(previous['walk_state'])
+
+    if max_power > 14 and not arbitrary_precision:
         logger.warn((
             'Max Power is set to: {}. '
             'Settings of max_power larger than 14 are more likely to cause '
@@ -309,68 +1315,112 @@ def walk_classes(graph, max_power=None, arbitrary_precision=False):
             'manually.'
         ).format(max_power))
 
-    # Create `W` as the matrix of diagonals
-    W = _diag_matrix(graph, max_power, arbitrary_precision)
-
-    # Get the eigenvalues from the graph adjacency matrix
-    eigenvalues, eigenvectors = _eigenvalues(graph)
-    num_values = len(np.unique(eigenvalues.round(decimals=DECIMALS)))
-
-    # List of all unique rows encountered
-    unique_rows = []
-    unique_row_idxs = []
-
-    # Mapping of a row to a class label
-    mapping = {}
-
-    # Unique class label
-    idx = 0
+    # Compute the matrix of diagonals and label its distinct rows,
+    # reading them from the cache when possible
+    if operator is not None:
+        def compute():
+            return _operator_walk_matrix(
+                operator,
+                max_power,
+                arbitrary_precision
+            )
+    elif previous is None:
+        def compute():
+            return _walk_matrix(
+                array,
+                max_power,
+                arbitrary_precision,
+                state,
+                None if exponent is None else 2.0 ** exponent
+            )
+    else:
+        def compute():
+            return _extend_walk_matrix(
+                array,
+                previous,
+                max_power,
+                arbitrary_precision,
+                state
+            )
+    with profiling.span(
+            'walk_matrix',
+            backend=_backend(arbitrary_precision, operator),
+            max_power=max_power):
+        parts = ('walk_matrix', max_power, arbitrary_precision)
+        if exponent is not None and operator is None:
+            parts += (SPECTRAL, exponent)
+        walks = _cached(cache, array, parts, compute)
+    W = np.matrix(walks['diag_matrix'])
+    unique_row_idxs = walks['uniq_rows'].tolist()
+    row_labels = walks['labels']
+
+    # Columns holding only exact counts. Float64 counts cached before
+    # they were tracked are not certain.
+    certain = walks.get('certain_columns')
+    if certain is None:
+        certain = np.full(W.shape[1], bool(arbitrary_precision))
+    certain = np.asarray(certain, dtype=bool)
+
+    # Scale factors of the columns, for walks of length 2..max_power.
+    # Operator walks are counted unscaled and divided afterwards.
+    scaling = None
+    if scale is not None:
+        factors = np.ldexp(1.0, exponent * np.arange(2, W.shape[1] + 2))
+        if operator is not None:
+            W = W / factors
+        if scale == COLUMN:
+            maxima = np.asarray(np.abs(W).max(axis=0), dtype=np.float64)
+            maxima = maxima.ravel()
+            maxima[maxima == 0] = 1
+            maxima = np.exp2(np.ceil(np.log2(maxima)))
+            W = W / maxima
+            factors = factors * maxima
+        scaling = {
+            'method': scale,
+            'radius': radius,
+            'divisor': 2.0 ** exponent,
+            'factors': factors
+        }
+
+    # Count the distinct eigenvalues of the graph adjacency matrix,
+    # unless the previous call counted them below its limit
+    if operator is not None:
+        with profiling.span('eigenvalues', backend='operator'):
+            num_values = len(operator.distinct_eigenvalues(DECIMALS))
+        estimated = False
+    elif (previous is not None and
+            previous['num_values'] < previous['max_power'] - 1):
+        num_values = previous['num_values']
+        estimated = previous.get('num_values_estimated', False)
+    else:
+        num_values, estimated = _num_eigenvalues(
+            array,
+            max_power - 1,
+            cache
+        )
 
     # Mapping of class label to a list of nodes in that class
-    classes = {}
-
-    # Log start
-    logger.info('Processing reduced walk matrix')
-
-    # Process unique elements
-    for row, node in enumerate(graph.nodes()):
-
-        # Get row from W as string of comma separated values
-        bts = ','.join(map(str, W[row].tolist()[0]))
-
-        # If bts has not been seen before, create a class label
-        if bts not in mapping:
-
-            # Create mapping
-            mapping[bts] = idx
-            classes[idx] = []
+    nodes = array.nodes()
+    classes = {label: [] for label in range(len(unique_row_idxs))}
+    for node, label in zip(nodes, row_labels.tolist()):
+        classes[label].append(node)
 
-            # Increment idx
-            idx += 1
-
-            # Add to unique rows from list of diagonals
-            unique_rows.append(np.array(W[row]).reshape((-1,)))
-            unique_row_idxs.append(row)
-
-        # Label graph node from mapping and record class
-        graph.node[node]['category'] = mapping[bts]
-        classes[mapping[bts]].append(node)
+    # Label graph nodes with their class in one call
+    array.set_node_attributes('category', row_labels)
 
     # Create the unique matrix
-    logger.info('Reduced walk matrix complete')
-    uniq_matrix = np.matrix(unique_rows, dtype=object)
+    uniq_matrix = np.matrix(W[unique_row_idxs], dtype=object)
 
-    # Check uniq_matrix for necessary flip-flopping conditions
-    # This method call is used for its side effects, which
-    # log information to the end user.
-    _necessary_flip_flip_conditions_check(
+    # Check uniq_matrix for necessary flip-flopping conditions, logging
+    # information to the end user, and keep the certificate
+    certificate = _necessary_flip_flip_conditions_check(
         uniq_matrix,
-        max_power is len(graph.nodes()),
+        max_power == len(nodes),
         arbitrary_precision
     )
 
     # Calculate number of classes
-    num_classes = len(mapping.keys())
+    num_classes = len(unique_row_idxs)
 
     # Take the subset for number of eigenvalues
     eig_matrix = uniq_matrix[0: num_classes, 0:num_values]
@@ -381,9 +1431,24 @@ def walk_classes(graph, max_power=None, arbitrary_precision=False):
         'classes': classes,
         'diag_matrix': W,
         'uniq_rows': unique_row_idxs,
+        'labels': row_labels,
         'uniq_matrix': uniq_matrix,
         'eig_matrix': eig_matrix,
-        'graph': graph
+        'graph': graph,
+        'array_graph': array,
+        'max_power': max_power,
+        'num_values': num_values,
+        'num_values_estimated': estimated,
+        'walk_state': state if keep_state else None,
+        'operator': operator,
+        'flip_flops': certificate,
+        'scale': scaling,
+        'precision': {
+            'mode': _backend(arbitrary_precision, operator),
+            'certain': bool(np.all(certain)),
+            'certain_columns': certain,
+            'recomputed_rows': int(walks.get('recomputed_rows', 0))
+        }
     }
 
 
@@ -402,8 +1467,10 @@ def spider_torus_walk_classes(st_obj, arbitrary_precision=False):
         A dict as returned by `gen.spider_torus`
     arbitrary_precision : Boolean
         Whether or not to compute the walk matrix using arbitrary
-        precision arithmetic. Using it is slow, but avoids numerical
-        difficulties. (Default False).
+        precision arithmetic. Columns of walk counts that fit in int64
+        use native arithmetic, the rest fall back to python integers.
+        Using it is slower, but avoids numerical difficulties.
+        (Default False).
 
     Returns
     -------
@@ -413,61 +1480,168 @@ def spider_torus_walk_classes(st_obj, arbitrary_precision=False):
         uniq_rows   - The indices of the distinct rows used to form the
                       matrix of diagonals
         uniq_matrix - The matrix of uique rows in `W`
-        graph       - A copy of the graph
+        graph       - A copy of the graph
+        flip_flops  - Certificate of the necessary flip-flopping
+                      conditions, as in `walk_classes`
+    """
+    # Get arguments
+    graph = st_obj['graph']
+    array = arraygraph.as_array_graph(graph)
+    representatives = st_obj['representatives']
+    copies = st_obj['copies']
+
+    # Add 2 to the list of copies, to be used as powers
+    # powers = [2] + copies
+    max_power = max(copies)
+    degree_max = _degrees(array).max()
+    k = int(53 / (np.log(degree_max) / np.log(2)))
+    temp_upperbound = min(array.number_of_nodes(), max(MAX_POWER,  k))
+
+    # This value of k computed to avoid numerical errors.
+    # The value MAX_POWER is set as a lowerbound to attempt to ensure that
+    # the linear system has large enough dimension to have a feasible point.
+    if max_power > temp_upperbound:
+        logger.warn((
+            'Max Power is set to: {}. '
+            'Setting an entry of copies to be larger than 14 is more '
+            'likely to cause loss of precision in the computations. These '
+            'numerical issues can cause the check to fail even if a solution '
+            'exists, especially on larger, denser graphs.'
+        ).format(max_power))
+
+    # Generate the rows of the walk matrix for the representatives only
+    uniq_matrix = _diag_matrix(
+        array,
+        max_power,
+        arbitrary_precision,
+        representatives
+    )
+
+    # Check uniq_matrix for necessary flip-flopping conditions, logging
+    # information to the end user, and keep the certificate
+    certificate = _necessary_flip_flip_conditions_check(
+        uniq_matrix,
+        True,
+        arbitrary_precision
+    )
+
+    # Return output
+    return {
+        'num_classes': len(copies) + 1,
+        'uniq_rows': representatives,
+        'uniq_matrix': uniq_matrix,
+        'graph': graph,
+        'flip_flops': certificate
+    }
+
+
+def partition_walk_classes(graph, partition, max_power=None,
+                           arbitrary_precision=False):
+    """Analyze the walk classes of a graph with a known partition.
+
+    Every cell of `partition` must lie within a single walk class, as
+    the orbits of the automorphism group do. Rows of the matrix of
+    diagonals are then computed for the first node of each cell only,
+    by streaming products of the adjacency matrix with their unit
+    vectors, and cells are merged when their rows match. No power of
+    the adjacency matrix is formed, and memory scales with the number
+    of nodes times the number of cells.
+
+    Partitions for the built-in generators are returned by
+    `gen.spider_torus` and by `gen.pyramid_prism_partition`,
+    `gen.snowflakecycle_partition` and `gen.kks_graph_partition`.
+
+    Parameters
+    ----------
+    graph : ArrayGraph | Networkx Graph
+        The graph that will be analyzed.
+    partition : List
+        A list of lists of nodes, one list per cell.
+    max_power: Number
+        An optional maximum power to use in determining the walk matrix,
+        chosen as in `walk_classes` if none is specified.
+    arbitrary_precision: Boolean | String
+        Whether or not to compute the walk matrix using arbitrary
+        precision arithmetic, as in `walk_classes` (Default False).
+
+    Returns
+    -------
+    dict
+        A dict consisting of the following:
+        num_classes - The number `N` of walk classes
+        classes     - A dictionary keyed by class label where each value
+                      is a list of nodes in that class
+        uniq_rows   - The indices of the representative node of each
+                      walk class
+        labels      - An integer array holding the class label of each
+                      node, in the order of graph.nodes()
+        uniq_matrix - The matrix of uique rows in `W`
+        graph       - The graph, where each node has the property
+                      `category` corresponding to the walk category computed
+        flip_flops  - Certificate of the necessary flip-flopping
+                      conditions, as in `walk_classes`
     """
-    # Get arguments
-    graph = st_obj['graph']
-    representatives = st_obj['representatives']
-    copies = st_obj['copies']
+    # Build the adjacency matrix once
+    array = arraygraph.as_array_graph(graph)
 
-    # Add 2 to the list of copies, to be used as powers
-    # powers = [2] + copies
-    max_power = max(copies)
-    degree_max = max(nx.degree(graph).values())
-    k = int(53 / (np.log(degree_max) / np.log(2)))
-    temp_upperbound = min(len(graph.nodes()), max(MAX_POWER,  k))
+    # Determine correct value for max_power
+    if max_power is None:
+        max_power = _default_max_power(array)
+
+    # Map nodes to their row of the matrix of diagonals
+    nodes = array.nodes()
+    index = {node: idx for idx, node in enumerate(nodes)}
+
+    # Compute the rows of the first node of each cell
+    representatives = [index[cell[0]] for cell in partition]
+    rows = _diag_matrix(
+        array,
+        max_power,
+        arbitrary_precision,
+        representatives
+    )
 
-    # This value of k computed to avoid numerical errors.
-    # The value MAX_POWER is set as a lowerbound to attempt to ensure that
-    # the linear system has large enough dimension to have a feasible point.
-    if max_power > temp_upperbound:
-        logger.warn((
-            'Max Power is set to: {}. '
-            'Setting an entry of copies to be larger than 14 is more '
-            'likely to cause loss of precision in the computations. These '
-            'numerical issues can cause the check to fail even if a solution '
-            'exists, especially on larger, denser graphs.'
-        ).format(max_power))
+    # Merge cells whose rows match
+    uniq_cells, cell_labels = _unique_rows(rows)
+    uniq_matrix = np.matrix(rows[uniq_cells], dtype=object)
+
+    # Label every node with the class of its cell
+    row_labels = np.zeros(len(nodes), dtype=np.intp)
+    for cell, label in zip(partition, cell_labels.tolist()):
+        row_labels[[index[node] for node in cell]] = label
+
+    # Mapping of class label to a list of nodes in that class
+    classes = {label: [] for label in range(len(uniq_cells))}
+    for node, label in zip(nodes, row_labels.tolist()):
+        classes[label].append(node)
 
-    # Generate the walk matrix
-    diag_matrix = _diag_matrix(graph, max_power, arbitrary_precision)
-    uniq_matrix = diag_matrix[representatives]
+    # Label graph nodes with their class in one call
+    array.set_node_attributes('category', row_labels)
 
-    # Check uniq_matrix for necessary flip-flopping conditions
-    # This method call is used for its side effects, which
-    # log information to the end user.
-    _necessary_flip_flip_conditions_check(
+    # Check uniq_matrix for necessary flip-flopping conditions, logging
+    # information to the end user, and keep the certificate
+    certificate = _necessary_flip_flip_conditions_check(
         uniq_matrix,
-        True,
+        max_power == len(nodes),
         arbitrary_precision
     )
 
     # Return output
     return {
-        'num_classes': len(copies) + 1,
-        'uniq_rows': representatives,
+        'num_classes': len(uniq_cells),
+        'classes': classes,
+        'uniq_rows': [representatives[cell] for cell in uniq_cells],
+        'labels': row_labels,
         'uniq_matrix': uniq_matrix,
-        'graph': graph
+        'graph': graph,
+        'flip_flops': certificate
     }
 
 
-def positive_linear_system_check(w_obj, epsilon=1e-10):
-    """Solve a linear program.
-
-    The system attempts to find a strictly positive solution
-    to the problem `Wx = e`.
+def _positive_system(w_obj, epsilon=1e-10):
+    """Form the linear program of `positive_linear_system_check`.
 
-    Paremeters
+    Parameters
     ----------
     w_obj : Dict
         Walk object returned by `walk_classes`
@@ -476,8 +1650,10 @@ def positive_linear_system_check(w_obj, epsilon=1e-10):
 
     Returns
     -------
-    Scipy Optimize Result
-        The result from calling scipy.optimize.linprog
+    tuple
+        A tuple containing a dict of the keyword arguments of
+        `lp.linear_program`, and the scale of its variables (see
+        `_variable_scale`).
     """
     # Get the reduced walk matrix
     if 'eig_matrix' in w_obj:
@@ -487,23 +1663,56 @@ def positive_linear_system_check(w_obj, epsilon=1e-10):
 
     # Get the number of rows and columns of w
     num_rows, num_cols = w.shape
+    scale = _variable_scale(w_obj, range(num_cols))
+    s = np.ones(num_cols) if scale is None else scale
 
-    # Return result
-    return sp.optimize.linprog(
-        c=np.ones(num_cols),
-        A_ub=-np.matrix(np.identity(num_cols)),
-        b_ub=-np.ones(num_cols) * epsilon,
-        A_eq=w,
-        b_eq=np.ones(num_rows)
-    )
+    # x >= epsilon is a bound on each variable
+    return {
+        'c': 1 / s,
+        'A_eq': np.asarray(w, dtype=np.float64),
+        'b_eq': np.ones(num_rows),
+        'bounds': [(epsilon * factor, None) for factor in s]
+    }, scale
+
+
+def _variable_scale(w_obj, columns):
+    """Return the scale of the variables of a linear system.
+
+    Column j of a scaled walk matrix is the unscaled column divided by
+    factor s_j, so `Wx = b` is solved for y = s * x. Bounds on x become
+    bounds on y multiplied by s, and the objective sum(x) becomes
+    sum(y / s), so both systems have the same solutions.
 
+    Parameters
+    ----------
+    w_obj : Dict
+        Walk object returned by `walk_classes`
+    columns : Iterable
+        Indices of the columns of the walk matrix used by the system.
+
+    Returns
+    -------
+    Numpy Array
+        The factor s_j of each column, or None if `w_obj` is unscaled.
+    """
+    if w_obj.get('scale') is None:
+        return None
+    factors = np.asarray(w_obj['scale']['factors'], dtype=np.float64)
+    return factors[list(columns)]
 
-def nonnegative_linear_system_check(w_obj, epsilon=1e-10, subset=False):
+
+def _unscaled(res, scale):
+    """Convert the solution y = s * x of a scaled system back to x."""
+    if scale is not None and res.x is not None:
+        res.x = res.x / scale
+    return res
+
+
+def positive_linear_system_check(w_obj, epsilon=1e-10):
     """Solve a linear program.
 
-    The system will attempt to find a nonnegative solution of the form
-    `Wx = (gamma * e) - g` where `g = diag(expm(A))`, limited to the entries
-    corresponding to the unique classes of `w`, and `(gamma * e) - g > 0`.
+    The system attempts to find a strictly positive solution
+    to the problem `Wx = e`.
 
     Paremeters
     ----------
@@ -511,17 +1720,70 @@ def nonnegative_linear_system_check(w_obj, epsilon=1e-10, subset=False):
         Walk object returned by `walk_classes`
     epsilon : Number
         Small, nonzero number (default 1e-10)
-    subset: Boolean | List
-        If True, the minimal subset of the walk matrix which demonstrates the
-        same flip-flopping conditions will be used. If a List, the column
-        indices provided in the list will be used to form the subset. Otherwise
-        (False), no subsetting will be performed.
 
     Returns
     -------
     Scipy Optimize Result
         The result from calling scipy.optimize.linprog
     """
+    with profiling.recording(w_obj.get('trace')):
+        problem, scale = _positive_system(w_obj, epsilon)
+        return _unscaled(
+            lp.linear_program(**problem),
+            scale
+        )
+
+
+def positive_linear_system_checks(w_objs, epsilon=1e-10):
+    """Solve the linear programs of many walk objects at once.
+
+    Parameters
+    ----------
+    w_objs : List
+        Walk objects returned by `walk_classes`
+    epsilon : Number
+        Small, nonzero number (default 1e-10)
+
+    Returns
+    -------
+    List
+        The result of `positive_linear_system_check` for each walk object,
+        solved together by `lp.linear_programs`.
+    """
+    problems = []
+    scales = []
+    for w_obj in w_objs:
+        problem, scale = _positive_system(w_obj, epsilon)
+        problems.append(problem)
+        scales.append(scale)
+    return [
+        _unscaled(res, scale)
+        for res, scale in zip(lp.linear_programs(problems), scales)
+    ]
+
+
+def _nonnegative_system(w_obj, epsilon=1e-10, subset=False, cache=None):
+    """Form the linear program of `nonnegative_linear_system_check`.
+
+    Parameters
+    ----------
+    w_obj : Dict
+        Walk object returned by `walk_classes`
+    epsilon : Number
+        Small, nonzero number (default 1e-10)
+    subset: Boolean | List
+        Subset of the columns used, as in
+        `nonnegative_linear_system_check`.
+    cache: cache.Cache
+        An optional on-disk cache holding the diagonal of expm(A).
+
+    Returns
+    -------
+    tuple
+        A tuple containing a dict of the keyword arguments of
+        `lp.linear_program`, and the scale of its variables (see
+        `_variable_scale`), or None.
+    """
     # Get the reduced walk matrix
     if 'eig_matrix' in w_obj:
         w = w_obj['eig_matrix']
@@ -529,49 +1791,139 @@ def nonnegative_linear_system_check(w_obj, epsilon=1e-10, subset=False):
         w = w_obj['uniq_matrix']
 
     # Take the subset of the matrix
+    columns = range(w.shape[1])
     if subset is True:
-        w = _flip_flop_subset(w)
+        columns = _flip_flop_subset(w, return_indices=True)
+        w = w[:, columns]
     elif isinstance(subset, list):
+        columns = subset
         w = w[:, subset]
 
     # Get the shape of w
     num_rows, num_cols = w.shape
 
-    # Get the adjacency_matrix
-    A = sp.sparse.csc_matrix(nx.adjacency_matrix(w_obj['graph']))
-
-    # Calcualte the diagonal matrix
-    try:
-        logger.info('Calculating expm of sparse adjacency matrix')
-        d = sp.sparse.linalg.expm(A).diagonal()
-    except Exception as e:
-        logger.info(
-            'scypy.sparse.linalg.expm failed with exception {}, '
-            'running adhoc expm on dense walk matrix'
-        )
-        logger.warn(e)
-        d = linalg.adhoc_expm(A.todense()).diagonal()
+    # Calculate g, the diagonal of expm(A) at the unique rows only,
+    # from the factors of a Kronecker structured adjacency matrix
+    uniq_rows = [int(idx) for idx in w_obj['uniq_rows']]
+    operator = w_obj.get('operator')
+    if operator is not None:
+        with profiling.span('expm', backend='operator', size=len(uniq_rows)):
+            d = operator.expm_diagonal(uniq_rows)
+    else:
+        array = w_obj.get('array_graph') or w_obj['graph']
+        with profiling.span(
+                'expm',
+                backend='expm_multiply',
+                size=len(uniq_rows)):
+            d = _cached(
+                cache,
+                array,
+                ('expm_diagonal', tuple(uniq_rows)),
+                lambda: {
+                    'diagonal': _expm_diagonal(_adjacency(array), uniq_rows)
+                }
+            )['diagonal']
+    g = np.asarray(d, dtype=np.float64)
 
     # Log expm finish
     logger.info('Expm calculated, checking linear system')
 
-    # Form g from the unique rows of d
-    g = np.matrix([d[idx] for idx in w_obj['uniq_rows']])
-
     # Construct lower bound for x
     lower = [
-        min(0, (epsilon - 1/sp.misc.factorial(x + 2)))
+        min(0, (epsilon - 1/sp.special.factorial(x + 2)))
         for x in range(num_cols)
     ]
 
-    # Return result
-    return sp.optimize.linprog(
-        c=np.ones(num_cols + 1),
-        A_ub=-np.identity(num_cols + 1),
-        b_ub=np.concatenate((lower, np.array([-epsilon]))),
-        A_eq=np.concatenate((w, -np.ones((num_rows, 1))), axis=1),
-        b_eq=-g
-    )
+    # Gamma is never scaled
+    scale = _variable_scale(w_obj, columns)
+    if scale is not None:
+        scale = np.append(scale, 1.0)
+    s = np.ones(num_cols + 1) if scale is None else scale
+
+    # The variables are x followed by gamma. The lower bounds on x,
+    # x >= -lower >= 0, and gamma >= epsilon are bounds on each variable.
+    return {
+        'c': 1 / s,
+        'A_eq': np.concatenate(
+            (np.asarray(w, dtype=np.float64), -np.ones((num_rows, 1))),
+            axis=1
+        ),
+        'b_eq': -g,
+        'bounds': [
+            (-bound * factor, None)
+            for bound, factor in zip(lower + [-epsilon], s)
+        ]
+    }, scale
+
+
+def nonnegative_linear_system_check(w_obj, epsilon=1e-10, subset=False,
+                                    cache=None):
+    """Solve a linear program.
+
+    The system will attempt to find a nonnegative solution of the form
+    `Wx = (gamma * e) - g` where `g = diag(expm(A))`, limited to the entries
+    corresponding to the unique classes of `w`, and `(gamma * e) - g > 0`.
+
+    Paremeters
+    ----------
+    w_obj : Dict
+        Walk object returned by `walk_classes`
+    epsilon : Number
+        Small, nonzero number (default 1e-10)
+    subset: Boolean | List
+        If True, the minimal subset of the walk matrix which demonstrates the
+        same flip-flopping conditions will be used. If a List, the column
+        indices provided in the list will be used to form the subset. Otherwise
+        (False), no subsetting will be performed.
+    cache: cache.Cache
+        An optional on-disk cache holding the diagonal of expm(A).
+
+    Returns
+    -------
+    Scipy Optimize Result
+        The result from calling scipy.optimize.linprog
+    """
+    with profiling.recording(w_obj.get('trace')):
+        problem, scale = _nonnegative_system(w_obj, epsilon, subset, cache)
+        return _unscaled(
+            lp.linear_program(**problem),
+            scale
+        )
+
+
+def nonnegative_linear_system_checks(w_objs, epsilon=1e-10, subset=False,
+                                     cache=None):
+    """Solve the linear programs of many walk objects at once.
+
+    Parameters
+    ----------
+    w_objs : List
+        Walk objects returned by `walk_classes`
+    epsilon : Number
+        Small, nonzero number (default 1e-10)
+    subset: Boolean | List
+        Subset of the columns used, as in
+        `nonnegative_linear_system_check`.
+    cache: cache.Cache
+        An optional on-disk cache holding the diagonal of expm(A).
+
+    Returns
+    -------
+    List
+        The result of `nonnegative_linear_system_check` for each walk
+        object, solved together by `lp.linear_programs`.
+    """
+    problems = []
+    scales = []
+    for w_obj in w_objs:
+        with profiling.recording(w_obj.get('trace')):
+            problem, scale = _nonnegative_system(w_obj, epsilon, subset, cache)
+            problems.append(problem)
+            scales.append(scale)
+    return [
+        _unscaled(res, scale)
+        for res, scale in zip(lp.linear_programs(problems), scales)
+    ]
 
 
 def pair_wise_flip_flopping(W):
@@ -593,45 +1945,18 @@ def pair_wise_flip_flopping(W):
         True if pair-wise flip-flopping holds for `W`
     """
     # Work with an ndarray representation of W
-    w = W.getA()
-
-    # Get the number of rows and columns in W
-    num_rows, num_cols = w.shape
-
-    # Generate all possible pairs of classes and k-walks
-    # A single pair is held as a tuple (x, y)
-    classes, walks = ([
-        (i, j)
-        for i in range(0, num)
-        for j in range(i + 1, num)
-    ] for num in [num_rows, num_cols])
-
-    # Iterate over all pairs of classes
-    for cls1, cls2 in classes:
-
-        # Whether these two classes flip-flop at any point
-        flip_flops = False
+    w = _walk_array(W)[0]
 
-        # Iterate over all pairs of walks
-        for w1, w2 in walks:
+    # Whether class i has more closed walks than class j for some length
+    greater = np.any(w[:, None, :] > w[None, :, :], axis=2)
 
-            # Comparison of classes for k-walk 1
-            n1 = w[cls1][w1] - w[cls2][w1]
-
-            # Comparison of classes for k-walk 2
-            n2 = w[cls1][w2] - w[cls2][w2]
-
-            # Check to see if the classes flip-flopped
-            if (n1 > 0 and n2 < 0) or (n1 < 0 and n2 > 0):
-                flip_flops = True
-                break
-
-        # If the classes don't flip-flop, return false immediately
-        if not flip_flops:
-            return False
+    # Classes flip-flop when each is greater than the other somewhere.
+    # A class is never greater than itself, so the diagonal is ignored.
+    flip_flops = greater & greater.T
+    np.fill_diagonal(flip_flops, True)
 
     # Return true if no counter examples are found
-    return True
+    return bool(np.all(flip_flops))
 
 
 def dominant_flip_flopping(W):
@@ -654,10 +1979,7 @@ def dominant_flip_flopping(W):
         True if dominant flip-flopping holds for `W`
     """
     # Work with an ndarray representation of W
-    w = W.getA()
-
-    # Get the number of rows and columns in W
-    num_rows, num_cols = w.shape
+    w = _walk_array(W)[0]
 
     # Generate the column-wise sum of w
     # This amounts to a 1darray where each item
@@ -665,30 +1987,131 @@ def dominant_flip_flopping(W):
     # all classes
     sums = w.sum(0)
 
-    # Iterate over all classes
-    for cls in range(0, num_rows):
+    # Check to see which classes dominate each k-walk
+    # Sums includes the number of walks for the class
+    # so it must be removed before checking that it
+    # dominates the remainder
+    is_dominant = w > sums - w
 
-        # Whether this class dominates any k-walk
-        is_dominant = False
+    # Every class must dominate some k-walk
+    return bool(np.all(np.any(is_dominant, axis=1)))
 
-        # Iterate over all walks
-        for walk in range(0, num_cols):
 
-            # Check to see if is dominant
-            # Sums includes the number of walks for the class
-            # so it must be removed before checking that it
-            # dominates the remainder
-            if w[cls][walk] > sums[walk] - w[cls][walk]:
-                is_dominant = True
-                break
+def set_average_flip_flopping_report(W):
+    """Check set-average flip-flopping, returning a witness on failure.
 
-        # Return false immediately if this class does
-        # not dominate a k-walk
-        if not is_dominant:
-            return False
+    Subsets of classes are encoded as bitmasks. The sums and largest
+    entries of every subset of each half of the classes are tabulated
+    once by doubling, and those of a subset S are combined from its two
+    halves, so subsets are visited in chunks of SUBSET_CHUNK masks in
+    bounded memory. A subset S is accepted against every T at once when,
+    for some walk length, the average of S exceeds the largest entry of
+    any class outside S, since no average over T can be larger. The
+    remaining pairs are compared in vectorized chunks, stopping at the
+    first failing pair. Integer matrices are compared exactly, by cross
+    multiplying sums and sizes instead of dividing.
 
-    # Return true as default
-    return True
+    Parameters
+    ----------
+    W : Numpy Matrix
+        Unique walk matrix as returned by `walk_classes`
+
+    Returns
+    -------
+    dict
+        A dict consisting of the following:
+        holds         - True if set-average flip-flopping holds for `W`
+        witness       - A pair (S, T) of lists of class indices for which
+                        no walk length has a larger average in S than in
+                        T, or None if the property holds
+        pairs_checked - The number of pairs (S, T) compared directly
+        pairs_pruned  - The number of pairs (S, T) accepted without
+                        being compared
+        elapsed       - Time taken, in seconds
+    """
+    start = time.time()
+    w, exact = _walk_array(W)
+
+    # Get the number of rows in W, and the mask holding every class
+    num_rows = w.shape[0]
+    full = 2 ** num_rows - 1
+
+    # Sizes, sums and largest entries of every subset of each half
+    sizes = _split_tables(
+        np.ones((num_rows, 1), dtype=np.int64),
+        np.add,
+        0
+    )
+    sums = _split_tables(w, np.add, 0)
+    if w.dtype == np.float64:
+        lowest = -np.inf
+    else:
+        lowest = -(abs(w).max() + 1) if w.size else 0
+    maxes = _split_tables(w, np.maximum, lowest)
+
+    # Compare averages exactly for integers
+    def greater(s_sum, s_size, t_sums, t_sizes):
+        if exact:
+            return s_sum * t_sizes[:, None] > t_sums * s_size
+        return s_sum / s_size > t_sums / t_sizes[:, None]
+
+    pairs_checked = 0
+    pairs_pruned = 0
+    witness = None
+    for first in range(0, full + 1, SUBSET_CHUNK):
+        masks = np.arange(
+            first,
+            min(first + SUBSET_CHUNK, full + 1),
+            dtype=np.int64
+        )
+        s_sizes = _split_lookup(sizes, np.add, masks).ravel()
+        s_sums = _split_lookup(sums, np.add, masks)
+        outside = _split_lookup(maxes, np.maximum, full ^ masks)
+
+        # Subsets S whose average beats every class outside S for some
+        # length are accepted against every T. The empty and full sets
+        # have no pairs.
+        if exact:
+            dominant = s_sums > s_sizes[:, None] * outside
+        else:
+            dominant = s_sums / np.maximum(s_sizes, 1)[:, None] > outside
+        dominant = np.any(dominant, axis=1)
+        dominant[(masks == 0) | (masks == full)] = True
+
+        # Count the pairs accepted by pruning
+        pruned = dominant & (masks > 0) & (masks < full)
+        pairs_pruned += int(np.sum(2 ** (num_rows - s_sizes[pruned]) - 1))
+
+        # Compare the remaining subsets S against every T outside S
+        for idx in np.flatnonzero(~dominant).tolist():
+            s = int(masks[idx])
+            for t in _submasks(full ^ s, num_rows):
+                pairs_checked += len(t)
+                failed = ~np.any(greater(
+                    s_sums[idx],
+                    s_sizes[idx],
+                    _split_lookup(sums, np.add, t),
+                    _split_lookup(sizes, np.add, t).ravel()
+                ), axis=1)
+                if np.any(failed):
+                    t = int(t[np.argmax(failed)])
+                    witness = tuple(
+                        [cls for cls in range(num_rows) if mask >> cls & 1]
+                        for mask in (s, t)
+                    )
+                    break
+            if witness is not None:
+                break
+        if witness is not None:
+            break
+
+    return {
+        'holds': witness is None,
+        'witness': witness,
+        'pairs_checked': pairs_checked,
+        'pairs_pruned': pairs_pruned,
+        'elapsed': time.time() - start
+    }
 
 
 def set_average_flip_flopping(W):
@@ -701,6 +2124,8 @@ def set_average_flip_flopping(W):
     the average number of walks of length L[x] in S is greater than the average
     number of walks of the same length in T.
 
+    See `set_average_flip_flopping_report` for the algorithm.
+
     Parameters
     ----------
     W : Numpy Matrix
@@ -711,121 +2136,301 @@ def set_average_flip_flopping(W):
     boolean
         True if set-average flip-flopping holds for `W`
     """
+    return set_average_flip_flopping_report(W)['holds']
+
+
+def each_class_max(W):
+    """Determine if a unique walk matrix demonstrates each class max.
+
+    Each class max is defined as:
+
+    For each class C[i] in W there exists a walk length L[x] such that
+    C[i] has larger number of walks of length L[x] than all other classes.
+
+    Parameters
+    ----------
+    W : Numpy Matrix
+        Unique walk matrix as returned by `walk_classes`
+
+    Returns
+    -------
+    boolean
+        True if each-class-max holds, false if not
+    """
     # Work with an ndarray representation of W
-    w = W.getA()
+    w = _walk_array(W)[0]
 
-    # Get the number of rows and columns in W
-    num_rows, num_cols = w.shape
+    # A class has more walks of a length than all other classes when it
+    # holds the maximum for that length and no other class ties it
+    is_max = w == w.max(axis=0)
+    has_max = is_max & (is_max.sum(axis=0) == 1)
 
-    # Generate the set of classes
-    classes = set([i for i in range(num_rows)])
+    # Every class must have a max for some length. A single class
+    # trivially has more walks than the (nonexistent) other classes.
+    return bool(np.all(np.any(has_max, axis=1)))
 
-    # Iterable returning all possible subsets of classes
-    # not including the empty set or the original set
-    c1 = map(
-        set,
-        chain.from_iterable(
-            combinations(classes, i)
-            for i in range(1, len(classes))
-        )
-    )
 
-    # Check every subset
-    for s1 in c1:
+def _first_failure(holds):
+    """Return the index of the first False entry of an array, or None."""
+    failed = np.flatnonzero(~np.asarray(holds).ravel())
+    return int(failed[0]) if len(failed) else None
 
-        # Find the compliment of the subset
-        compliment = classes - s1
 
-        # Iterable returning all possible subsets of classes
-        # not including the empty that do not intersect with s1
-        c2 = map(
-            set,
-            chain.from_iterable(
-                combinations(compliment, i)
-                for i in range(1, len(compliment) + 1)
-            )
-        )
+def _pair_wise_certificate(w):
+    """Certify pair-wise flip-flopping of a walk array.
 
-        # Check s1 against every non intersecting subset s2
-        for s2 in c2:
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - whether or not the property holds
+        - a pair [i, j] of classes where i never has more walks than j,
+          or None
+        - if the property holds, a list of lists whose entry [i][j] is a
+          walk length index where i has more walks than j, and -1 for
+          i == j, or None
+    """
+    num_rows = w.shape[0]
+    greater = w[:, None, :] > w[None, :, :]
+    found = np.any(greater, axis=2)
+    np.fill_diagonal(found, True)
 
-            # Whether flip-flipping is found
-            flip_flops = False
+    failure = _first_failure(found)
+    if failure is not None:
+        return False, list(divmod(failure, num_rows)), None
 
-            # Check each walk length average for dominance
-            for walk in range(0, num_cols):
+    columns = np.argmax(greater, axis=2)
+    np.fill_diagonal(columns, -1)
+    return True, None, columns.tolist()
 
-                # Calculate average number of walks for s1
-                a1 = sum([w[cls][walk] for cls in s1]) / len(s1)
 
-                # Calculate average number of walks for s2
-                a2 = sum([w[cls][walk] for cls in s2]) / len(s2)
+def _dominant_certificate(w):
+    """Certify dominant flip-flopping of a walk array.
 
-                # If the average of s1 is greater than the average
-                # of s2, then this pair exhibits the sought flip-flopping
-                # property. Break and check the next pair.
-                if a1 > a2:
-                    flip_flops = True
-                    break
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - whether or not the property holds
+        - a class that never dominates the others, or None
+        - if the property holds, a walk length index where each class
+          dominates, or None
+    """
+    is_dominant = w > w.sum(0) - w
+    failure = _first_failure(np.any(is_dominant, axis=1))
+    if failure is not None:
+        return False, failure, None
+    return True, None, np.argmax(is_dominant, axis=1).tolist()
 
-            # No flip flopping was found, return
-            if not flip_flops:
-                return False
 
-    # If no counter examples are found return true
-    return True
+def _each_class_max_certificate(w):
+    """Certify each class max of a walk array.
 
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - whether or not the property holds
+        - a class that never holds the maximum alone, or None
+        - if the property holds, a walk length index where each class
+          holds the maximum alone, or None
+    """
+    is_max = w == w.max(axis=0)
+    has_max = is_max & (is_max.sum(axis=0) == 1)
+    failure = _first_failure(np.any(has_max, axis=1))
+    if failure is not None:
+        return False, failure, None
+    return True, None, np.argmax(has_max, axis=1).tolist()
 
-def each_class_max(W):
-    """Determine if a unique walk matrix demonstrates each class max.
 
-    Each class max is defined as:
+def _set_average_certificate(w):
+    """Certify set-average flip-flopping of a walk array.
 
-    For each class C[i] in W there exists a walk length L[x] such that
-    C[i] has larger number of walks of length L[x] than all other classes.
+    Returns
+    -------
+    tuple
+        A tuple containing
+        - whether or not the property holds
+        - a pair [S, T] of lists of classes where no walk length has a
+          larger average in S than in T, or None
+        - None, since a proof lists a length for each of the 3**N pairs
+    """
+    report = set_average_flip_flopping_report(w)
+    witness = report['witness']
+    return report['holds'], witness and list(witness), None
+
+
+# Flip-flopping conditions, cheapest first, as (name, checker, certifier)
+# tuples. Set-average flip-flopping implies pair-wise flip-flopping, by
+# taking S and T to be single classes, so it is checked last.
+FLIP_FLOP_CONDITIONS = [
+    ('dominant', dominant_flip_flopping, _dominant_certificate),
+    ('each_class_max', each_class_max, _each_class_max_certificate),
+    ('pair_wise', pair_wise_flip_flopping, _pair_wise_certificate),
+    ('set_average', set_average_flip_flopping, _set_average_certificate)
+]
+
+
+def flip_flop_certificate(W, conditions=None, short_circuit=True,
+                          known=None):
+    """Check flip-flopping conditions, returning checkable certificates.
+
+    Conditions are checked cheapest first. A failure of pair-wise
+    flip-flopping at classes (i, j) is also a failure of set-average
+    flip-flopping at S = [i], T = [j], so the 3**N set-average check is
+    only run when pair-wise flip-flopping holds. Failures, and successes
+    of every condition but set-average flip-flopping, can be checked by
+    `verify_flip_flop_certificate` by comparing a few rows. A set-average
+    success carries no witness, since one would list a walk length for
+    each of the 3**N pairs of subsets, so checking it reruns the full
+    3**N search.
 
     Parameters
     ----------
     W : Numpy Matrix
         Unique walk matrix as returned by `walk_classes`
+    conditions : List
+        Names of the conditions checked, from FLIP_FLOP_CONDITIONS
+        (default all of them).
+    short_circuit : Boolean
+        Whether or not to stop at the first condition that fails, when
+        only whether every condition holds is needed (default True).
+    known : Dict
+        An optional certificate returned by an earlier call for `W`,
+        whose conditions are not checked again.
 
     Returns
     -------
-    boolean
-        True if each-class-max holds, false if not
+    dict
+        A dict consisting of the following:
+        holds      - True if every checked condition holds
+        conditions - A dict keyed by condition name, for each condition
+                     checked or implied, holding
+                     holds      - Whether or not it holds
+                     witness    - If it fails, the classes where it
+                                  fails, as in the `_*_certificate`
+                                  functions
+                     columns    - If it holds, the walk length indices
+                                  where it holds, or None for
+                                  set-average flip-flopping, which has
+                                  no witness of its success
+                     implied_by - The condition whose failure implies
+                                  this failure, or None
+        Conditions skipped by `short_circuit` are left out.
     """
-    # Work with an ndarray representation of W
-    w = W.getA()
+    if conditions is None:
+        conditions = [name for name, _, _ in FLIP_FLOP_CONDITIONS]
+    w = _walk_array(W)[0]
+
+    results = {}
+    if known is not None:
+        results.update(
+            (name, known['conditions'][name])
+            for name in conditions if name in known['conditions']
+        )
 
-    # Get the number of rows and columns in W
-    num_rows, num_cols = w.shape
+    for name, checker, certify in FLIP_FLOP_CONDITIONS:
+        if name not in conditions or name in results:
+            continue
+        if short_circuit and not all(c['holds'] for c in results.values()):
+            break
+
+        # Set-average flip-flopping fails wherever pair-wise does
+        pair_wise = results.get('pair_wise')
+        if name == 'set_average' and pair_wise and not pair_wise['holds']:
+            i, j = pair_wise['witness']
+            results[name] = {
+                'holds': False,
+                'witness': [[i], [j]],
+                'columns': None,
+                'implied_by': 'pair_wise'
+            }
+            continue
+
+        with profiling.span(checker.__name__, shape=w.shape):
+            holds, witness, columns = certify(w)
+        results[name] = {
+            'holds': holds,
+            'witness': witness,
+            'columns': columns,
+            'implied_by': None
+        }
 
-    # Possible classes
-    classes = [i for i in range(0, num_rows)]
+    return {
+        'holds': all(result['holds'] for result in results.values()),
+        'conditions': results
+    }
 
-    # Possible walks
-    walks = [i for i in range(0, num_cols)]
 
-    # Check all classes
-    for cls in classes:
+def _set_averages_greater(w, s, t):
+    """Whether the average of rows S exceeds that of rows T, per column."""
+    s_sum, t_sum = w[s].sum(axis=0), w[t].sum(axis=0)
+    return s_sum * len(t) > t_sum * len(s)
 
-        # Whether class has a max
-        has_max = False
 
-        # Check all walks
-        for walk in walks:
+def verify_flip_flop_certificate(W, certificate):
+    """Check a certificate returned by `flip_flop_certificate`.
 
-            # Find maximum of other classes for same walk
-            maximum = max([w[cls2][walk] for cls2 in classes if cls2 != cls])
+    Failures are checked by comparing the rows of their witness, and
+    successes by comparing the rows at each listed walk length, without
+    searching over classes or subsets. The exception is a set-average
+    success, which lists no walk lengths: it is checked by rerunning
+    `set_average_flip_flopping`, whose search over the 3**N pairs of
+    subsets costs as much as computing the certificate did.
 
-            # Set has max to true if number of walks is greater
-            if w[cls][walk] > maximum:
-                has_max = True
-                break
+    Parameters
+    ----------
+    W : Numpy Matrix
+        Unique walk matrix the certificate was computed for.
+    certificate : Dict
+        A certificate returned by `flip_flop_certificate`.
 
-        # If not max for some length return false
-        if not has_max:
-            return False
+    Returns
+    -------
+    boolean
+        True if every condition of the certificate is confirmed.
+    """
+    w = _walk_array(W)[0]
+    num_rows = w.shape[0]
+
+    for name, result in certificate['conditions'].items():
+        witness, columns = result['witness'], result['columns']
+
+        # Failures: the witness never meets the requirement
+        if not result['holds']:
+            if name == 'pair_wise':
+                ok = not np.any(w[witness[0]] > w[witness[1]])
+            elif name == 'set_average':
+                ok = not np.any(_set_averages_greater(w, *witness))
+            elif name == 'dominant':
+                ok = not np.any(w[witness] > w.sum(0) - w[witness])
+            else:
+                is_max = w == w.max(axis=0)
+                ok = not np.any(
+                    is_max[witness] & (is_max.sum(axis=0) == 1)
+                )
+
+        # Successes: every listed walk length meets its requirement
+        elif name == 'pair_wise':
+            ok = all(
+                w[i, columns[i][j]] > w[j, columns[i][j]]
+                for i in range(num_rows) for j in range(num_rows) if i != j
+            )
+        elif name == 'dominant':
+            sums = w.sum(0)
+            ok = all(
+                w[i, col] > sums[col] - w[i, col]
+                for i, col in enumerate(columns)
+            )
+        elif name == 'each_class_max':
+            ok = all(
+                all(w[i, col] > w[j, col] for j in range(num_rows) if j != i)
+                for i, col in enumerate(columns)
+            )
+        else:
+            # Set-average success has no witness, so search again
+            ok = set_average_flip_flopping(w)
 
-    # Return true if property is not violated
+        if not ok:
+            return False
     return True
@@ -0,0 +1,185 @@
+#
+# This file is part of spiderdonuts,
+#  https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Spiderdonuts module for recording where an analysis spends its time.
+
+A trace is a dict holding a list of spans. While a trace is being
+recorded, each stage of an analysis wrapped in `span` appends a dict
+with its name, nesting depth, start time and wall time, the peak
+resident set size of the process at its end, and any details the stage
+adds, such as the nnz of an intermediate matrix or the backend used.
+
+    trace = new_trace()
+    with recording(trace):
+        w_obj = polygraph.walk_classes(graph)
+    summary(trace)['closed_walks']['wall']
+
+Outside of a recording, spans cost a function call and record nothing.
+"""
+
+# Imports
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+# Traces currently being recorded, innermost last
+_ACTIVE = []
+
+# Depth of the innermost open span
+_DEPTH = [0]
+
+
+def new_trace():
+    """Create an empty trace.
+
+    Returns
+    -------
+    Dict
+        A dict with a list of `spans` and the `start` time of the trace.
+    """
+    return {
+        'start': time.time(),
+        'spans': []
+    }
+
+
+def active():
+    """Whether or not any trace is being recorded."""
+    return bool(_ACTIVE)
+
+
+def max_rss():
+    """Return the peak resident set size of the process.
+
+    Returns
+    -------
+    Number
+        Peak resident set size as reported by getrusage, in kilobytes on
+        Linux and bytes on macOS, or None if unavailable.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextmanager
+def recording(trace):
+    """Record spans into a trace.
+
+    Recordings nest, and spans are recorded into every active trace.
+    Recording a trace that is already active has no further effect.
+
+    Parameters
+    ----------
+    trace : Dict
+        A trace created by `new_trace`, or None to record nothing.
+
+    Yields
+    ------
+    Dict
+        `trace`
+    """
+    if trace is None or any(trace is other for other in _ACTIVE):
+        yield trace
+        return
+
+    _ACTIVE.append(trace)
+    try:
+        yield trace
+    finally:
+        _ACTIVE.pop()
+
+
+@contextmanager
+def span(name, **details):
+    """Time a stage of an analysis.
+
+    Parameters
+    ----------
+    name : String
+        Name of the stage, e.g. 'closed_walks'.
+    details
+        Details of the stage recorded with the span, e.g. backend='highs'.
+
+    Yields
+    ------
+    Dict
+        The span, to which the stage can add details such as nnz, or
+        None if no trace is being recorded.
+    """
+    if not _ACTIVE:
+        yield None
+        return
+
+    record = {'name': name, 'depth': _DEPTH[0]}
+    record.update(details)
+    traces = list(_ACTIVE)
+    start = time.time()
+    _DEPTH[0] += 1
+    try:
+        yield record
+    finally:
+        _DEPTH[0] -= 1
+        record['start'] = start
+        record['wall'] = time.time() - start
+        record['max_rss'] = max_rss()
+        for trace in traces:
+            trace['spans'].append(record)
+
+
+def summary(trace):
+    """Total the spans of a trace by name.
+
+    Parameters
+    ----------
+    trace : Dict
+        A recorded trace.
+
+    Returns
+    -------
+    Dict
+        Keyed by span name, the number of spans `count`, their total
+        `wall` time and the largest `max_rss` seen at their end.
+    """
+    totals = {}
+    for record in trace['spans']:
+        total = totals.setdefault(
+            record['name'],
+            {'count': 0, 'wall': 0.0, 'max_rss': None}
+        )
+        total['count'] += 1
+        total['wall'] += record['wall']
+        if record['max_rss'] is not None:
+            total['max_rss'] = max(total['max_rss'] or 0, record['max_rss'])
+    return totals
+
+
+def write(trace, path):
+    """Write a trace to a JSON file.
+
+    Parameters
+    ----------
+    trace : Dict
+        A recorded trace.
+    path : String
+        Path of the file, which is overwritten.
+    """
+    with open(path, 'w') as file:
+        json.dump(trace, file, indent=1, default=_json_default)
+
+
+def _json_default(value):
+    """Convert numpy values, which json cannot encode, to python values."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
@@ -0,0 +1,374 @@
+#
+# This file is part of spiderdonuts, https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Benchmark the walk class analysis across graph families and sizes.
+
+Times `walk_classes`, each flip-flop checker and both linear system
+checks on growing instances of the built-in generators, in float and
+arbitrary precision modes. Prints the best time of each stage per graph
+and the scaling exponent of each stage in the number of nodes, fitted on
+a log-log scale per family.
+
+Usage
+-----
+    $ python3 -m code.scripts.benchmark
+    $ python3 -m code.scripts.benchmark --save baseline.json
+    $ python3 -m code.scripts.benchmark --compare baseline.json
+
+With --compare, every stage slower than the baseline by more than
+--threshold (default 1.5 times) is reported, and the exit status is 1.
+"""
+
+# Imports
+from code import generators as gen, polygraph
+from tabulate import tabulate
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import scipy as sp
+
+
+# Graph families, as (family, generator, list of params) tuples, each
+# list of params growing in the number of nodes. Scaling is only fitted
+# for families of several sizes.
+FAMILIES = [
+    ('pyramid_prism', 'pyramid_prism', [
+        {'faces': 4, 'layers': layers} for layers in [0, 16, 64, 256]
+    ]),
+    ('spider_torus', 'spider_torus', [
+        {'degree': 4, 'length': 2, 'copies': [5, 3]},
+        {'degree': 4, 'length': 2, 'copies': [9, 5]},
+        {'degree': 4, 'length': 3, 'copies': [7, 5, 3]}
+    ]),
+    ('snowflakecycle', 'snowflakecycle', [
+        {'flake_number': 5, 'inner_cycle': 5, 'outer_cycle': outer}
+        for outer in [3, 9, 27, 81]
+    ]),
+    ('kks_graph', 'kks_graph', [
+        {'clique_size': 4, 'num_cliques': cliques} for cliques in [5, 9, 17, 33]
+    ]),
+    ('orthobicupola', 'orthobicupola', [
+        {'sides': sides} for sides in [3, 6, 12, 24]
+    ]),
+    ('chamfered_dodecahedron', 'chamfered_dodecahedron', [{}]),
+    ('rhombicuboctahedron', 'rhombicuboctahedron', [{}]),
+    ('hexagonal_pyramid_prism', 'hexagonal_pyramid_prism', [{}]),
+    ('tiered_pyramid_prism', 'tiered_pyramid_prism', [{}])
+]
+
+# Precision modes, as (name, arbitrary_precision) tuples
+MODES = [
+    ('float', False),
+    ('exact', True)
+]
+
+# Flip-flop checkers timed on the unique walk matrix
+FLIP_FLOPS = [
+    ('pair_wise', polygraph.pair_wise_flip_flopping),
+    ('dominant', polygraph.dominant_flip_flopping),
+    ('set_average', polygraph.set_average_flip_flopping),
+    ('each_class_max', polygraph.each_class_max)
+]
+
+# The set-average check takes 3^N steps for N walk classes, so it is
+# skipped above this many classes
+MAX_SET_AVERAGE_CLASSES = 12
+
+# Number of times each stage is timed, keeping the best
+REPEAT = 3
+
+
+def _best_time(function, repeat):
+    """Time a function, returning its best time and last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _benchmark_graph(name, params, arbitrary_precision, repeat):
+    """Time every stage of the analysis of one graph.
+
+    Returns
+    -------
+    Dict
+        The number of nodes and classes, the best time in seconds of
+        each stage, None for stages that were skipped or failed, and
+        the error raised by each stage that failed.
+    """
+    g = getattr(gen, name)(**params)
+
+    # Analyze walk classes
+    if type(g) is dict:
+        num_nodes = g['graph'].number_of_nodes()
+        seconds, w_obj = _best_time(
+            lambda: polygraph.spider_torus_walk_classes(
+                g,
+                arbitrary_precision
+            ),
+            repeat
+        )
+    else:
+        num_nodes = g.number_of_nodes()
+        seconds, w_obj = _best_time(
+            lambda: polygraph.walk_classes(
+                g,
+                arbitrary_precision=arbitrary_precision
+            ),
+            repeat
+        )
+    timings = {'walk_classes': seconds}
+
+    # Check flip-flopping properties
+    w = w_obj['uniq_matrix']
+    for key, ff in FLIP_FLOPS:
+        if key == 'set_average' and len(w) > MAX_SET_AVERAGE_CLASSES:
+            timings[key] = None
+            continue
+        timings[key] = _best_time(lambda: ff(w), repeat)[0]
+
+    # Solve the linear systems
+    errors = {}
+    for key, check in [
+            ('positive', polygraph.positive_linear_system_check),
+            ('nonnegative', polygraph.nonnegative_linear_system_check)]:
+        try:
+            timings[key] = _best_time(lambda: check(w_obj), repeat)[0]
+        except Exception as e:
+            timings[key] = None
+            errors[key] = '{}: {}'.format(type(e).__name__, e)
+
+    return {
+        'num_nodes': num_nodes,
+        'num_classes': int(w_obj['num_classes']),
+        'timings': timings,
+        'errors': errors
+    }
+
+
+def run(repeat=REPEAT, modes=MODES):
+    """Run every benchmark.
+
+    Parameters
+    ----------
+    repeat : Number
+        Number of times each stage is timed (default REPEAT).
+    modes : List
+        Precision modes, as in MODES.
+
+    Returns
+    -------
+    Dict
+        The environment, and a list of results, each holding the family,
+        generator, params, mode, sizes and timings of one graph.
+    """
+    results = []
+    for family, name, param_list in FAMILIES:
+        for params in param_list:
+            for mode, arbitrary_precision in modes:
+                result = {
+                    'family': family,
+                    'generator': name,
+                    'params': params,
+                    'mode': mode
+                }
+                result.update(_benchmark_graph(
+                    name,
+                    params,
+                    arbitrary_precision,
+                    repeat
+                ))
+                print('{} {} {}: {} nodes, walk_classes {:.4f}s'.format(
+                    name,
+                    params,
+                    mode,
+                    result['num_nodes'],
+                    result['timings']['walk_classes']
+                ))
+                results.append(result)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': sp.__version__,
+            'machine': platform.machine()
+        },
+        'results': results
+    }
+
+
+def _key(result):
+    """Identify the graph and mode of a result."""
+    return (
+        result['generator'],
+        json.dumps(result['params'], sort_keys=True),
+        result['mode']
+    )
+
+
+def scaling(benchmark):
+    """Fit the growth of each stage in the number of nodes.
+
+    Parameters
+    ----------
+    benchmark : Dict
+        Output of `run`.
+
+    Returns
+    -------
+    List
+        Rows of (family, mode, stage, exponent), where the time of the
+        stage grows like num_nodes ** exponent, fitted over the graphs
+        of a family with at least two sizes.
+    """
+    groups = {}
+    for result in benchmark['results']:
+        groups.setdefault((result['family'], result['mode']), []).append(
+            result
+        )
+
+    rows = []
+    for (family, mode), results in groups.items():
+        for stage in results[0]['timings']:
+            points = [
+                (result['num_nodes'], result['timings'][stage])
+                for result in results
+                if result['timings'].get(stage)
+            ]
+            if len(set(nodes for nodes, _ in points)) < 2:
+                continue
+            x, y = np.log(np.array(points, dtype=np.float64)).T
+            rows.append((family, mode, stage, np.polyfit(x, y, 1)[0]))
+    return rows
+
+
+def compare(benchmark, baseline, threshold):
+    """Find stages that got slower than a baseline.
+
+    Parameters
+    ----------
+    benchmark, baseline : Dict
+        Outputs of `run`.
+    threshold : Number
+        Ratio of times above which a stage is a regression.
+
+    Returns
+    -------
+    List
+        Rows of (generator, params, mode, stage, baseline time, time,
+        ratio) for every regression. A stage that fails where the
+        baseline succeeded is a regression, with its error in place of
+        the time and an infinite ratio.
+    """
+    previous = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in benchmark['results']:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        for stage, seconds in result['timings'].items():
+            old_seconds = old['timings'].get(stage)
+            error = result.get('errors', {}).get(stage)
+            if error is not None and old_seconds:
+                regressions.append((
+                    result['generator'],
+                    _key(result)[1],
+                    result['mode'],
+                    stage,
+                    old_seconds,
+                    error,
+                    float('inf')
+                ))
+                continue
+            if not seconds or not old_seconds:
+                continue
+            ratio = seconds / old_seconds
+            if ratio > threshold:
+                regressions.append((
+                    result['generator'],
+                    _key(result)[1],
+                    result['mode'],
+                    stage,
+                    old_seconds,
+                    seconds,
+                    ratio
+                ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--float-only', action='store_true')
+    parser.add_argument('--save', help='Write the results to a JSON file')
+    parser.add_argument('--compare', help='Compare to a saved JSON file')
+    parser.add_argument('--threshold', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    benchmark = run(args.repeat, MODES[:1] if args.float_only else MODES)
+
+    # Scaling curves
+    print(tabulate(
+        [
+            (result['generator'], json.dumps(result['params']),
+             result['mode'], result['num_nodes'], result['num_classes'],
+             *[result['timings'][stage] for stage in result['timings']])
+            for result in benchmark['results']
+        ],
+        tablefmt='grid',
+        headers=['Graph', 'Params', 'Mode', 'Nodes', 'Classes',
+                 *benchmark['results'][0]['timings']]
+    ))
+    errors = [
+        (result['generator'], json.dumps(result['params']), result['mode'],
+         stage, error)
+        for result in benchmark['results']
+        for stage, error in result.get('errors', {}).items()
+    ]
+    if errors:
+        print('Errors')
+        print(tabulate(
+            errors,
+            tablefmt='grid',
+            headers=['Graph', 'Params', 'Mode', 'Stage', 'Error']
+        ))
+    print('Scaling Exponents')
+    print(tabulate(
+        scaling(benchmark),
+        tablefmt='grid',
+        headers=['Family', 'Mode', 'Stage', 'Exponent']
+    ))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(benchmark, file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(benchmark, json.load(file), args.threshold)
+        if regressions:
+            print('Regressions')
+            print(tabulate(
+                regressions,
+                tablefmt='grid',
+                headers=['Graph', 'Params', 'Mode', 'Stage', 'Baseline',
+                         'Time', 'Ratio']
+            ))
+            return 1
+        print('No regressions above {} times the baseline'.format(
+            args.threshold
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
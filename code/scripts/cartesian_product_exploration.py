@@ -29,7 +29,7 @@ graphs = {
 
 flip_flops = [
     polygraph.pair_wise_flip_flopping,
-    polygraph.average_condition_flip_flopping,
+    polygraph.set_average_flip_flopping,
     polygraph.dominant_flip_flopping,
     polygraph.each_class_max
 ]
@@ -31,11 +31,14 @@ for graph_type, generator in GRAPHS.items():
     acrow = [graph_type]
     crow = [graph_type]
     for i in range(MIN, MAX_1):
-        graph = nx.cartesian_product(pyramid, generator(i))
-        w_obj = polygraph.walk_classes(graph)
+        product = gen.cartesian_product(pyramid, generator(i), operator=True)
+        w_obj = polygraph.walk_classes(
+            product['graph'],
+            operator=product['operator']
+        )
         w = w_obj['eig_matrix']
         pwrow.append(polygraph.pair_wise_flip_flopping(w))
-        acrow.append(polygraph.average_condition_flip_flopping(w))
+        acrow.append(polygraph.set_average_flip_flopping(w))
         crow.append(w_obj['num_classes'])
     pwff.append(pwrow)
     acff.append(acrow)
@@ -18,9 +18,9 @@ Outputs
 
 
 # Imports
-from code import generators as gen, polygraph, SPIDERDONUTS, verbose
+from code import deceptive, generators as gen, linalg, polygraph
+from code import SPIDERDONUTS, verbose
 from functools import partial
-from math import exp
 from tabulate import tabulate
 import io
 import logging
@@ -34,25 +34,6 @@ NUM_POINTS = 100
 MAX_POWER = 7
 
 
-def deceptive(y, coefficients):
-    """Deceptive function.
-
-    Parameters
-    ----------
-    y : Number
-        Eigenvalue of a graph
-    coefficients : list
-        List of coefficients
-
-    Returns
-    -------
-    Number
-        e^y + coefficients[0]*y^2 + ... coefficients[k-1]*y^k
-    """
-    poly = np.poly1d(np.concatenate((coefficients, [0, 0])))
-    return exp(y) + np.polyval(poly, y)
-
-
 # Get logger
 logger = logging.getLogger(SPIDERDONUTS)
 verbose(True)
@@ -70,7 +51,12 @@ graphs_generators = [
 ]
 
 # Min lambda
-min_lambda = [('Graph', 'Min g(lambda)', 'Number of Coefficients')]
+min_lambda = [(
+    'Graph',
+    'Min g(lambda)',
+    'Certified Min g(lambda)',
+    'Number of Coefficients'
+)]
 
 # Analyze graphs
 for name, generator in graphs_generators:
@@ -101,29 +87,41 @@ for name, generator in graphs_generators:
             res.message
         ))
     else:
-        # Take solutions as coefficients
-        coefficients = res.x[::-1]
+        # Take solutions, excluding gamma, as coefficients of
+        # lambda^2..lambda^(k+1)
+        coefficients = res.x[:-1]
 
         # Find graph eigenvalues
         logger.info('Finding graph eigenvalues')
-        eigenvalues = np.linalg.eigvalsh(nx.adjacency_matrix(graph).todense())
+        adj = nx.adjacency_matrix(graph)
+        eigenvalues = linalg.eigenvalues(adj)
 
         # Key points
-        max_eig = max(eigenvalues)
-        min_eig = min(eigenvalues)
+        max_eig = eigenvalues.max()
+        min_eig = eigenvalues.min()
         linspace = np.linspace(min_eig, max_eig, NUM_POINTS)
 
         # Evaluate the deceptive function at each eigenvalue
         logger.info('Evaluating deceptive function at eigenvalues')
-        eig_results = [deceptive(x, coefficients) for x in eigenvalues]
-        lin_results = [deceptive(x, coefficients) for x in linspace]
+        eig_results = deceptive.deceptive_values(coefficients, eigenvalues)
+        lin_results = deceptive.deceptive_values(coefficients, linspace)
+
+        # Bound the minimum over the eigenvalues, each known to within
+        # n * eps * ||A||, with ||A|| at most the largest degree
+        radius = (
+            adj.shape[0] * np.finfo(np.float64).eps *
+            abs(adj).sum(axis=1).max()
+        )
+        certified, _ = deceptive.eigenvalue_minimum(
+            coefficients,
+            eigenvalues,
+            radius
+        )
 
         # Append min result to table output
-        min_result, min_idx = min(
-            (val, idx)
-            for (idx, val) in enumerate(eig_results)
-        )
-        min_lambda.append((name, min_result, len(coefficients)))
+        min_idx = int(np.argmin(eig_results))
+        min_result = eig_results[min_idx]
+        min_lambda.append((name, min_result, certified, len(coefficients)))
 
         # Generate plot
         logger.info('Generating (lambda, g(lambda)) plot')
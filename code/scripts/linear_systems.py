@@ -3,12 +3,20 @@
 # and is Copyright (C) North Carolina State University, 2017. It is licensed
 # under the three-clause BSD license; see LICENSE.
 #
-"""Calculate Linear Systems `Wx = e` for pyramid prisms."""
+"""Calculate Linear Systems `Wx = e` for pyramid prisms.
+
+Results are written to OUTPUT, or to the path given as the first
+argument, as each graph is analyzed, one JSON object per line, so an
+interrupted sweep keeps its finished results. The file is overwritten
+on every run.
+"""
 
 # Imports
 from code import generators as gen
-from code import polygraph
+from code import pipeline
+from itertools import chain
 import numpy as np
+import sys
 from tabulate import tabulate
 
 
@@ -18,53 +26,59 @@ MIN_PYRAMID_LAYERS = 0
 MAX_PYRAMID_LAYERS = 3
 MIN_BCP_FACES = 3
 MAX_BCP_FACES = 6
+OUTPUT = 'docs/tables-and-figures/linear-systems.jsonl'
+NAMES = {
+    'pyramid_prism': 'Pyramid Prism ({faces}, {layers})',
+    'chamfered_dodecahedron': 'Chamfered Dodecahedron',
+    'orthobicupola': 'Orthobicupola ({sides})'
+}
 
 
-def _analyze(graph):
-    # Get the walk object
-    w_obj = polygraph.walk_classes(graph)
-
-    # Solve the linear system involving the eig_matrix
-    res = polygraph.positive_linear_system_check(w_obj)
-
+def _is_positive(result):
     # Check to see if x is positive
-    return np.all(res.x >= 0)
-
-
-# Accumulated results
-results = [[] for layer in range(MIN_PYRAMID_LAYERS, MAX_PYRAMID_LAYERS + 1)]
-
-# Check pyramid prisms
-for layers in range(MIN_PYRAMID_LAYERS, MAX_PYRAMID_LAYERS + 1):
-
-    # Get result index
-    idx = layers - MIN_PYRAMID_LAYERS
-
-    # Set Layer result header
-    results[idx].append('Pyramid Prism (4, {})'.format(layers))
-
-    # Create a pyramid prism
-    g = gen.pyramid_prism(NUM_PYRAMID_FACES, layers)
-
-    # Analyze g
-    results[idx].append(_analyze(g))
-
-
-# Check chamfered dodecahedron
-g = gen.chamfered_dodecahedron()
-results.append(['Chamfered Dodecahedron', _analyze(g)])
-
-
-# Check orthobicupola
-for faces in range(MIN_BCP_FACES, MAX_BCP_FACES + 1):
-    # Generate the graph
-    g = gen.orthobicupola(faces)
-
-    results.append([
-        'Orthobicupola ({})'.format(faces),
-        _analyze(g)
-    ])
+    positive = result.get('positive')
+    if positive is None or positive['x'] is None:
+        return False
+    return bool(np.all(np.asarray(positive['x']) >= 0))
+
+
+# Check pyramid prisms, the chamfered dodecahedron and orthobicupola
+results = pipeline.write_results(
+    chain(
+        pipeline.analyze_sweep(
+            gen.sweep(
+                'pyramid_prism',
+                faces=[NUM_PYRAMID_FACES],
+                layers=range(MIN_PYRAMID_LAYERS, MAX_PYRAMID_LAYERS + 1)
+            ),
+            'pyramid_prism'
+        ),
+        pipeline.analyze_sweep(
+            gen.sweep('chamfered_dodecahedron', params=[{}]),
+            'chamfered_dodecahedron'
+        ),
+        pipeline.analyze_sweep(
+            gen.sweep(
+                'orthobicupola',
+                sides=range(MIN_BCP_FACES, MAX_BCP_FACES + 1)
+            ),
+            'orthobicupola'
+        )
+    ),
+    sys.argv[1] if len(sys.argv) > 1 else OUTPUT,
+    append=False
+)
+
+# Accumulated (graph, is positive) rows
+rows = []
+for result in results:
+    row = [
+        NAMES[result['generator']].format(**result['params']),
+        _is_positive(result)
+    ]
+    print('{}: {}'.format(*row))
+    rows.append(row)
 
 
 # Print
-print(tabulate(results, tablefmt='grid', headers=['Graph', 'Is Positive']))
+print(tabulate(rows, tablefmt='grid', headers=['Graph', 'Is Positive']))
@@ -0,0 +1,50 @@
+#
+# This file is part of spiderdonuts, https://github.com/TheoryInPractice/spiderdonuts/,
+# and is Copyright (C) North Carolina State University, 2017. It is licensed
+# under the three-clause BSD license; see LICENSE.
+#
+"""Tests that scaled walk matrices give the classes found unscaled."""
+
+from code import generators as gen
+from code import polygraph
+import networkx as nx
+from tabulate import tabulate
+
+
+# Graphs with distinct walk classes whose scaled counts agree in their
+# leading digits, and the max_power each is analyzed at
+CASES = [
+    ('Lollipop 20, 12', nx.lollipop_graph(20, 12), 10),
+    ('Lollipop 20, 12', nx.lollipop_graph(20, 12), 12),
+    ('Pyramid prism 4, 40', gen.pyramid_prism(4, 40), 24)
+]
+SCALES = [None, polygraph.SPECTRAL, polygraph.COLUMN]
+
+
+rows = []
+failures = []
+for name, graph, max_power in CASES:
+    exact = polygraph.walk_classes(
+        graph,
+        max_power,
+        arbitrary_precision=True
+    )
+    row = [name, max_power, exact['num_classes']]
+    for scale in SCALES:
+        w_obj = polygraph.walk_classes(graph, max_power, scale=scale)
+        row.append(w_obj['num_classes'])
+        if w_obj['num_classes'] != exact['num_classes']:
+            failures.append((name, max_power, scale))
+    rows.append(row)
+
+print('Number of Walk Classes')
+print(tabulate(
+    rows,
+    tablefmt='grid',
+    headers=['Graph', 'Max Power', 'Exact', *[str(s) for s in SCALES]]
+))
+
+if failures:
+    raise Exception('Scaled classes differ from exact ones: {}'.format(
+        failures
+    ))
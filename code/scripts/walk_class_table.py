@@ -3,12 +3,18 @@
 # and is Copyright (C) North Carolina State University, 2017. It is licensed
 # under the three-clause BSD license; see LICENSE.
 #
-"""Generate a table of walk classes for pyramid prisms."""
+"""Generate a table of walk classes for pyramid prisms.
+
+Results are written to OUTPUT, or to the path given as the first
+argument, as each graph is analyzed, one JSON object per line, so an
+interrupted sweep keeps its finished results. The file is overwritten
+on every run.
+"""
 
 # Imports
 from tabulate import tabulate
-from code import polygraph, generators as gen
-import numpy as np
+from code import generators as gen, pipeline
+import sys
 
 
 # CONSTANTS
@@ -16,71 +22,61 @@ MIN_FACES = 2
 MAX_FACES = 8
 MIN_LAYERS = 0
 MAX_LAYERS = 5
-PWFF = 'Pair-Wise Flip-Flopping '
-DFF = 'Dominant Flip-Flopping'
-ACFF = 'Average-Condition Flip-Flopping'
-ECM = 'Each Class Max'
-
+OUTPUT = 'docs/tables-and-figures/walk-class-table.jsonl'
+PROPERTIES = [
+    ('pair_wise', 'Pair-Wise Flip-Flopping '),
+    ('dominant', 'Dominant Flip-Flopping'),
+    ('set_average', 'Average-Condition Flip-Flopping'),
+    ('each_class_max', 'Each Class Max')
+]
 
-# Number of rows and columns
-num_faces = (MAX_FACES - MIN_FACES) + 1
-num_layers = (MAX_LAYERS - MIN_LAYERS) + 1
 
-# Create results lists
-shape = (num_faces, num_layers)
-pwff = np.zeros(dtype=bool, shape=shape)
-dff = np.zeros(dtype=bool, shape=shape)
-acff = np.zeros(dtype=bool, shape=shape)
-ecm = np.zeros(dtype=bool, shape=shape)
+# Which properties hold, keyed by (faces, layers)
+flip_flops = {}
 
 # Check each combination
-for faces in range(MIN_FACES, MAX_FACES):
-    for layers in range(MIN_LAYERS, MAX_LAYERS):
-
-        # Generate the graph
-        g = gen.pyramid_prism(faces, layers)
-
-        # Analyze classes
-        w_obj = polygraph.walk_classes(g)
-
-        # Get the unique walk matrix w
-        w = w_obj['uniq_matrix']
-
-        # Get results row and cell
-        row = faces - MIN_FACES
-        col = layers - MIN_LAYERS
-
-        # Check which properties it holds
-        pwff[row][col] = polygraph.pair_wise_flip_flopping(w)
-        dff[row][col] = polygraph.dominant_flip_flopping(w)
-        acff[row][col] = polygraph.average_condition_flip_flopping(w)
-        ecm[row][col] = polygraph.each_class_max(w)
-
-
-def _annotate(array):
+sweep = gen.sweep(
+    'pyramid_prism',
+    faces=range(MIN_FACES, MAX_FACES + 1),
+    layers=range(MIN_LAYERS, MAX_LAYERS + 1)
+)
+results = pipeline.write_results(
+    pipeline.analyze_sweep(sweep, 'pyramid_prism', linear_systems=False),
+    sys.argv[1] if len(sys.argv) > 1 else OUTPUT,
+    append=False
+)
+for result in results:
+    params = result['params']
+    print('{} Faces, {} Layers: {}'.format(
+        params['faces'],
+        params['layers'],
+        result['error'] or result['flip_flops']
+    ))
+    flip_flops[params['faces'], params['layers']] = result.get(
+        'flip_flops',
+        {}
+    )
+
+
+def _annotate(key):
     # Annotate with number of faces
     arr = [
-        ['{} Faces'.format(i + MIN_FACES)] + row
-        for i, row in enumerate(array.tolist())
+        ['{} Faces'.format(faces)] + [
+            flip_flops[faces, layers].get(key)
+            for layers in range(MIN_LAYERS, MAX_LAYERS + 1)
+        ]
+        for faces in range(MIN_FACES, MAX_FACES + 1)
     ]
 
     # Annotate with number of layers
     arr.insert(0, [
         '',
-        *['{} Layers'.format(i + MIN_LAYERS) for i in range(num_layers)]
+        *['{} Layers'.format(i) for i in range(MIN_LAYERS, MAX_LAYERS + 1)]
     ])
 
     return arr
 
 # Print
-print(PWFF)
-print(tabulate(_annotate(pwff), tablefmt='grid'))
-
-print(DFF)
-print(tabulate(_annotate(dff), tablefmt='grid'))
-
-print(ACFF)
-print(tabulate(_annotate(acff), tablefmt='grid'))
-
-print(ECM)
-print(tabulate(_annotate(ecm), tablefmt='grid'))
+for key, title in PROPERTIES:
+    print(title)
+    print(tabulate(_annotate(key), tablefmt='grid'))